@@ -34,6 +34,11 @@ class FanqieLocalAdapter:
             headers["Authorization"] = f"Bearer {self.API_TOKEN}"
         return headers
 
+    def _timeout(self, ctx, default=10):
+        """微服务请求超时：跟随 crawler 传入的 FetchContext (截止时间快到时相应缩短)"""
+        if ctx is None: return default
+        return max(0.5, min(default, ctx.attempt_timeout()))
+
     def can_handle(self, url):
         return "fanqienovel.com" in url or "fqnovel.com" in url
 
@@ -64,7 +69,7 @@ class FanqieLocalAdapter:
         return None
     # adapters/fanqie_local_adapter.py -> FanqieLocalAdapter -> get_meta
 
-    def get_meta(self, crawler, url):
+    def get_meta(self, crawler, url, ctx=None):
         """
         利用微服务 /get_detail 接口获取超详细元数据 (含标签)
         """
@@ -72,7 +77,7 @@ class FanqieLocalAdapter:
         if not book_id:
             item_id = self._get_item_id(url)
             if item_id:
-                book_id = self._resolve_book_id_by_item(crawler, item_id)
+                book_id = self._resolve_book_id_by_item(crawler, item_id, ctx)
         
         if not book_id: return None
 
@@ -81,7 +86,7 @@ class FanqieLocalAdapter:
                 f"{self.API_HOST}/get_catalog", 
                 params={"book_id": book_id}, 
                 headers=self._get_headers(),
-                timeout=10
+                timeout=self._timeout(ctx)
             )
             
             if resp.status_code in [401, 403]:
@@ -157,7 +162,7 @@ class FanqieLocalAdapter:
             return None
         
         return None
-    def _resolve_book_id_by_item(self, crawler, item_id):
+    def _resolve_book_id_by_item(self, crawler, item_id, ctx=None):
         """
         [增强版] 通过章节 ID 反查书籍 ID
         策略 A: 调用公共 API (directory/detail)
@@ -169,7 +174,7 @@ class FanqieLocalAdapter:
         try:
             print(f"[FanqieLocal] 正在通过 API 反查 BookID: {item_id}")
             # 使用 crawler 发送请求以利用其 header/proxy 配置
-            json_str = crawler._fetch_page_smart(api_url)
+            json_str = crawler._fetch_page_smart(api_url, ctx=ctx)
             
             if json_str:
                 data = json.loads(json_str)
@@ -188,7 +193,7 @@ class FanqieLocalAdapter:
         page_url = f"https://fanqienovel.com/reader/{item_id}"
         try:
             print(f"[FanqieLocal] API 失败，尝试解析网页源码: {page_url}")
-            html = crawler._fetch_page_smart(page_url)
+            html = crawler._fetch_page_smart(page_url, ctx=ctx)
             if html:
                 # 1. 尝试匹配 window.__INITIAL_STATE__ 里的 bookId
                 # 格式通常是: "bookId":"123456"
@@ -211,7 +216,7 @@ class FanqieLocalAdapter:
 
         return None
 
-    def _fetch_toc_list(self, book_id):
+    def _fetch_toc_list(self, book_id, ctx=None):
         """
         从微服务获取标准化的目录列表
         返回: [{'item_id': '...', 'title': '...', 'url': '...'}, ...]
@@ -221,7 +226,7 @@ class FanqieLocalAdapter:
                 f"{self.API_HOST}/get_catalog", 
                 params={"book_id": book_id}, 
                 headers=self._get_headers(),
-                timeout=10
+                timeout=self._timeout(ctx)
             )
             
             if resp.status_code in [401, 403]:
@@ -252,7 +257,7 @@ class FanqieLocalAdapter:
             print(f"[FanqieLocal] 获取目录失败: {e}")
             return []
 
-    def get_toc(self, crawler, toc_url):
+    def get_toc(self, crawler, toc_url, ctx=None):
         """
         获取目录页数据
         """
@@ -263,12 +268,12 @@ class FanqieLocalAdapter:
         if not book_id:
             item_id = self._get_item_id(toc_url)
             if item_id:
-                book_id = self._resolve_book_id_by_item(crawler, item_id)
+                book_id = self._resolve_book_id_by_item(crawler, item_id, ctx)
         
         if not book_id: return None
 
         # 3. 获取列表
-        chapters = self._fetch_toc_list(book_id)
+        chapters = self._fetch_toc_list(book_id, ctx)
         
         # 4. [修复] 获取真实书名 (从微服务详情接口)
         book_title = "番茄小说"  # 默认值
@@ -277,7 +282,7 @@ class FanqieLocalAdapter:
                 f"{self.API_HOST}/get_detail", 
                 params={"book_id": book_id}, 
                 headers=self._get_headers(),
-                timeout=10
+                timeout=self._timeout(ctx)
             )
             
             if resp.status_code in [401, 403]:
@@ -304,7 +309,7 @@ class FanqieLocalAdapter:
             'page_type': 'toc'  # [智能检测] 明确标记这是目录页
         }
 
-    def run(self, crawler, url):
+    def run(self, crawler, url, ctx=None):
         """
         获取正文 (包含自动上下文分析)
         """
@@ -322,7 +327,7 @@ class FanqieLocalAdapter:
                     "image_mode": 0
                 },
                 headers=self._get_headers(),
-                timeout=10
+                timeout=self._timeout(ctx)
             )
             
             if resp.status_code in [401, 403]:
@@ -352,7 +357,7 @@ class FanqieLocalAdapter:
         book_id = self._get_book_id(url) # URL里通常没有
         print("ttttttt", book_id)
         if not book_id:
-            book_id = self._resolve_book_id_by_item(crawler, current_item_id)
+            book_id = self._resolve_book_id_by_item(crawler, current_item_id, ctx)
             
         prev_url = None
         next_url = None
@@ -369,7 +374,7 @@ class FanqieLocalAdapter:
                     f"{self.API_HOST}/get_detail", 
                     params={"book_id": book_id}, 
                     headers=self._get_headers(),
-                    timeout=10
+                    timeout=self._timeout(ctx)
                 )
                 
                 if resp.status_code in [401, 403]:
@@ -389,7 +394,7 @@ class FanqieLocalAdapter:
                 print(f"[FanqieLocal] 获取书名失败: {e}")
             
             # 获取全书目录列表
-            toc_list = self._fetch_toc_list(book_id)
+            toc_list = self._fetch_toc_list(book_id, ctx)
             
             # 在列表中定位当前章节
             for i, chapter in enumerate(toc_list):
@@ -41,8 +41,8 @@ class SxgreadAdapter:
                 
         return None
 
-    def get_toc(self, crawler, toc_url):
-        html = crawler._fetch_page_smart(toc_url)
+    def get_toc(self, crawler, toc_url, ctx=None):
+        html = crawler._fetch_page_smart(toc_url, ctx=ctx)
         if not html: return None
         soup = BeautifulSoup(html, 'html.parser')
         
@@ -107,14 +107,14 @@ class SxgreadAdapter:
         else:
             print("[SxgreadAdapter] 未找到 #newlist，尝试通用解析")
             # 如果改版了找不到 newlist，回退到通用逻辑
-            return crawler._general_toc_logic(toc_url)
+            return crawler._general_toc_logic(toc_url, ctx=ctx)
     # === [新增] 获取元数据函数 ===
-    def get_meta(self, crawler, url):
+    def get_meta(self, crawler, url, ctx=None):
         """
         从书香阁目录页提取封面、作者、简介和标签
         """
         # 1. 请求页面
-        html = crawler._fetch_page_smart(url)
+        html = crawler._fetch_page_smart(url, ctx=ctx)
         if not html: return None
         soup = BeautifulSoup(html, 'html.parser')
         print(url)
@@ -179,8 +179,8 @@ class SxgreadAdapter:
             meta['tags'].append("连载")
 
         return meta
-    def run(self, crawler, url):
-        html = crawler._fetch_page_smart(url)
+    def run(self, crawler, url, ctx=None):
+        html = crawler._fetch_page_smart(url, ctx=ctx)
         if not html: return None
         
         soup = BeautifulSoup(html, 'html.parser')
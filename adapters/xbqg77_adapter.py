@@ -6,6 +6,14 @@ class Xbqg77Adapter:
     """
     新笔趣阁 (xbqg77.com) 专属适配器
     """
+    # 流式提取目标声明：标题 h2 / 正文 article / 翻页在 .dir 容器里
+    stream_targets = {
+        'title': ['h2'],
+        'content': ['article#article', 'article'],
+        'nav': ['.dir'],
+        'drop': ['script', '.ad', '.desc'],
+    }
+
     def can_handle(self, url):
         # 只要 URL 包含 xbqg77.com，就由该插件接管
         return "xbqg77.com" in url
@@ -27,9 +35,9 @@ class Xbqg77Adapter:
             return 'toc'
         return 'unknown'
 
-    def get_toc(self, crawler, toc_url):
+    def get_toc(self, crawler, toc_url, ctx=None):
         """解析目录逻辑"""
-        html = crawler._fetch_page_smart(toc_url)
+        html = crawler._fetch_page_smart(toc_url, ctx=ctx)
         if not html: return None
         soup = BeautifulSoup(html, 'html.parser')
         
@@ -55,7 +63,7 @@ class Xbqg77Adapter:
             'page_type': 'toc'  # [智能检测] 明确标记这是目录页
         }
 
-    def run(self, crawler, url):
+    def run(self, crawler, url, ctx=None):
         """解析正文逻辑（含分页缝合）"""
         combined_content = []
         current_url = url
@@ -66,40 +74,54 @@ class Xbqg77Adapter:
         # URL 格式: https://www.xbqg77.com/52449/1
         path_parts = url.rstrip('/').split('/')
         book_id = path_parts[-2] if len(path_parts) >= 2 else ""
+        prefetched = {}
 
         for i in range(5): # 最多缝合5页
-            html = crawler._fetch_page_smart(current_url)
+            html = prefetched.pop(current_url, None) or crawler._fetch_page_smart(current_url, ctx=ctx)
             if not html: break
-            soup = BeautifulSoup(html, 'html.parser')
 
-            # 1. 标题识别：该站 h2 是最纯净的
-            page_title = ""
-            h2 = soup.find('h2')
-            if h2: page_title = h2.get_text(strip=True)
-            
+            # 优先流式提取 (.dir 里凑齐 下一页/章 + 目录 即停止读取)，失败再走完整 soup
+            ex = None
+            if getattr(crawler, 'streaming_extract', False):
+                first = (i == 0)
+                def nav_ready(e, first=first):
+                    texts = ''.join(t for t, _ in e.links)
+                    return "下一" in texts and "目录" in texts and (not first or "上一章" in texts)
+                ex = crawler.stream_extract(html, stop_when=nav_ready, **self.stream_targets)
+
+            if ex:
+                page_title = ex.title or ""
+                raw_text = ex.content
+                nav_links = ex.links
+            else:
+                soup = BeautifulSoup(html, 'html.parser')
+                # 1. 标题识别：该站 h2 是最纯净的
+                page_title = ""
+                h2 = soup.find('h2')
+                if h2: page_title = h2.get_text(strip=True)
+                # 2. 正文提取：该站使用 article 标签
+                raw_text = None
+                article = soup.find('article', id='article') or soup.find('article')
+                if article:
+                    # 移除 article 内部的广告和干扰
+                    for junk in article.select('script, .ad, .desc'): junk.decompose()
+                    raw_text = article.get_text('\n')
+                nav_links = [(a.get_text(strip=True), a.get('href')) for a in soup.select('.dir a')] # 该站翻页在 .dir 容器里
+
             if i == 0:
                 meta['title'] = page_title or "加载失败"
-            
-            # 2. 正文提取：该站使用 article 标签
-            article = soup.find('article', id='article') or soup.find('article')
-            if article:
-                # 移除 article 内部的广告和干扰
-                for junk in article.select('script, .ad, .desc'): junk.decompose()
-                
+
+            if raw_text:
                 # 提取行并清洗
-                raw_text = article.get_text('\n')
                 lines = crawler._clean_text_lines(raw_text)
-                
                 # [专项清洗] 移除该站特有的 .la 干扰符
                 clean_lines = [re.sub(r'\.la', '', line).strip() for line in lines if line.strip()]
                 combined_content.extend(clean_lines)
 
             # 3. 寻找导航
             next_page = None
-            nav_links = soup.select('.dir a') # 该站翻页在 .dir 容器里
-            for a in nav_links:
-                txt = a.get_text(strip=True)
-                href = a.get('href')
+            for txt, href in nav_links:
+                if not href: continue
                 full_url = urljoin(current_url, href)
                 
                 if "下一页" in txt or "下一章" in txt:
@@ -113,6 +135,11 @@ class Xbqg77Adapter:
                 elif "目录" in txt and i == 0:
                     meta['toc_url'] = full_url
 
+            # 首页能推算出所有分页时，剩余页并发拉取 (依赖 crawler 的共享线程池)
+            if i == 0 and next_page and getattr(crawler, 'parallel_pages', False):
+                planned = [u for u in crawler._plan_page_urls(ex.hint_text() if ex else soup, next_page, 5) if u not in visited]
+                prefetched = crawler._prefetch_pages(planned, ctx=ctx)
+
             if next_page and next_page not in visited:
                 current_url = next_page
                 visited.add(next_page)
@@ -0,0 +1,215 @@
+"""
+紧凑目录 (CompactToc)
+
+万章级目录如果用 list[dict] 存放，每章都要带一份 id/name/raw_title/title/url 的键和完整绝对 URL，
+缓存命中时还要整体 json 解码。这里改为按列存储：
+- id 放在 array('l') 里
+- 标题 sys.intern 驻留，name 与 title 相同时不重复存
+- URL 只存公共前缀之后的部分
+对外仍然表现为"章节字典列表"：支持 len / 下标 / 负下标 / 切片 / 迭代 / reversed，
+模板和接口无需改动；需要真正的 list 时调用 to_list()。
+下标 / 迭代得到的章节字典是按列现拼的只读行 (ChapterRow)，原地修改写不回目录，所以直接报错；
+要改请先 to_list() 或 dict(row)。
+"""
+import os
+import sys
+from array import array
+
+PAYLOAD_MARK = "__compact_toc__"
+# 章节数少于这个值时没有压缩的必要，保持原样
+MIN_COMPACT_SIZE = 200
+
+_STD_KEYS = ('id', 'name', 'raw_title', 'title', 'url')
+
+
+class ChapterRow(dict):
+    """CompactToc 的只读章节行：仍是 dict (可 json 化 / jsonify)，但任何写操作都抛 TypeError"""
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("CompactToc 的章节行是只读的，修改前请先 to_list() 或 dict(row)")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    update = setdefault = pop = popitem = clear = _readonly
+
+    def __reduce__(self):
+        # pickle / deepcopy 默认会逐项 __setitem__，这里还原成普通字典
+        return dict, (dict(self),)
+
+
+class CompactToc:
+    __slots__ = ('prefix', 'keys', 'ids', 'titles', 'names', 'suffixes', 'extras')
+
+    def __init__(self, prefix, keys, ids, titles, names, suffixes, extras=None):
+        self.prefix = prefix
+        self.keys = tuple(keys)        # 这份目录里出现的标准键 (保持原字典的键集合)
+        self.ids = ids                 # array('l')
+        self.titles = titles           # raw_title (或 title)
+        self.names = names             # '' 表示与 title 相同
+        self.suffixes = suffixes       # url 去掉 prefix 之后的部分
+        self.extras = extras or {}     # {index: {非标准键 / 与 raw_title 不同的 title}}
+
+    # ---------- 构建 ----------
+    @classmethod
+    def from_chapters(cls, chapters):
+        """
+        从章节字典列表构建；键集合不一致或缺少 url 时返回 None (调用方继续用原列表)
+        """
+        if not chapters: return None
+        keys = tuple(k for k in _STD_KEYS if k in chapters[0])
+        if 'url' not in keys: return None
+
+        urls = []
+        for c in chapters:
+            u = c.get('url')
+            if not isinstance(u, str): return None
+            urls.append(u)
+        prefix = os.path.commonprefix(urls)
+        # 前缀截到最后一个 '/'，避免把章节号的公共数字也切进去
+        prefix = prefix[:prefix.rfind('/') + 1] if '/' in prefix else ''
+        cut = len(prefix)
+
+        ids = array('l')
+        titles, names, suffixes, extras = [], [], [], {}
+        intern = sys.intern
+        for i, c in enumerate(chapters):
+            if tuple(k for k in _STD_KEYS if k in c) != keys: return None
+            raw = c.get('raw_title', c.get('title')) or ''
+            if not isinstance(raw, str): return None
+            cid = c.get('id', 0)
+            try: ids.append(int(cid))
+            except (TypeError, ValueError, OverflowError): return None
+            titles.append(intern(raw))
+            name = c.get('name', '')
+            names.append('' if name == raw else intern(str(name)))
+            suffixes.append(urls[i][cut:])
+
+            extra = {k: v for k, v in c.items() if k not in _STD_KEYS}
+            if 'title' in c and 'raw_title' in c and c['title'] != raw: extra['title'] = c['title']
+            if extra: extras[i] = extra
+        return cls(prefix, keys, ids, titles, names, suffixes, extras)
+
+    # ---------- 序列化 ----------
+    def to_payload(self):
+        """列式 JSON 结构 (键只出现一次，解码对象数约为原来的 1/5)"""
+        return {
+            PAYLOAD_MARK: 1,
+            'prefix': self.prefix,
+            'keys': list(self.keys),
+            'ids': self.ids.tolist(),
+            'titles': self.titles,
+            'names': self.names,
+            'urls': self.suffixes,
+            'extras': {str(k): v for k, v in self.extras.items()},
+        }
+
+    @classmethod
+    def from_payload(cls, payload):
+        intern = sys.intern
+        return cls(
+            payload.get('prefix', ''),
+            payload.get('keys') or _STD_KEYS,
+            array('l', payload.get('ids') or []),
+            [intern(t) for t in payload.get('titles') or []],
+            [intern(n) if n else '' for n in payload.get('names') or []],
+            payload.get('urls') or [],
+            {int(k): v for k, v in (payload.get('extras') or {}).items()},
+        )
+
+    @staticmethod
+    def is_payload(obj):
+        return isinstance(obj, dict) and obj.get(PAYLOAD_MARK) == 1
+
+    # ---------- 列表视图 ----------
+    def __len__(self):
+        return len(self.suffixes)
+
+    def __bool__(self):
+        return bool(self.suffixes)
+
+    def _row(self, i, factory=ChapterRow):
+        raw = self.titles[i]
+        items = []
+        for k in self.keys:
+            if k == 'id': items.append(('id', self.ids[i]))
+            elif k == 'name': items.append(('name', self.names[i] or raw))
+            elif k == 'raw_title': items.append(('raw_title', raw))
+            elif k == 'title': items.append(('title', raw))
+            elif k == 'url': items.append(('url', self.prefix + self.suffixes[i]))
+        extra = self.extras.get(i)
+        if extra: items.extend(extra.items())
+        return factory(items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(*index.indices(len(self)))]
+        n = len(self)
+        if index < 0: index += n
+        if not 0 <= index < n: raise IndexError("chapter index out of range")
+        return self._row(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._row(i)
+
+    def __reversed__(self):
+        for i in range(len(self) - 1, -1, -1):
+            yield self._row(i)
+
+    def url_at(self, i):
+        """只取 URL，不构建整行字典"""
+        return self.prefix + self.suffixes[i]
+
+    def to_list(self):
+        """展开为普通 (可修改的) 字典列表"""
+        return [self._row(i, dict) for i in range(len(self))]
+
+    def __repr__(self):
+        return f"<CompactToc {len(self)} chapters prefix={self.prefix!r}>"
+
+
+def pack_toc(data):
+    """
+    目录数据 -> 可 json 化的结构 (章节足够多时换成列式 payload)
+    不是目录 (没有 chapters 列表) 的数据原样返回
+    """
+    if not isinstance(data, dict): return data
+    chapters = data.get('chapters')
+    if isinstance(chapters, CompactToc):
+        packed = dict(data)
+        packed['chapters'] = chapters.to_payload()
+        return packed
+    if isinstance(chapters, list) and len(chapters) >= MIN_COMPACT_SIZE:
+        toc = CompactToc.from_chapters(chapters)
+        if toc is not None:
+            packed = dict(data)
+            packed['chapters'] = toc.to_payload()
+            return packed
+    return data
+
+
+def unpack_toc(data, as_list=False):
+    """
+    pack_toc 的逆操作：列式 payload -> CompactToc (as_list=True 时展开为普通列表)
+    """
+    if not isinstance(data, dict): return data
+    chapters = data.get('chapters')
+    if CompactToc.is_payload(chapters):
+        toc = CompactToc.from_payload(chapters)
+        data['chapters'] = toc.to_list() if as_list else toc
+    return data
+
+
+def compact_chapters(chapters):
+    """章节列表转 CompactToc；太短或结构不统一时原样返回"""
+    if isinstance(chapters, CompactToc): return chapters
+    if isinstance(chapters, list) and len(chapters) >= MIN_COMPACT_SIZE:
+        toc = CompactToc.from_chapters(chapters)
+        if toc is not None: return toc
+    return chapters
+
+
+def toc_json_default(obj):
+    """json.dump(default=...) 钩子：CompactToc 落盘为列式 payload"""
+    if isinstance(obj, CompactToc): return obj.to_payload()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
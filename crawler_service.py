@@ -75,6 +75,7 @@ sys.modules['managers.cache'] = MockManagers.cache
 # 导入爬虫核心 (必须在注入之后)
 # =========================================================
 from spider_core import crawler_instance as crawler, searcher
+from compact_toc import pack_toc
 
 # === 配置区 ===
 MASTER_URL = os.environ.get("MASTER_URL", "https://book.ztrztr.top")
@@ -182,11 +183,13 @@ def do_work(task):
         os.environ['FORCE_LOCAL_CRAWL'] = '1'
         
         try:
-            # 强制爬取逻辑
+            # 强制爬取逻辑 (Master 转发来的多是读者正在等的请求，按 interactive 排队)
             if endpoint == 'run':
-                data = crawler.run(url)
+                with crawler.scheduler.context('interactive'):
+                    data = crawler.run(url)
             elif endpoint == 'toc':
-                data = crawler.get_toc(url)
+                with crawler.scheduler.context('interactive'):
+                    data = crawler.get_toc(url)
             elif endpoint == 'search':
                 data = searcher.search_bing(payload.get('keyword'))
         finally:
@@ -199,6 +202,8 @@ def do_work(task):
         if data:
             # 数据清洗：防止任何非标对象混入
             # 有时候 soup 对象或者 lxml 对象会混进来，导致 JSON 序列化失败
+            # 大目录按列式结构回传，体积更小，服务端 get_toc 会还原
+            if endpoint == 'toc': data = pack_toc(data)
             try:
                 json.dumps(data) 
             except TypeError:
@@ -5,7 +5,6 @@ from dotenv import load_dotenv # 1. 引入这个库
 # 2. 【关键】必须在导入其他本地模块（如 routes, managers）之前加载 .env
 # 否则 routes/core_bp.py 初始化时读不到环境变量
 load_dotenv() 
-import sqlite3
 from flask import Flask, render_template, request, jsonify, session
 from datetime import timedelta
 import threading
@@ -21,8 +20,20 @@ from routes.admin_bp import admin_bp
 from routes.pro_bp import pro_bp
 # [新增] 引入解析函数
 from spider_core import parse_chapter_id
+from flask.json.provider import DefaultJSONProvider
+from compact_toc import CompactToc
+
+
+class AppJSONProvider(DefaultJSONProvider):
+    """jsonify 时把 CompactToc 展开成普通章节列表，接口返回格式不变"""
+    @staticmethod
+    def default(o):
+        if isinstance(o, CompactToc): return o.to_list()
+        return DefaultJSONProvider.default(o)
+
 
 app = Flask(__name__)
+app.json = AppJSONProvider(app)
 
 # 这里也能正确读到 KEY 了
 secret_key = os.environ.get('FLASK_SECRET_KEY')
@@ -39,6 +50,17 @@ app.config['SESSION_COOKIE_SECURE'] = os.environ.get('SESSION_COOKIE_SECURE', '0
 app.register_blueprint(core_bp)
 app.register_blueprint(admin_bp)
 app.register_blueprint(pro_bp)
+# 请求结束时把池化的 SQLite 连接还回连接池
+app.teardown_appcontext(managers.close_db)
+
+# 抓取调度：请求线程里的抓取按 interactive 排队 (其余线程默认 update)，请求结束时清掉，复用的线程不会带到下一个请求
+@app.before_request
+def mark_interactive_crawl():
+    crawler_instance.scheduler.enter('interactive', session.get('user', {}).get('username'))
+
+@app.teardown_request
+def clear_crawl_priority(e=None):
+    crawler_instance.scheduler.leave()
 
 # 基础 CSRF 防护：仅校验同源 Origin/Referer（存在时）
 @app.before_request
@@ -96,10 +118,8 @@ def schedule_auto_check():
             db_files = [f for f in os.listdir(managers.USER_DATA_DIR) if f == 'data.sqlite']
             
             for db_f in db_files:
-                db_path = os.path.join(managers.USER_DATA_DIR, db_f)
                 try:
-                    conn = sqlite3.connect(db_path)
-                    conn.row_factory = sqlite3.Row
+                    conn = managers.get_db()  # 池化连接，已是 sqlite3.Row
                     cursor = conn.cursor()
                     
                     # 检查表是否存在
@@ -140,7 +160,8 @@ def schedule_auto_check():
 
                             # === 爬取最新章节 ===
                             # 1. 获取目录
-                            latest_chap = crawler_instance.get_latest_chapter(toc_url, no_cache=True)
+                            with crawler_instance.scheduler.context('update'):
+                                latest_chap = crawler_instance.get_latest_chapter(toc_url, no_cache=True)
                             
                             if latest_chap:
                                 remote_title = latest_chap.get('title', '')
@@ -156,6 +177,10 @@ def schedule_auto_check():
                                 if remote_seq == -1 and 0 < raw_id < 10000:
                                      remote_seq = raw_id
                                 elif remote_seq == -1:
+                                     # [新增] 标题里没有章节号时，用目录索引里的位置作为序号
+                                     loc = crawler_instance.toc_index.locate(toc_url, latest_chap.get('url', ''))
+                                     if loc: remote_seq = loc['pos'] + 1
+                                if remote_seq == -1:
                                      # 如果解析不出章节号，且 raw_id 太大或为 0，直接跳过此次检查
                                      print(f"   ⚠️ [{key}] 无法识别章节号: title={remote_title}, raw_id={raw_id}")
                                      continue
@@ -5,32 +5,38 @@ import hashlib
 import time
 import uuid
 import re
+import atexit
+import signal
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask import session, g, has_request_context
 from shared import USER_DATA_DIR, CACHE_DIR, DL_DIR
 import shared
+from compact_toc import CompactToc, pack_toc, unpack_toc, compact_chapters, toc_json_default
+from sqlite_pool import get_pool
 
 # ==========================================
 # 0. 数据库核心 (SQL版)
 # ==========================================
 DB_PATH = os.path.join(USER_DATA_DIR, "data.sqlite")
+# WAL + pragma + 连接复用见 sqlite_pool.py；第一次取连接时开启 WAL
+_db_pool = get_pool(DB_PATH, row_factory=sqlite3.Row)
 
 def get_db():
-    """获取数据库连接"""
-    if has_request_context():
-        if 'db' not in g:
-            g.db = sqlite3.connect(DB_PATH)
-            g.db.row_factory = sqlite3.Row
-        return g.db
-    else:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
+    """
+    获取数据库连接 (按线程复用的池化连接，请求结束时由 close_db 归还)
+    注意：同一线程里的所有调用拿到的是同一个连接、共享同一个事务，这点和原先每次 connect 不同：
+    - conn.close() 不会真的关闭，但会回滚本线程所有未提交的写入 (包括调用方的)
+    - with get_db() as conn: 块内抛异常同样回滚整个事务，块正常结束则连调用方未提交的写入一起提交
+    所以会被别处调用的辅助函数不要 close() / commit() 连接；写入放在自己的 with get_db() 块里一次完成
+    """
+    return _db_pool.get()
 
 def close_db(e=None):
-    db = g.pop('db', None)
-    if db is not None: db.close()
+    g.pop('db', None)
+    _db_pool.release()
 
 def get_current_user():
     if not has_request_context():
@@ -62,7 +68,6 @@ class BaseJsonManager:
             conn = get_db()
             conn.execute("REPLACE INTO user_modules (username, module_type, json_content) VALUES (?, ?, ?)", (u, self.module_type, json_str))
             conn.commit()
-            if not has_request_context(): conn.close()
         except Exception as e:
             print(f"DB Save Error ({self.module_type}): {e}")
 
@@ -100,118 +105,289 @@ class RoleManager:
         self._save_config(data)
 
 # ==========================================
-# 3. 业务管理器 (继承 BaseJsonManager)
+# 3. 业务管理器 (行级表)
 # ==========================================
+# 原先每个模块是 user_modules 里的一整块 JSON，改一条记录就要整块读-解码-改-编码-重写。
+# 现在每个模块拆成带索引的行级表：日常修改是一条小 upsert；load()/save() 仍按原 JSON 结构
+# 组装 / 整体替换，直接调用 load()/save() 的旧代码不受影响。旧数据由 migrate_module_blobs() 迁移。
+
+class BaseTableManager(BaseJsonManager):
+    SCHEMA = ()     # 建表 / 建索引语句
+    TABLES = ()     # save() 整体替换时要清空的表
+
+    def __init__(self, module_type):
+        super().__init__(module_type)
+        self._ensure_tables()
+
+    def _ensure_tables(self):
+        try:
+            with get_db() as conn:
+                for ddl in self.SCHEMA: conn.execute(ddl)
+        except Exception as e:
+            print(f"[DB Init] {self.module_type} 建表失败: {e}")
+
+    def load(self, username=None):
+        u = username or get_current_user()
+        try:
+            return self._load_rows(get_db(), u)
+        except Exception as e:
+            print(f"DB Load Error ({self.module_type}): {e}")
+            return {}
+
+    def save(self, data, username=None):
+        u = username or get_current_user()
+        try:
+            with get_db() as conn:
+                self._replace_rows(conn, u, data or {})
+        except Exception as e:
+            print(f"DB Save Error ({self.module_type}): {e}")
+
+    def _replace_rows(self, conn, u, data):
+        for table in self.TABLES:
+            conn.execute(f"DELETE FROM {table} WHERE username=?", (u,))
+        self._insert_rows(conn, u, data)
+
+
+class HistoryManager(BaseTableManager):
+    LIMIT = 50  # 保留最近50条
+    SCHEMA = ('''CREATE TABLE IF NOT EXISTS user_history (
+                    username TEXT NOT NULL,
+                    book_key TEXT NOT NULL,
+                    title TEXT,
+                    url TEXT,
+                    book_name TEXT,
+                    timestamp INTEGER,
+                    PRIMARY KEY (username, book_key)
+                )''',)
+    TABLES = ('user_history',)
 
-class HistoryManager(BaseJsonManager):
     def __init__(self): super().__init__('history')
 
     def add_record(self, book_key, title, url, book_name=None):
-        data = self.load()
-        if "records" not in data: data["records"] = []
-        # 去重并置顶
-        records = [r for r in data["records"] if r.get('key') != book_key]
-        records.insert(0, {
-            "key": book_key,
-            "title": title,
-            "url": url,
-            "timestamp": int(time.time()),
-            "book_name": book_name or book_key
-        })
-        data["records"] = records[:50] # 保留最近50条
-        self.save(data)
+        u = get_current_user()
+        try:
+            with get_db() as conn:
+                # REPLACE 会给记录分配新的 rowid，rowid 越大越新 (去重并置顶)
+                conn.execute("REPLACE INTO user_history (username, book_key, title, url, book_name, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                             (u, book_key, title, url, book_name or book_key, int(time.time())))
+                conn.execute("DELETE FROM user_history WHERE username=? AND rowid NOT IN "
+                             "(SELECT rowid FROM user_history WHERE username=? ORDER BY rowid DESC LIMIT ?)", (u, u, self.LIMIT))
+        except Exception as e:
+            print(f"DB Save Error (history): {e}")
+
+    def _load_rows(self, conn, u):
+        rows = conn.execute("SELECT book_key, title, url, timestamp, book_name FROM user_history WHERE username=? ORDER BY rowid DESC", (u,)).fetchall()
+        return {"records": [{"key": r[0], "title": r[1], "url": r[2], "timestamp": r[3], "book_name": r[4]} for r in rows]}
+
+    def _insert_rows(self, conn, u, data):
+        records = [r for r in data.get("records", []) if r.get('key')][:self.LIMIT]
+        # 倒序插入，列表第一条 rowid 最大；同一本书出现多次时保留靠前的那条
+        conn.executemany("REPLACE INTO user_history (username, book_key, title, url, book_name, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                         [(u, r['key'], r.get('title'), r.get('url'), r.get('book_name') or r['key'], r.get('timestamp'))
+                          for r in reversed(records)])
 
     def get_history(self): return self.load().get("records", [])
     def clear(self): self.save({"records": []})
 
-class IsolatedBooklistManager(BaseJsonManager):
+class IsolatedBooklistManager(BaseTableManager):
+    SCHEMA = ('''CREATE TABLE IF NOT EXISTS user_booklists (
+                    username TEXT NOT NULL,
+                    list_id TEXT NOT NULL,
+                    name TEXT,
+                    PRIMARY KEY (username, list_id)
+                )''',
+              '''CREATE TABLE IF NOT EXISTS user_booklist_books (
+                    username TEXT NOT NULL,
+                    list_id TEXT NOT NULL,
+                    book_key TEXT NOT NULL,
+                    status TEXT,
+                    data TEXT,  -- book_data 其余字段 (JSON)
+                    PRIMARY KEY (username, list_id, book_key)
+                )''')
+    TABLES = ('user_booklists', 'user_booklist_books')
+
     def __init__(self): super().__init__('booklists')
 
     def add_list(self, name):
-        data = self.load()
+        u = get_current_user()
         list_id = str(int(time.time()))
-        data[list_id] = {"name": name, "books": []}
-        self.save(data)
+        with get_db() as conn:
+            conn.execute("DELETE FROM user_booklist_books WHERE username=? AND list_id=?", (u, list_id))
+            conn.execute("REPLACE INTO user_booklists (username, list_id, name) VALUES (?, ?, ?)", (u, list_id, name))
         return list_id
 
+    @staticmethod
+    def _book_row(u, list_id, book_data):
+        extra = {k: v for k, v in book_data.items() if k not in ('key', 'status')}
+        return (u, list_id, book_data['key'], book_data.get('status'), json.dumps(extra, ensure_ascii=False))
+
     def add_to_list(self, list_id, book_data):
-        data = self.load()
-        if list_id in data:
-            if not any(b['key'] == book_data['key'] for b in data[list_id]['books']):
-                data[list_id]['books'].append(book_data)
-                self.save(data)
+        u = get_current_user()
+        with get_db() as conn:
+            if conn.execute("SELECT 1 FROM user_booklists WHERE username=? AND list_id=?", (u, list_id)).fetchone():
+                conn.execute("INSERT OR IGNORE INTO user_booklist_books (username, list_id, book_key, status, data) VALUES (?, ?, ?, ?, ?)",
+                             self._book_row(u, list_id, book_data))
 
     def update_status(self, list_id, book_key, status, action):
-        data = self.load()
-        if list_id in data:
-            books = data[list_id]['books']
+        u = get_current_user()
+        with get_db() as conn:
             if action == 'remove':
-                data[list_id]['books'] = [b for b in books if b['key'] != book_key]
+                conn.execute("DELETE FROM user_booklist_books WHERE username=? AND list_id=? AND book_key=?", (u, list_id, book_key))
             else:
-                for b in books:
-                    if b['key'] == book_key: b['status'] = status
-            self.save(data)
-    
+                conn.execute("UPDATE user_booklist_books SET status=? WHERE username=? AND list_id=? AND book_key=?", (status, u, list_id, book_key))
+
     # 兼容旧代码调用 load 方法直接返回字典
-    def load(self, username=None):
-        return super().load(username)
+    def _load_rows(self, conn, u):
+        data = {}
+        for r in conn.execute("SELECT list_id, name FROM user_booklists WHERE username=? ORDER BY rowid", (u,)):
+            data[r[0]] = {"name": r[1], "books": []}
+        for r in conn.execute("SELECT list_id, book_key, status, data FROM user_booklist_books WHERE username=? ORDER BY rowid", (u,)):
+            if r[0] not in data: continue
+            book = {"key": r[1]}
+            book.update(json.loads(r[3]) if r[3] else {})
+            if r[2] is not None: book['status'] = r[2]
+            data[r[0]]["books"].append(book)
+        return data
+
+    def _insert_rows(self, conn, u, data):
+        for list_id, lst in data.items():
+            if not isinstance(lst, dict): continue
+            conn.execute("INSERT OR REPLACE INTO user_booklists (username, list_id, name) VALUES (?, ?, ?)", (u, list_id, lst.get('name')))
+            conn.executemany("INSERT OR IGNORE INTO user_booklist_books (username, list_id, book_key, status, data) VALUES (?, ?, ?, ?, ?)",
+                             [self._book_row(u, list_id, b) for b in lst.get('books', []) if isinstance(b, dict) and b.get('key')])
+
+class IsolatedTagManager(BaseTableManager):
+    SCHEMA = ('''CREATE TABLE IF NOT EXISTS user_tags (
+                    username TEXT NOT NULL,
+                    book_key TEXT NOT NULL,
+                    tag TEXT NOT NULL,
+                    PRIMARY KEY (username, book_key, tag)
+                )''',
+              "CREATE INDEX IF NOT EXISTS idx_user_tags_tag ON user_tags(username, tag)")
+    TABLES = ('user_tags',)
 
-class IsolatedTagManager(BaseJsonManager):
     def __init__(self): super().__init__('tags')
-    
+
     def update_tags(self, key, tags):
-        d = self.load()
-        if tags: d[key] = [t.strip() for t in tags if t.strip()]
-        elif key in d: del d[key]
-        self.save(d)
-        return d.get(key, [])
-    
+        u = get_current_user()
+        clean = [t.strip() for t in tags if t.strip()] if tags else []
+        with get_db() as conn:
+            conn.execute("DELETE FROM user_tags WHERE username=? AND book_key=?", (u, key))
+            conn.executemany("INSERT OR IGNORE INTO user_tags (username, book_key, tag) VALUES (?, ?, ?)", [(u, key, t) for t in clean])
+        return list(dict.fromkeys(clean))
+
+    def _load_rows(self, conn, u):
+        d = {}
+        for r in conn.execute("SELECT book_key, tag FROM user_tags WHERE username=? ORDER BY rowid", (u,)):
+            d.setdefault(r[0], []).append(r[1])
+        return d
+
+    def _insert_rows(self, conn, u, data):
+        conn.executemany("INSERT OR IGNORE INTO user_tags (username, book_key, tag) VALUES (?, ?, ?)",
+                         [(u, key, t) for key, tags in data.items() if isinstance(tags, list) for t in tags if t])
+
     def get_all(self): return self.load()
 
-class UpdateManager(BaseJsonManager):
+class UpdateManager(BaseTableManager):
+    FIELDS = ('latest_title', 'latest_url', 'latest_id', 'toc_url', 'last_check', 'unread_count', 'status_text')
+    SCHEMA = ('''CREATE TABLE IF NOT EXISTS user_update_info (
+                    username TEXT NOT NULL,
+                    book_key TEXT NOT NULL,
+                    latest_title TEXT,
+                    latest_url TEXT,
+                    latest_id,
+                    toc_url TEXT,
+                    last_check INTEGER,
+                    unread_count INTEGER,
+                    status_text TEXT,
+                    PRIMARY KEY (username, book_key)
+                )''',)
+    TABLES = ('user_update_info',)
+
     def __init__(self): super().__init__('updates')
     
     def set_update(self, book_key, latest_data, username=None):
-        data = self.load(username)
+        u = username or get_current_user()
         # 兼容性处理
         title = latest_data.get('title') or latest_data.get('latest_title') or "未知"
         url = latest_data.get('url') or latest_data.get('latest_url')
         cid = latest_data.get('id') or latest_data.get('latest_id') or -1
-        
-        data[book_key] = {
-            "latest_title": title,
-            "latest_url": url,
-            "latest_id": cid,
-            "toc_url": latest_data.get('toc_url'),
-            "last_check": int(time.time())
-        }
-        self.save(data, username)
+        with get_db() as conn:
+            conn.execute("REPLACE INTO user_update_info (username, book_key, latest_title, latest_url, latest_id, toc_url, last_check) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", (u, book_key, title, url, cid, latest_data.get('toc_url'), int(time.time())))
         
     def get_update(self, book_key):
-        return self.load().get(book_key)
+        row = get_db().execute(f"SELECT {', '.join(self.FIELDS)} FROM user_update_info WHERE username=? AND book_key=?",
+                               (get_current_user(), book_key)).fetchone()
+        return self._row_dict(row) if row else None
 
     def update_progress(self, book_key, unread_count, status_text, username=None):
-        data = self.load(username)
-        if book_key in data:
-            data[book_key]['unread_count'] = unread_count
-            data[book_key]['status_text'] = status_text
-            self.save(data, username)
-
-class IsolatedStatsManager(BaseJsonManager):
-    def __init__(self): super().__init__('stats')
-
-    def update(self, t, w, c, bk):
-        d = self.load()
-        if "daily_stats" not in d: d["daily_stats"] = {}
-        k = datetime.now().strftime('%Y-%m-%d')
-        if k not in d["daily_stats"]: d["daily_stats"][k] = {"time":0,"words":0,"chapters":0,"books":[]}
-        r = d["daily_stats"][k]
-        r["time"]+=t; r["words"]+=w; r["chapters"]+=c
-        if bk and bk not in r["books"]: r["books"].append(bk)
-        self.save(d)
-        
-    def get_summary(self):
-        today = datetime.now()
+        u = username or get_current_user()
+        with get_db() as conn:
+            conn.execute("UPDATE user_update_info SET unread_count=?, status_text=? WHERE username=? AND book_key=?",
+                         (unread_count, status_text, u, book_key))
+
+    def _row_dict(self, row):
+        # unread_count / status_text 只有调用过 update_progress 才有 (与原 JSON 结构一致)
+        return {k: row[i] for i, k in enumerate(self.FIELDS) if row[i] is not None or i < 5}
+
+    def _load_rows(self, conn, u):
+        rows = conn.execute(f"SELECT book_key, {', '.join(self.FIELDS)} FROM user_update_info WHERE username=? ORDER BY rowid", (u,)).fetchall()
+        return {r[0]: self._row_dict(tuple(r)[1:]) for r in rows}
+
+    def _insert_rows(self, conn, u, data):
+        conn.executemany(f"REPLACE INTO user_update_info (username, book_key, {', '.join(self.FIELDS)}) VALUES (?, ?{', ?' * len(self.FIELDS)})",
+                         [(u, key) + tuple(rec.get(f) for f in self.FIELDS) for key, rec in data.items() if isinstance(rec, dict)])
+
+class StatsAggregate:
+    """
+    单个用户阅读统计的增量聚合：累计总量、按天数据、热力图数组、近 30 天每天的书目集合、累计书目集合
+    get_summary 只看最近 30 天和现成的累计值，不再遍历全部历史、也不再逐天 strptime
+    """
+    WINDOW = 30
+
+    def __init__(self, totals, days, recent_books, all_books, version=0):
+        self.totals = list(totals)            # [time, words, chapters]
+        self.version = version                # 建立时 user_stats_totals.version，其它进程写过库就会变
+        self.days = days                      # {day: [time, words, chapters]}
+        self.recent_books = recent_books      # {day: {book_key}}，只保留最近 WINDOW 天
+        self.all_books = all_books            # {book_key}
+        self.heatmap = [{"date": d, "count": int(r[0] / 60)} for d, r in sorted(days.items()) if r[0] > 0]
+        self._heat_pos = {h["date"]: i for i, h in enumerate(self.heatmap)}
+
+    def apply(self, day, t, w, c, books):
+        """落库后把这批增量并进聚合"""
+        self.totals[0] += t; self.totals[1] += w; self.totals[2] += c
+        r = self.days.setdefault(day, [0, 0, 0])
+        r[0] += t; r[1] += w; r[2] += c
+        if books:
+            self.all_books.update(books)
+            self.recent_books.setdefault(day, set()).update(books)
+        self._set_heat(self.heatmap, self._heat_pos, day, r[0])
+
+    @staticmethod
+    def _set_heat(heat, pos, day, t):
+        if t <= 0: return
+        entry = {"date": day, "count": int(t / 60)}
+        i = pos.get(day)
+        if i is not None:
+            heat[i] = entry
+        elif not heat or day > heat[-1]["date"]:
+            pos[day] = len(heat)
+            heat.append(entry)
+        else:  # 补写更早的日期 (少见)：插入后重建下标
+            heat.append(entry)
+            heat.sort(key=lambda h: h["date"])
+            pos.clear()
+            pos.update((h["date"], i) for i, h in enumerate(heat))
+
+    def summary(self, today, pending=None):
+        """pending: 还没落库的增量 {day: (time, words, chapters, {book_key})}"""
+        pending = pending or {}
+        oldest = (today - timedelta(days=self.WINDOW - 1)).strftime('%Y-%m-%d')
+        for d in [d for d in self.recent_books if d < oldest]:
+            del self.recent_books[d]
+
         summary = {
             "24h": {"time": 0, "words": 0, "chapters": 0, "books": 0},
             "7d":  {"time": 0, "words": 0, "chapters": 0, "books": 0},
@@ -219,34 +395,330 @@ class IsolatedStatsManager(BaseJsonManager):
             "all": {"time": 0, "words": 0, "chapters": 0, "books": 0, "heatmap": []},
             "trend": {"dates": [], "times": []}
         }
-        books_sets = {"24h": set(), "7d": set(), "30d": set(), "all": set()}
-        data = self.load()
-        daily = data.get("daily_stats", {})
-        
-        for i in range(29, -1, -1):
-            day = today - timedelta(days=i)
-            d_str = day.strftime('%Y-%m-%d')
-            rec = daily.get(d_str, {})
+        books_sets = {"24h": set(), "7d": set(), "30d": set()}
+        for i in range(self.WINDOW - 1, -1, -1):
+            d_str = (today - timedelta(days=i)).strftime('%Y-%m-%d')
+            r = self.days.get(d_str, (0, 0, 0))
+            t, w, c = r[0], r[1], r[2]
+            b_set = self.recent_books.get(d_str, set())
+            p = pending.get(d_str)
+            if p:
+                t += p[0]; w += p[1]; c += p[2]
+                b_set = b_set | p[3]
             summary["trend"]["dates"].append(d_str[5:])
-            summary["trend"]["times"].append(int(rec.get("time", 0) / 60))
-
-        for date_str, rec in daily.items():
-            try:
-                rec_date = datetime.strptime(date_str, '%Y-%m-%d')
-                delta = (today - rec_date).days
-                t, w, c = rec.get("time", 0), rec.get("words", 0), rec.get("chapters", 0)
-                b_list = rec.get("books", [])
-                summary["all"]["time"] += t; summary["all"]["words"] += w; summary["all"]["chapters"] += c; books_sets["all"].update(b_list)
-                if t > 0: summary["all"]["heatmap"].append({"date": date_str, "count": int(t/60)})
-                if delta == 0: summary["24h"]["time"] += t; summary["24h"]["words"] += w; summary["24h"]["chapters"] += c; books_sets["24h"].update(b_list)
-                if delta < 7: summary["7d"]["time"] += t; summary["7d"]["words"] += w; summary["7d"]["chapters"] += c; books_sets["7d"].update(b_list)
-                if delta < 30: summary["30d"]["time"] += t; summary["30d"]["words"] += w; summary["30d"]["chapters"] += c; books_sets["30d"].update(b_list)
-            except: pass
+            summary["trend"]["times"].append(int(t / 60))
+            for k, span in (("24h", 1), ("7d", 7), ("30d", 30)):
+                if i < span:
+                    summary[k]["time"] += t; summary[k]["words"] += w; summary[k]["chapters"] += c
+                    books_sets[k].update(b_set)
         for k in books_sets:
             summary[k]["books"] = len(books_sets[k])
-            summary[k]["time"] = int(summary[k]["time"] / 60) 
+            summary[k]["time"] = int(summary[k]["time"] / 60)
+
+        t, w, c = self.totals
+        heat = self.heatmap
+        new_books = set()
+        if pending:
+            heat, pos = list(heat), dict(self._heat_pos)
+            for d_str, p in sorted(pending.items()):
+                t += p[0]; w += p[1]; c += p[2]
+                new_books |= p[3] - self.all_books
+                self._set_heat(heat, pos, d_str, self.days.get(d_str, (0,))[0] + p[0])
+        summary["all"].update({"time": int(t / 60), "words": w, "chapters": c,
+                               "books": len(self.all_books) + len(new_books), "heatmap": list(heat)})
         return summary
 
+class IsolatedStatsManager(BaseTableManager):
+    SCHEMA = ('''CREATE TABLE IF NOT EXISTS user_stats_daily (
+                    username TEXT NOT NULL,
+                    day TEXT NOT NULL,  -- YYYY-MM-DD
+                    time INTEGER DEFAULT 0,
+                    words INTEGER DEFAULT 0,
+                    chapters INTEGER DEFAULT 0,
+                    PRIMARY KEY (username, day)
+                )''',
+              '''CREATE TABLE IF NOT EXISTS user_stats_books (
+                    username TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    book_key TEXT NOT NULL,
+                    PRIMARY KEY (username, day, book_key)
+                )''',
+              # 管理后台按天聚合全站数据
+              "CREATE INDEX IF NOT EXISTS idx_user_stats_daily_day ON user_stats_daily(day)",
+              # 累计总量与累计书目集合，随落库增量维护；version 每次写入 +1，多进程部署时用来判断内存聚合是否过期
+              '''CREATE TABLE IF NOT EXISTS user_stats_totals (
+                    username TEXT PRIMARY KEY,
+                    time INTEGER DEFAULT 0,
+                    words INTEGER DEFAULT 0,
+                    chapters INTEGER DEFAULT 0,
+                    version INTEGER DEFAULT 0
+                )''',
+              '''CREATE TABLE IF NOT EXISTS user_stats_book_set (
+                    username TEXT NOT NULL,
+                    book_key TEXT NOT NULL,
+                    PRIMARY KEY (username, book_key)
+                )''',
+              # 全站按天聚合与全站累计 (管理后台用)，同样随落库增量维护
+              '''CREATE TABLE IF NOT EXISTS site_stats_daily (
+                    day TEXT PRIMARY KEY,
+                    time INTEGER DEFAULT 0,
+                    words INTEGER DEFAULT 0,
+                    chapters INTEGER DEFAULT 0,
+                    active_users INTEGER DEFAULT 0
+                )''',
+              '''CREATE TABLE IF NOT EXISTS site_stats_totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    time INTEGER DEFAULT 0,
+                    words INTEGER DEFAULT 0,
+                    chapters INTEGER DEFAULT 0
+                )''')
+    TABLES = ('user_stats_daily', 'user_stats_books', 'user_stats_totals', 'user_stats_book_set')
+    # 心跳缓冲落库间隔 (秒)。缓冲只在本进程内存里，这是有代价的：
+    # - 多 worker 部署时，其它进程的 load()/get_summary() 最多看不到本进程最近 FLUSH_INTERVAL 秒的增量
+    # - 正常退出 (atexit) 和 SIGTERM 会先落库；SIGKILL / OOM 直接被杀时，这段增量会丢失
+    # 对这两点敏感的多 worker 部署可以设 STATS_FLUSH_INTERVAL=0：每次心跳直接落库，不做缓冲
+    FLUSH_INTERVAL = int(os.environ.get('STATS_FLUSH_INTERVAL', 30))
+    MAX_PENDING = 500     # 缓冲的用户数超过这个数立即落库
+    MAX_AGGREGATES = 256  # 内存里保留多少个用户的聚合
+
+    def __init__(self):
+        super().__init__('stats')
+        # 写回缓冲：每个打开的阅读页每分钟一次心跳，先在内存里按 (用户, 天) 合并，定时批量落库
+        self._pending = {}                       # {username: {day: [time, words, chapters, {book_key}]}}
+        self._pending_lock = threading.Lock()    # 只保护 _pending，心跳不会被落库阻塞
+        self._flush_lock = threading.Lock()      # 落库与读取互斥，保证读到的 "库 + 缓冲" 不重不漏
+        self._aggs = OrderedDict()               # {username: StatsAggregate}，LRU
+        self._flusher = None
+        self.heartbeats = 0
+        self.flushed_rows = 0
+        self.flushes = 0
+        atexit.register(self.flush)
+        self._flush_on_sigterm()
+
+    def _flush_on_sigterm(self):
+        """SIGTERM (容器停止 / gunicorn 回收 worker) 时先把缓冲落库，再交给原来的处理函数"""
+        try:
+            prev = signal.getsignal(signal.SIGTERM)
+        except (ValueError, OSError):
+            return
+
+        def handler(signum, frame):
+            # 放到单独线程里落库：信号可能打断正持有 _flush_lock 的主线程，直接调用会死锁
+            t = threading.Thread(target=self.flush, daemon=True)
+            t.start()
+            t.join(5)
+            if callable(prev): prev(signum, frame)
+            elif prev == signal.SIG_DFL: raise SystemExit(128 + signum)
+
+        try:
+            signal.signal(signal.SIGTERM, handler)
+        except (ValueError, OSError):
+            pass  # 不在主线程导入时无法注册信号处理，只剩 atexit
+
+    def _ensure_tables(self):
+        try:
+            existing = {r[0] for r in get_db().execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        except sqlite3.Error:
+            existing = {'user_stats_totals', 'site_stats_daily'}
+        super()._ensure_tables()
+        # 聚合表是新建的：从已有的按天数据回填一次
+        try:
+            with get_db() as conn:
+                if 'version' not in {r[1] for r in conn.execute("PRAGMA table_info(user_stats_totals)")}:
+                    conn.execute("ALTER TABLE user_stats_totals ADD COLUMN version INTEGER DEFAULT 0")
+                if 'user_stats_totals' not in existing:
+                    conn.execute("INSERT OR IGNORE INTO user_stats_totals (username, time, words, chapters) "
+                                 "SELECT username, SUM(time), SUM(words), SUM(chapters) FROM user_stats_daily GROUP BY username")
+                    conn.execute("INSERT OR IGNORE INTO user_stats_book_set (username, book_key) SELECT DISTINCT username, book_key FROM user_stats_books")
+                if 'site_stats_daily' not in existing:
+                    conn.execute("INSERT OR IGNORE INTO site_stats_daily (day, time, words, chapters, active_users) "
+                                 "SELECT day, SUM(time), SUM(words), SUM(chapters), COUNT(*) FROM user_stats_daily GROUP BY day")
+                    conn.execute("INSERT OR IGNORE INTO site_stats_totals (id, time, words, chapters) "
+                                 "SELECT 1, COALESCE(SUM(time), 0), COALESCE(SUM(words), 0), COALESCE(SUM(chapters), 0) FROM user_stats_daily")
+        except Exception as e:
+            print(f"[DB Init] stats 聚合表回填失败: {e}")
+
+    @staticmethod
+    def _bump_site(conn, rows):
+        """把 [(day, time, words, chapters, 新增活跃用户数)] 累加到全站聚合 (减去时传负数)"""
+        if not rows: return
+        conn.executemany("INSERT INTO site_stats_daily (day, time, words, chapters, active_users) VALUES (?, ?, ?, ?, ?) "
+                         "ON CONFLICT(day) DO UPDATE SET time=time+excluded.time, words=words+excluded.words, "
+                         "chapters=chapters+excluded.chapters, active_users=active_users+excluded.active_users", rows)
+        conn.execute("INSERT INTO site_stats_totals (id, time, words, chapters) VALUES (1, ?, ?, ?) "
+                     "ON CONFLICT(id) DO UPDATE SET time=time+excluded.time, words=words+excluded.words, chapters=chapters+excluded.chapters",
+                     (sum(r[1] for r in rows), sum(r[2] for r in rows), sum(r[3] for r in rows)))
+
+    def update(self, t, w, c, bk, username=None):
+        u = username or get_current_user()
+        k = datetime.now().strftime('%Y-%m-%d')
+        with self._pending_lock:
+            days = self._pending.setdefault(u, {})
+            rec = days.get(k)
+            if rec is None: rec = days[k] = [0, 0, 0, set()]
+            rec[0] += t; rec[1] += w; rec[2] += c
+            if bk: rec[3].add(bk)
+            self.heartbeats += 1
+            backlog = len(self._pending)
+        if self.FLUSH_INTERVAL <= 0 or backlog >= self.MAX_PENDING:
+            self.flush()
+            return
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._flusher is not None: return
+        with self._pending_lock:
+            if self._flusher is not None: return
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name="StatsFlusher")
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """把缓冲的心跳合并写入按天表和累计表，返回写入的 (用户, 天) 条数"""
+        with self._flush_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, {}
+            if not batch: return 0
+            rows = [(u, k, r) for u, days in batch.items() for k, r in days.items()]
+            totals = []
+            for u, days in batch.items():
+                totals.append((u, sum(r[0] for r in days.values()), sum(r[1] for r in days.values()), sum(r[2] for r in days.values())))
+            try:
+                with get_db() as conn:
+                    # 先看哪些 (用户, 天) 是第一次出现，用来累计全站当天的活跃用户数
+                    site = [(k, r[0], r[1], r[2], 0 if conn.execute("SELECT 1 FROM user_stats_daily WHERE username=? AND day=?", (u, k)).fetchone() else 1)
+                            for u, k, r in rows]
+                    conn.executemany("INSERT INTO user_stats_daily (username, day, time, words, chapters) VALUES (?, ?, ?, ?, ?) "
+                                     "ON CONFLICT(username, day) DO UPDATE SET time=time+excluded.time, words=words+excluded.words, "
+                                     "chapters=chapters+excluded.chapters",
+                                     [(u, k, r[0], r[1], r[2]) for u, k, r in rows])
+                    conn.executemany("INSERT OR IGNORE INTO user_stats_books (username, day, book_key) VALUES (?, ?, ?)",
+                                     [(u, k, bk) for u, k, r in rows for bk in r[3]])
+                    # 本进程缓存了聚合的用户：记下写入前的版本，落库后只有版本正好接上才增量更新
+                    before = {}
+                    for u in batch:
+                        if u in self._aggs:
+                            v = conn.execute("SELECT version FROM user_stats_totals WHERE username=?", (u,)).fetchone()
+                            before[u] = (v[0] or 0) if v else 0
+                    conn.executemany("INSERT INTO user_stats_totals (username, time, words, chapters, version) VALUES (?, ?, ?, ?, 1) "
+                                     "ON CONFLICT(username) DO UPDATE SET time=time+excluded.time, words=words+excluded.words, "
+                                     "chapters=chapters+excluded.chapters, version=COALESCE(version, 0)+1", totals)
+                    conn.executemany("INSERT OR IGNORE INTO user_stats_book_set (username, book_key) VALUES (?, ?)",
+                                     list({(u, bk) for u, k, r in rows for bk in r[3]}))
+                    self._bump_site(conn, site)
+            except Exception as e:
+                print(f"DB Save Error (stats): {e}")
+                # 放回缓冲，下次再试
+                with self._pending_lock:
+                    for u, k, r in rows:
+                        cur = self._pending.setdefault(u, {}).setdefault(k, [0, 0, 0, set()])
+                        cur[0] += r[0]; cur[1] += r[1]; cur[2] += r[2]; cur[3].update(r[3])
+                return 0
+            for u, v in before.items():
+                agg = self._aggs.get(u)
+                if agg is None: continue
+                if agg.version != v:  # 别的进程在这之前写过，聚合已经过期，下次读取时重建
+                    self._aggs.pop(u, None)
+                    continue
+                for k, r in batch[u].items():
+                    agg.apply(k, r[0], r[1], r[2], r[3])
+                agg.version = v + 1
+            self.flushes += 1
+            self.flushed_rows += len(rows)
+            return len(rows)
+
+    def _pending_for(self, u):
+        with self._pending_lock:
+            return {k: (r[0], r[1], r[2], set(r[3])) for k, r in self._pending.get(u, {}).items()}
+
+    def load(self, username=None):
+        """库里的数据 + 还没落库的心跳"""
+        u = username or get_current_user()
+        with self._flush_lock:
+            data = super().load(u)
+            pending = self._pending_for(u)
+        daily = data.setdefault("daily_stats", {})
+        for k, (t, w, c, books) in pending.items():
+            rec = daily.setdefault(k, {"time": 0, "words": 0, "chapters": 0, "books": []})
+            rec["time"] += t; rec["words"] += w; rec["chapters"] += c
+            rec["books"].extend(bk for bk in books if bk not in rec["books"])
+        return data
+
+    def save(self, data, username=None):
+        self.flush()  # 整体替换前先落库，避免缓冲里的增量叠加到新数据上
+        super().save(data, username)
+
+    def _load_rows(self, conn, u):
+        daily = {}
+        for r in conn.execute("SELECT day, time, words, chapters FROM user_stats_daily WHERE username=? ORDER BY day", (u,)):
+            daily[r[0]] = {"time": r[1], "words": r[2], "chapters": r[3], "books": []}
+        for r in conn.execute("SELECT day, book_key FROM user_stats_books WHERE username=? ORDER BY rowid", (u,)):
+            if r[0] in daily: daily[r[0]]["books"].append(r[1])
+        return {"daily_stats": daily}
+
+    def _replace_rows(self, conn, u, data):
+        # 整体替换：先从全站聚合里减掉该用户的旧数据，写入后再加上新数据
+        day_rows = "SELECT day, time, words, chapters FROM user_stats_daily WHERE username=?"
+        self._bump_site(conn, [(r[0], -r[1], -r[2], -r[3], -1) for r in conn.execute(day_rows, (u,))])
+        v = conn.execute("SELECT version FROM user_stats_totals WHERE username=?", (u,)).fetchone()
+        super()._replace_rows(conn, u, data)
+        # 累计行被整行替换，版本在旧值上接着 +1，其它进程缓存的聚合据此失效
+        conn.execute("UPDATE user_stats_totals SET version=? WHERE username=?", (((v[0] or 0) if v else 0) + 1, u))
+        self._bump_site(conn, [(r[0], r[1], r[2], r[3], 1) for r in conn.execute(day_rows, (u,))])
+        self._aggs.pop(u, None)
+
+    def _insert_rows(self, conn, u, data):
+        daily = {day: r for day, r in data.get("daily_stats", {}).items() if isinstance(r, dict)}
+        conn.executemany("INSERT OR REPLACE INTO user_stats_daily (username, day, time, words, chapters) VALUES (?, ?, ?, ?, ?)",
+                         [(u, day, r.get("time", 0), r.get("words", 0), r.get("chapters", 0)) for day, r in daily.items()])
+        conn.executemany("INSERT OR IGNORE INTO user_stats_books (username, day, book_key) VALUES (?, ?, ?)",
+                         [(u, day, bk) for day, r in daily.items() for bk in r.get("books", []) if bk])
+        conn.execute("INSERT OR REPLACE INTO user_stats_totals (username, time, words, chapters) VALUES (?, ?, ?, ?)",
+                     (u, sum(r.get("time", 0) for r in daily.values()), sum(r.get("words", 0) for r in daily.values()),
+                      sum(r.get("chapters", 0) for r in daily.values())))
+        conn.executemany("INSERT OR IGNORE INTO user_stats_book_set (username, book_key) VALUES (?, ?)",
+                         [(u, bk) for bk in {bk for r in daily.values() for bk in r.get("books", []) if bk}])
+
+    def _aggregate(self, conn, u):
+        """
+        取用户的聚合，不在内存里时从库里建一次 (之后随落库增量更新)
+        每次先比对 user_stats_totals.version：别的进程落库或整体替换过就重建，多进程部署下不会读到旧数据
+        """
+        tot = conn.execute("SELECT time, words, chapters, version FROM user_stats_totals WHERE username=?", (u,)).fetchone()
+        version = (tot[3] or 0) if tot else 0
+        agg = self._aggs.get(u)
+        if agg is not None and agg.version == version:
+            self._aggs.move_to_end(u)
+            return agg
+        since = (datetime.now() - timedelta(days=StatsAggregate.WINDOW)).strftime('%Y-%m-%d')
+        days = {r[0]: [r[1], r[2], r[3]] for r in conn.execute("SELECT day, time, words, chapters FROM user_stats_daily WHERE username=?", (u,))}
+        recent = {}
+        for r in conn.execute("SELECT day, book_key FROM user_stats_books WHERE username=? AND day >= ?", (u, since)):
+            recent.setdefault(r[0], set()).add(r[1])
+        all_books = {r[0] for r in conn.execute("SELECT book_key FROM user_stats_book_set WHERE username=?", (u,))}
+        agg = StatsAggregate(tuple(tot[:3]) if tot else (0, 0, 0), days, recent, all_books, version)
+        self._aggs[u] = agg
+        self._aggs.move_to_end(u)
+        while len(self._aggs) > self.MAX_AGGREGATES:
+            self._aggs.popitem(last=False)
+        return agg
+
+    def get_summary(self, username=None):
+        u = username or get_current_user()
+        with self._flush_lock:
+            agg = self._aggregate(get_db(), u)
+            return agg.summary(datetime.now(), self._pending_for(u))
+
+    def stats(self):
+        with self._pending_lock:
+            return {"heartbeats": self.heartbeats, "pending_users": len(self._pending), "flushes": self.flushes,
+                    "flushed_rows": self.flushed_rows, "interval": self.FLUSH_INTERVAL, "aggregates": len(self._aggs)}
+
+
 # ==========================================
 # 4. 核心 KV 数据库 (SQL版)
 # ==========================================
@@ -264,8 +736,7 @@ class IsolatedDB:
     def _get_db_conn(self):
         username = session.get('user', {}).get('username', 'default_user')
         db_path = os.path.join(USER_DATA_DIR, f"{username}.sqlite")
-        conn = sqlite3.connect(db_path)
-        return conn
+        return get_pool(db_path).get()
 
     def _ensure_history_table(self):
         try:
@@ -295,7 +766,7 @@ class IsolatedDB:
         """将旧的纯文本 URL 转换为 JSON 对象"""
         print("[DB] 检查数据结构版本...")
         try:
-            with sqlite3.connect(DB_PATH) as conn:
+            with get_db() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT username, book_key, value FROM user_books")
                 rows = cursor.fetchall()
@@ -541,9 +1012,9 @@ class UpdateRecordManager:
             # 但我们在 __init__ 里调用时通常是在 import 阶段，也不行
             # 所以只能把建表逻辑通过独立的连接来做，或者每次操作前检查
             
-            # 使用独立连接建表，防止 Flask context 报错
-            conn = sqlite3.connect(DB_PATH) 
-            conn.execute('''CREATE TABLE IF NOT EXISTS book_updates (
+            # 池化连接不依赖 Flask context；不 commit / close：连接是本线程共享的 (见 get_db)，
+            # 建表语句不会开启隐式事务，不会动到调用方未提交的写入
+            get_db().execute('''CREATE TABLE IF NOT EXISTS book_updates (
                             book_key TEXT PRIMARY KEY,
                             username TEXT NOT NULL,
                             toc_url TEXT,
@@ -552,8 +1023,6 @@ class UpdateRecordManager:
                             has_update BOOLEAN DEFAULT 0,
                             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                         )''')
-            conn.commit()
-            conn.close()
         except Exception as e:
             print(f"[DB Init] 自动建表失败 (不用担心，可能是文件锁定): {e}")
 
@@ -585,9 +1054,9 @@ class UpdateRecordManager:
     # [新增] 获取更详细的状态，供前端渲染红点
     def get_book_status(self, book_key):
         with get_db() as conn:
-            row = conn.execute("SELECT has_update, last_remote_id FROM book_updates WHERE book_key=?", (book_key,)).fetchone()
+            row = conn.execute("SELECT has_update, last_remote_id, toc_url FROM book_updates WHERE book_key=?", (book_key,)).fetchone()
             if row:
-                return {"subscribed": True, "has_update": bool(row['has_update']), "remote_id": row['last_remote_id']}
+                return {"subscribed": True, "has_update": bool(row['has_update']), "remote_id": row['last_remote_id'], "toc_url": row['toc_url']}
             return {"subscribed": False, "has_update": False}
     
     def update_status(self, book_key, remote_id, has_u):
@@ -634,7 +1103,6 @@ class OfflineBookManager:
             with open(self._get_book_path(k), 'r') as f: return json.load(f).get(u)
         except: return None
 import redis
-import threading
 class CacheManager:
     def __init__(self, ttl=604800): 
         self.cache_dir = CACHE_DIR
@@ -647,14 +1115,17 @@ class CacheManager:
         if not os.path.exists(fp): return None
         if time.time() - os.path.getmtime(fp) > self.ttl: return None
         try:
-            with open(fp, 'r', encoding='utf-8') as f: return json.load(f)
+            # 大目录以列式结构落盘，读出时还原为 CompactToc (仍可按列表使用)
+            with open(fp, 'r', encoding='utf-8') as f: return unpack_toc(json.load(f))
         except: return None
     def set(self, url, data):
+        # 截止时间到了只缝合了一部分分页的章节不落缓存，否则会一直是半章
+        if isinstance(data, dict) and data.get('partial'): return
         fp = self._get_filename(url)
         # [修复] 修正语法错误，拆分为标准写法
         try:
             with open(fp, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False)
+                json.dump(pack_toc(data), f, ensure_ascii=False)
         except Exception as e:
             print(f"[Cache] Write Error: {e}")
             
@@ -679,8 +1150,9 @@ class DownloadManager:
     def _master_worker(self, task_id, chapters, crawler):
         task = self.downloads[task_id]
         results = [None] * len(chapters)
+        fetch = crawler.scheduler.wrap(self._fetch_worker, 'bulk') if hasattr(crawler, 'scheduler') else self._fetch_worker
         with ThreadPoolExecutor(max_workers=8) as pool:
-            future_to_index = {pool.submit(self._fetch_worker, c['url'], crawler): i for i, c in enumerate(chapters)}
+            future_to_index = {pool.submit(fetch, c['url'], crawler): i for i, c in enumerate(chapters)}
             for future in as_completed(future_to_index):
                 idx = future_to_index[future]
                 try:
@@ -705,7 +1177,6 @@ class DownloadManager:
 # ==========================================
 # 导出管理器 (TXT/EPUB) - 支持断点续传
 # ==========================================
-import threading
 class ExportManager:
     def __init__(self):
         self.exports = {}  # 内存中的活跃任务
@@ -725,6 +1196,9 @@ class ExportManager:
                         # 添加创建时间（如果没有）
                         if 'created_at' not in task:
                             task['created_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+                        chapters = task.get('chapters')
+                        if CompactToc.is_payload(chapters): chapters = CompactToc.from_payload(chapters)
+                        task['chapters'] = compact_chapters(chapters or [])
                         self.exports[task_id] = task
             except Exception as e:
                 print(f"[ExportManager] 加载任务失败: {e}")
@@ -740,7 +1214,7 @@ class ExportManager:
             all_tasks[task_id] = self.exports[task_id]
             
             with open(self.task_file, 'w', encoding='utf-8') as f:
-                json.dump(all_tasks, f, ensure_ascii=False, indent=2)
+                json.dump(all_tasks, f, ensure_ascii=False, indent=2, default=toc_json_default)
         except Exception as e:
             print(f"[ExportManager] 保存任务失败: {e}")
     
@@ -751,7 +1225,7 @@ class ExportManager:
                 return task_id
         return None
     
-    def start_export(self, book_name, chapters, crawler_instance, export_format='txt', metadata=None, resume_task_id=None, delay=0.5):
+    def start_export(self, book_name, chapters, crawler_instance, export_format='txt', metadata=None, resume_task_id=None, delay=0.5, username=None):
         """启动导出任务（支持续传）
         
         Args:
@@ -763,6 +1237,9 @@ class ExportManager:
             task = self.exports[task_id]
             task['status'] = 'running'
             task['delay'] = delay  # 更新延迟设置
+            # [新增] 目录在暂停期间有变化时，按 URL 把已完成的章节对齐到新目录
+            if chapters and hasattr(crawler_instance, 'toc_index'):
+                self._realign_task(task, chapters, crawler_instance.toc_index)
             print(f"[Export] 续传任务 {task_id}，已完成 {len(task.get('completed_chapters', []))} 章")
         else:
             # 新任务
@@ -778,10 +1255,11 @@ class ExportManager:
                 'format': export_format,
                 'filename': filename,
                 'metadata': metadata or {},
-                'chapters': [{'name': c.get('name', f'第{i+1}章'), 'url': c['url']} for i, c in enumerate(chapters)],
+                'chapters': compact_chapters([{'name': c.get('name', f'第{i+1}章'), 'url': c['url']} for i, c in enumerate(chapters)]),
                 'completed_chapters': [],  # 已完成的章节索引
                 'results': {},  # 已抓取的章节内容 {index: {title, content}}
                 'delay': delay,  # 抓取延迟（秒）
+                'username': username,  # 发起用户 (调度器按用户公平分配名额)
                 'paused': False,  # 暂停标志
                 'created_at': time.strftime('%Y-%m-%d %H:%M:%S')  # 创建时间
             }
@@ -791,6 +1269,28 @@ class ExportManager:
         threading.Thread(target=self._export_worker, args=(task_id, crawler_instance)).start()
         return task_id
     
+    def _realign_task(self, task, chapters, toc_index):
+        """续传时用新目录替换旧目录，已完成章节/已抓取内容按 URL 映射到新下标"""
+        old = task.get('chapters') or []
+        if len(old) == len(chapters) and (not old or (old[0]['url'] == chapters[0]['url'] and old[-1]['url'] == chapters[-1]['url'])):
+            return
+        new_list = [{'name': c.get('name', f'第{i+1}章'), 'url': c['url']} for i, c in enumerate(chapters)]
+        new_pos = toc_index.position_map(new_list)
+        old_results = {int(k): v for k, v in task.get('results', {}).items()}
+        completed, results = set(), {}
+        for idx in task.get('completed_chapters', []):
+            if not 0 <= idx < len(old): continue
+            j = new_pos.get(toc_index.normalize(old[idx]['url']))
+            if j is None: continue
+            completed.add(j)
+            if idx in old_results: results[j] = old_results[idx]
+        print(f"[Export] 目录已变化 {len(old)} -> {len(new_list)} 章，保留已完成 {len(completed)} 章")
+        task['chapters'] = compact_chapters(new_list)
+        task['total'] = len(new_list)
+        task['completed_chapters'] = sorted(completed)
+        task['results'] = results
+        task['current'] = len(completed)
+
     def pause_export(self, task_id):
         """暂停导出任务"""
         if task_id in self.exports:
@@ -834,9 +1334,13 @@ class ExportManager:
             # 原有的本地并发逻辑
             pending_chapters = [(i, c) for i, c in enumerate(chapters) if i not in completed]
             
+            # 导出属于批量任务：在全局调度器里优先级最低，并按用户公平分配名额
+            fetch = self._fetch_chapter
+            if hasattr(crawler, 'scheduler'):
+                fetch = crawler.scheduler.wrap(self._fetch_chapter, 'bulk', task.get('username'))
             with ThreadPoolExecutor(max_workers=3) as pool:
                 future_to_index = {
-                    pool.submit(self._fetch_chapter, c['url'], crawler): i 
+                    pool.submit(fetch, c['url'], crawler): i 
                     for i, c in pending_chapters
                 }
                 
@@ -1625,6 +2129,44 @@ stats_manager = IsolatedStatsManager()
 history_manager = HistoryManager()
 update_manager = UpdateManager()
 update_sub_manager = UpdateRecordManager()
+
+def migrate_module_blobs():
+    """
+    把 user_modules 里旧的整块 JSON 拆进行级表；迁移完的行改名为 '<模块>:legacy' 留作备份
+    每个进程导入时都会执行：整个过程在一个写事务里，每行先改名认领、认领成功才重建，
+    并发或重复执行都不会把旧 JSON 再套用一遍，也不会删掉已有的备份
+    """
+    table_managers = {m.module_type: m for m in (history_manager, booklist_manager, tag_manager, update_manager, stats_manager)}
+    done = 0
+    try:
+        with get_db() as conn:
+            conn.execute("BEGIN IMMEDIATE")  # 先拿写锁，其它进程在此排队，轮到时已经没有待迁移的行
+            rows = conn.execute(f"SELECT username, module_type, json_content FROM user_modules WHERE module_type IN ({','.join('?' * len(table_managers))})",
+                                tuple(table_managers)).fetchall()
+            for username, module_type, content in rows:
+                conn.execute("SAVEPOINT migrate_blob")
+                try:
+                    data = json.loads(content) if content else {}
+                    backup = f"{module_type}:legacy"
+                    if conn.execute("SELECT 1 FROM user_modules WHERE username=? AND module_type=?", (username, backup)).fetchone():
+                        backup = f"{backup}:{int(time.time())}"  # 已有备份时另起一行，不覆盖
+                    cur = conn.execute("UPDATE user_modules SET module_type=? WHERE username=? AND module_type=?",
+                                       (backup, username, module_type))
+                    if cur.rowcount == 1:
+                        table_managers[module_type]._replace_rows(conn, username, data if isinstance(data, dict) else {})
+                        done += 1
+                    conn.execute("RELEASE migrate_blob")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO migrate_blob")
+                    conn.execute("RELEASE migrate_blob")
+                    print(f"[DB] ⚠️ 迁移 {username}/{module_type} 失败: {e}")
+    except sqlite3.Error as e:
+        if 'no such table' not in str(e):  # 新库还没有 user_modules 表
+            print(f"[DB] ⚠️ 模块 JSON 迁移失败: {e}")
+        return
+    if done: print(f"[DB] 📦 已将 {done} 个模块 JSON 迁移到行级表")
+
+migrate_module_blobs()
 exporter = ExportManager()
 
 # 注入到 shared 供装饰器使用
@@ -3,7 +3,7 @@ import os
 import psutil # 记得 pip install psutil
 import platform
 from shared import CACHE_DIR, USER_DATA_DIR, admin_required
-from managers import role_manager, get_db, cluster_manager
+from managers import role_manager, get_db, cluster_manager, history_manager
 from datetime import datetime, timedelta
 import json
 import managers
@@ -322,51 +322,60 @@ def api_admin_system_summary():
             # 2. 统计总藏书量（排除 meta 和系统键）
             book_count = conn.execute("SELECT COUNT(*) FROM user_books WHERE book_key NOT LIKE '@%' AND book_key NOT LIKE '%:meta'").fetchone()[0]
             
-            # 3. 统计全站活跃数据
-            rows = conn.execute("SELECT json_content FROM user_modules WHERE module_type='stats'").fetchall()
-            total_time = 0
-            total_words = 0
-            for row in rows:
-                stats = json.loads(row[0])
-                for d in stats.get('daily_stats', {}).values():
-                    total_time += d.get('time', 0)
-                    total_words += d.get('words', 0)
+            # 3. 统计全站活跃数据 (先把缓冲中的阅读心跳落库)
+            managers.stats_manager.flush()
+            total_time, total_words = (conn.execute("SELECT time, words FROM site_stats_totals WHERE id=1").fetchone() or (0, 0))
             
             return jsonify({
                 "status": "success",
                 "users": user_count,
                 "books": book_count,
                 "total_time_hr": round(total_time / 60, 1),
-                "total_words_wan": round(total_words / 10000, 2)
+                "total_words_wan": round(total_words / 10000, 2),
+                "stats_buffer": managers.stats_manager.stats()
             })
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
+@admin_bp.route('/api/admin/search_stats')
+@admin_required
+def api_admin_search_stats():
+    """搜索相关缓存的命中率 (结果缓存 / 加密链解析缓存)、各搜索源延迟与书源质量得分"""
+    from spider_core import searcher, crawler_instance
+    return jsonify({
+        "status": "success",
+        "result_cache": searcher.result_cache.stats(),
+        "link_cache": searcher.link_cache.stats(),
+        "suggest_index": searcher.suggest_index.stats(),
+        "engines": searcher.engine_stats.snapshot(),
+        "source_quality": crawler_instance.source_quality.snapshot(),
+        "chapter_latency": crawler_instance.chapter_latency.snapshot(),
+        "alignment": crawler_instance.alignment.stats(),
+    })
+
 @admin_bp.route('/api/admin/activity_stats')
 @admin_required
 def api_admin_activity_stats():
     try:
         with get_db() as conn:
-            # 获取所有用户的 stats 模块
-            rows = conn.execute("SELECT json_content FROM user_modules WHERE module_type='stats'").fetchall()
-            
-            # 聚合每天的总阅读时长
-            aggregate = {}
-            for row in rows:
-                stats = json.loads(row[0])
-                daily = stats.get('daily_stats', {})
-                for date_str, data in daily.items():
-                    aggregate[date_str] = aggregate.get(date_str, 0) + data.get('time', 0)
+            # 聚合最近 30 天每天的总阅读时长 (先把缓冲中的阅读心跳落库)
+            managers.stats_manager.flush()
+            today = datetime.now()
+            since = (today - timedelta(days=29)).strftime('%Y-%m-%d')
+            rows = conn.execute("SELECT day, time, active_users FROM site_stats_daily WHERE day >= ?", (since,)).fetchall()
+            aggregate = {r[0]: r[1] for r in rows}
+            active = {r[0]: r[2] for r in rows}
             
             # 转换为 Chart.js 格式（最近 30 天）
-            today = datetime.now()
             labels = []
             values = []
+            users = []
             for i in range(29, -1, -1):
                 d = (today - timedelta(days=i)).strftime('%Y-%m-%d')
                 labels.append(d[5:]) # 只取 MM-DD
                 values.append(round(aggregate.get(d, 0) / 60, 1)) # 转为小时
+                users.append(active.get(d, 0))
             
-            return jsonify({"status": "success", "labels": labels, "values": values})
+            return jsonify({"status": "success", "labels": labels, "values": values, "active_users": users})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -376,20 +385,15 @@ def api_admin_activity_stats():
 def api_admin_user_detail(username):
     try:
         with get_db() as conn:
-            # A. 获取统计信息
-            stats_row = conn.execute("SELECT json_content FROM user_modules WHERE username=? AND module_type='stats'", (username,)).fetchone()
-            stats = json.loads(stats_row[0]) if stats_row else {"daily_stats": {}}
+            # A. 获取统计信息 (总时长和总字数)
+            managers.stats_manager.flush()
+            total_time, total_words = conn.execute("SELECT COALESCE(SUM(time), 0), COALESCE(SUM(words), 0) FROM user_stats_totals WHERE username=?", (username,)).fetchone()
             
             # B. 获取历史记录 (取前 5)
-            hist_row = conn.execute("SELECT json_content FROM user_modules WHERE username=? AND module_type='history'", (username,)).fetchone()
-            history = json.loads(hist_row[0]).get('records', [])[:5] if hist_row else []
+            history = history_manager.load(username).get('records', [])[:5]
             
             # C. 获取藏书总数
             book_count = conn.execute("SELECT COUNT(*) FROM user_books WHERE username=? AND book_key NOT LIKE '@%'", (username,)).fetchone()[0]
-            
-            # 计算总时长和总字数
-            total_time = sum(d.get('time', 0) for d in stats.get('daily_stats', {}).values())
-            total_words = sum(d.get('words', 0) for d in stats.get('daily_stats', {}).values())
 
             return jsonify({
                 "status": "success",
@@ -4,7 +4,8 @@ import requests
 import os
 from shared import login_required, is_safe_url, BASE_DIR, DL_DIR
 import managers
-from spider_core import crawler_instance as crawler, searcher, epub_handler, parse_chapter_id
+from spider_core import crawler_instance as crawler, searcher, epub_handler, parse_chapter_id, FetchContext, TocIndexStore
+from compact_toc import CompactToc
 import re
 core_bp = Blueprint('core', __name__)
 DEFAULT_SERVER = 'https://auth.ztrztr.top'
@@ -36,7 +37,7 @@ def detect_page_type(data):
     # === [优先级2] 数据结构特征检测 ===
     # 检查是否有 chapters 列表（典型的目录页特征）
     chapters = data.get('chapters', [])
-    if isinstance(chapters, list) and len(chapters) > 3:  # 至少3章才算目录
+    if isinstance(chapters, (list, CompactToc)) and len(chapters) > 3:  # 至少3章才算目录
         print(f"[Smart Detect] 发现 {len(chapters)} 个章节 → 判定为目录页")
         return 'toc'
     
@@ -293,7 +294,23 @@ def read_mode():
             data = managers.offline_manager.get_chapter(k, u) if k and not force else None
             if not data and not force: data = managers.cache.get(u)
             if not data:
-                data = crawler.run(u)
+                # 阅读请求整体 25 秒截止：排队、重试、分页缝合都不越过它
+                read_ctx = FetchContext(timeout=crawler.timeout, priority='interactive', user=get_current_user(), budget=25)
+                # 对冲读取 (HEDGED_READ=1 或 ?hedge=1)：主源慢于近期 p90 时同时抓镜像，谁先到用谁
+                hedge = request.args.get('hedge')
+                if hedge == '1' or (crawler.hedged_read and hedge != '0'):
+                    data, u = crawler.run_hedged(u, ctx=read_ctx)
+                else:
+                    data = crawler.run(u, ctx=read_ctx)
+                if not data:
+                    # 主源抓取失败：查对齐表，用镜像站的同一章顶上 (剩余时间内最多试两个)
+                    for alt in crawler.alignment.alternatives(url=u)[:2]:
+                        if read_ctx.expired(): break
+                        print(f"[Read] 🔀 主源不可用，改用对齐镜像 {alt['source']}: {alt['url']}")
+                        data = crawler.run(alt['url'], ctx=read_ctx)
+                        if data:
+                            u = alt['url']
+                            break
                 if data: managers.cache.set(u, data)
 
     except Exception as e:
@@ -372,7 +389,18 @@ def read_mode():
 
         # 计算 ID
         current_chapter_id = -1
-        if data.get('title'):
+        # [新增] 优先查目录索引 (O(1)，不受站点数据库 ID 干扰)
+        chapter_loc = None
+        if not u.startswith('epub:') and data.get('toc_url'):
+            chapter_loc = crawler.toc_index.locate(data['toc_url'], u)
+        if chapter_loc:
+            current_chapter_id = chapter_loc['id'] if chapter_loc['id'] > 0 else chapter_loc['pos'] + 1
+            if not (data.get('next') or data.get('next_url')) and chapter_loc['next_url']:
+                data['next'] = chapter_loc['next_url']
+            if not (data.get('prev') or data.get('prev_url')) and chapter_loc['prev_url']:
+                data['prev'] = chapter_loc['prev_url']
+
+        if current_chapter_id <= 0 and data.get('title'):
             current_chapter_id = parse_chapter_id(data['title'])
         
         # 网页版 URL 兜底 ID
@@ -394,7 +422,9 @@ def read_mode():
                     'toc_url': data.get('toc_url') or (managers.db.find(k)['url'] if k and managers.db.find(k) else '')
                 },
                 'current_url': u,
-                'chapter_id': current_chapter_id
+                'chapter_id': current_chapter_id,
+                'chapter_pos': chapter_loc['pos'] if chapter_loc else -1,
+                'chapter_total': chapter_loc['total'] if chapter_loc else 0
             })
 
         # 6. 渲染页面
@@ -525,9 +555,20 @@ def insert():
     res = managers.db.insert(key, final_value)
     if is_manual and res.get('status') == 'success':
         managers.db.add_version(key, final_value)
+        # 手动加入书架的书收录进联想索引
+        searcher.suggest_index.add_shelf_book(key, final_value, managers.get_current_user())
         
     return jsonify(res)
 
+def _book_title_for_key(key):
+    """书架 key 对应的中文书名：书单里的标题优先，其次 key 本身含中文时直接用"""
+    if not key: return None
+    for list_data in managers.booklist_manager.load().values():
+        for b in list_data.get('books', []):
+            if b.get('key') == key and b.get('title'):
+                return b['title']
+    return key if re.search(r'[\u4e00-\u9fa5]', key) else None
+
 @core_bp.route('/api/quick_save', methods=['POST'])
 @login_required
 def api_quick_save():
@@ -545,6 +586,8 @@ def api_quick_save():
     res = managers.db.insert(key, url)
     
     if res.get('status') == 'success':
+        # 后台建换源对齐表 (之后换源 / 源站挂掉时直接查表)
+        crawler.alignment.schedule_build(_book_title_for_key(key), url)
         return jsonify({"status": "success", "message": "已保存到书架"})
     else:
         return jsonify({"status": "error", "message": res.get('message', '保存失败')})
@@ -655,6 +698,17 @@ def api_switch_source():
         if not book_name:
             return jsonify({"status": "error", "msg": "无法获取书名，请先将书加入书单"})
 
+        # 0. 已建过对齐表的书直接查表 (不用现场搜索 + 拉目录)
+        aligned = crawler.alignment.alternatives(url=current_url, book_name=book_name)
+        if aligned:
+            new_url = aligned[0]['url']
+            managers.db.update(book_key, new_url)
+            return jsonify({
+                "status": "success",
+                "new_url": new_url,
+                "msg": f"已切换至: {aligned[0]['source']}"
+            })
+
         # 2. 获取当前章节 ID
         if cached_page and cached_page.get('title'):
              current_id = parse_chapter_id(cached_page['title'])
@@ -759,6 +813,17 @@ def api_source_list():
     # 改为直接返回搜索结果，不做耗时的验证
     from spider_core import searcher
     sources = searcher.search_bing(book_name) if force else searcher.search_bing_cached(book_name)
+
+    # 对齐表里已有的镜像排在前面 (确认时查表秒切)，搜索结果里没有的也补上
+    aligned = crawler.alignment.alternatives(url=current_url, book_name=book_name, chapter_id=current_id, title=frontend_title)
+    if aligned:
+        by_toc = {TocIndexStore.normalize(a['toc_url']): a for a in aligned}
+        sources = sources or []
+        for src in sources:
+            if by_toc.pop(TocIndexStore.normalize(src.get('url', '')), None): src['aligned'] = True
+        sources += [{'title': book_name, 'url': a['toc_url'], 'source': a['source'],
+                     'description': '已对齐', 'aligned': True} for a in by_toc.values()]
+        sources.sort(key=lambda src: not src.get('aligned'))
     
     if not sources:
         return jsonify({"status": "failed", "msg": "全网未找到相关书籍"})
@@ -769,7 +834,9 @@ def api_source_list():
         # 回传上下文，供前端二次确认使用
         "match_info": {
             "current_id": current_id,
-            "current_title": frontend_title
+            "current_title": frontend_title,
+            "current_url": current_url,
+            "book_name": book_name
         }
     })
 
@@ -783,6 +850,14 @@ def api_confirm_switch():
     
     if not target_url: return jsonify({"status": "error", "msg": "Target URL missing"})
 
+    # 目标源在对齐表里：直接查表
+    aligned = crawler.alignment.alternatives(url=data.get('current_url'), book_name=data.get('book_name'),
+                                             chapter_id=current_id, title=current_title)
+    target = TocIndexStore.normalize(target_url)
+    for a in aligned:
+        if TocIndexStore.normalize(a['toc_url']) == target:
+            return jsonify({"status": "success", "new_url": a['url']})
+
     new_url = crawler.find_best_match(target_url, current_id, current_title)
     
     if new_url:
@@ -907,8 +982,9 @@ def api_prefetch():
     if hasattr(crawler, '_active_tasks') and u in crawler._active_tasks:
         return jsonify({"status": "pending", "msg": "正在爬取中，请稍候"})
     
-    # 提交爬取任务（自动去重）
-    d = crawler.run(u)
+    # 提交爬取任务（自动去重，预读优先级低于正在阅读的请求）
+    with crawler.scheduler.context('prefetch', get_current_user()):
+        d = crawler.run(u)
     if d:
         managers.cache.set(u, d)
         return jsonify({"status": "success"})
@@ -931,12 +1007,81 @@ def api_search():
     try:
         keyword = request.json.get('keyword') if request.json else None
         if not keyword: return jsonify({"status": "error", "message": "缺少关键词"})
-        tid = managers.task_manager.submit(_worker_search, keyword)
+        # force=true 时跳过搜索缓存，重新搜索并刷新缓存
+        force = bool(request.json.get('force'))
+        tid = managers.task_manager.submit(_worker_search, keyword, force=force)
         return jsonify({"status": "pending", "task_id": tid})
     except Exception as e:
         print(f"[Search Error] {e}")
         return jsonify({"status": "error", "message": str(e)})
 
+@core_bp.route('/api/search_stream')
+@login_required
+def api_search_stream():
+    """
+    搜索进度 + 结果的 SSE 推送 (替代 /api/search_novel + 轮询 /api/task_status)
+    每个搜索源完成就推送它新增的条目，首条结果的等待时间 = 最快的那个源
+    事件: progress {progress, message} / items [新增条目] / done {count} / error {message}
+    """
+    import json
+    import queue
+    from flask import Response, stream_with_context
+
+    keyword = (request.args.get('keyword') or '').strip()
+    if not keyword:
+        return jsonify({"status": "error", "message": "缺少关键词"}), 400
+    force = request.args.get('force') in ('1', 'true')
+    events = queue.Queue()
+
+    def on_progress(progress=None, msg=None, new_items=None):
+        if progress is not None or msg:
+            events.put(('progress', {"progress": progress, "message": msg}))
+        if new_items:
+            events.put(('items', new_items))
+
+    def worker():
+        try:
+            results = searcher.search_concurrent(keyword, on_progress, use_cache=not force)
+            events.put(('done', {"count": len(results or [])}))
+        except Exception as e:
+            print(f"[Search Stream] ❌ {keyword}: {e}")
+            events.put(('error', {"message": str(e)}))
+
+    # 浏览器断开后搜索仍会跑完 (结果进搜索缓存，下次秒回)
+    threading.Thread(target=worker, daemon=True).start()
+
+    def generate():
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event, data = events.get(timeout=15)
+            except queue.Empty:
+                yield ": ping\n\n"  # 保活，防止反向代理断开空闲连接
+                continue
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+            if event in ('done', 'error'): break
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # nginx 不缓冲
+    })
+
+@core_bp.route('/api/search_suggest')
+@login_required
+def api_search_suggest():
+    """
+    输入联想：只查本地内存索引 (自己的书架 / 历史搜索 / 书库)，不发任何网络请求
+    支持书名、作者、全拼、拼音首字母前缀；cached=true 表示这本书有现成的搜索缓存，回车即出结果
+    """
+    q = (request.args.get('q') or '').strip()
+    if not q: return jsonify({"status": "success", "data": []})
+    try: limit = max(1, min(int(request.args.get('limit', 8)), 20))
+    except ValueError: limit = 8
+    data = searcher.suggest_index.suggest(q, limit, username=managers.get_current_user())
+    for item in data:
+        item['cached'] = searcher.result_cache.peek(item['title'])
+    return jsonify({"status": "success", "data": data})
+
 @core_bp.route('/api/upload_epub', methods=['POST'])
 @login_required
 def api_upload_epub():
@@ -952,6 +1097,7 @@ def api_upload_epub():
         k = searcher.get_pinyin_key(os.path.splitext(fn)[0])
         v = f"epub:{fn}:toc"
         managers.db.insert(k, v)
+        searcher.suggest_index.add(os.path.splitext(fn)[0], source='epub')
         return jsonify({"status": "success", "key": k, "value": v})
     except Exception as e:
         print(f"[Upload Error] {e}")
@@ -961,13 +1107,13 @@ from managers import db, update_manager, booklist_manager, task_manager, get_cur
 
 # === 异步任务 Worker 函数 ===
 
-def _worker_search(keyword, callback=None):
-    """后台搜索任务"""
+def _worker_search(keyword, callback=None, force=False):
+    """后台搜索任务 (默认走搜索缓存)"""
     # 如果有 callback (即来自 TaskManager 的 update_task), 传入 search_concurrent
     if callback:
-         return searcher.search_concurrent(keyword, callback)
+         return searcher.search_concurrent(keyword, callback, use_cache=not force)
     # 否则兼容旧调用
-    return searcher.search_bing(keyword)
+    return searcher.search_bing(keyword) if force else searcher.search_bing_cached(keyword)
 
 def _worker_check_update(book_key, current_url, callback=None, username=None):
     """后台检查更新任务"""
@@ -1060,7 +1206,17 @@ def _worker_check_update(book_key, current_url, callback=None, username=None):
             "status_text": "已最新"
         }
         
-        # A. 获取当前阅读章节 ID
+        # A. [新增] 目录索引能定位到当前章节时，直接按位置算落后章数
+        loc = crawler.toc_index.locate(toc_url, current_url)
+        if loc:
+            if loc['behind'] > 0:
+                response_data["unread_count"] = loc['behind']
+                response_data["status_text"] = f"落后 {loc['behind']} 章"
+            else:
+                response_data["status_text"] = "已追平"
+            return {"status": "success", "data": response_data, "msg": "刷新成功"}
+
+        # B. 索引缺失时回退：获取当前阅读章节 ID
         current_id = parse_chapter_id(current_url)
         if current_id <= 0:
             match = re.search(r'/(\d+)(?:_\d+)?(?:\.html)?$', current_url)
@@ -1068,7 +1224,7 @@ def _worker_check_update(book_key, current_url, callback=None, username=None):
         
         latest_id = save_data['latest_id']
         
-        # B. 执行比对
+        # C. 执行比对
         if latest_id > 0 and current_id > 0:
             diff = latest_id - current_id
             if diff > 0:
@@ -1104,7 +1260,8 @@ def api_check_update():
     
     # 提交异步任务
     username = get_current_user()
-    tid = managers.task_manager.submit(_worker_check_update, book_key, current_url, username=username)
+    check = crawler.scheduler.wrap(_worker_check_update, 'update', username)
+    tid = managers.task_manager.submit(check, book_key, current_url, username=username)
     return jsonify({"status": "pending", "task_id": tid})
 
 
@@ -1172,15 +1329,6 @@ def api_get_updates_status():
         elif isinstance(val_obj, str): current_url = val_obj
         if not current_url: continue
 
-        # 计算当前章节 ID (Current ID)
-        current_id = -1
-        # cached_page = managers.cache.get(current_url) 
-        
-        match = re.search(r'/(\d+)(?:_\d+)?(?:\.html)?$', current_url)
-        if match: current_id = int(match.group(1))
-
-        if current_id <= 0: continue 
-
         # === Step 2: 获取最新章节信息 (Logic Branching) ===
         latest_id = -1
         latest_title = ""
@@ -1188,6 +1336,28 @@ def api_get_updates_status():
 
         # --- A. Modern Path (新逻辑: SQLite) ---
         sub_status = managers.update_sub_manager.get_book_status(key)
+        legacy_info = legacy_records.get(key)
+
+        # [新增] 目录索引命中时按位置计算，避免把站点数据库 ID 当成章节号
+        toc_url = (sub_status or {}).get('toc_url') or (legacy_info or {}).get('toc_url')
+        remote_id = sub_status.get('remote_id', 0) if sub_status and sub_status.get('subscribed') else 0
+        loc = crawler.toc_index.locate(toc_url, current_url, latest_id=remote_id) if toc_url else None
+        if loc:
+            behind = loc['behind']
+            response_data[key] = {
+                "unread_count": behind,
+                "status_text": f"落后 {behind} 章" if behind > 0 else "已追平",
+                "latest_title": (legacy_info or {}).get('latest_title', '') or "最新章节",
+                "debug_source": "toc_index"
+            }
+            continue
+
+        # 计算当前章节 ID (Current ID)
+        current_id = -1
+        match = re.search(r'/(\d+)(?:_\d+)?(?:\.html)?$', current_url)
+        if match: current_id = int(match.group(1))
+
+        if current_id <= 0: continue 
         
         # [关键判定] 只要 subscribed 且 remote_id > 0，就采信
         if sub_status and sub_status.get('subscribed') and sub_status.get('remote_id', 0) > 0:
@@ -1197,7 +1367,6 @@ def api_get_updates_status():
         
         # --- B. Legacy Path (旧逻辑: JSON) ---
         if latest_id <= 0:
-            legacy_info = legacy_records.get(key)
             if legacy_info:
                 lid = int(legacy_info.get('latest_id', -1))
                 if lid <= 0 and legacy_info.get('latest_title'):
@@ -1389,8 +1558,9 @@ def api_subscribe():
                 traceback.print_exc()
                 print(f"[Instant Check] 失败: {e}")
 
-        threading.Thread(target=_instant_check, args=(user_db_val,), daemon=True).start()
+        threading.Thread(target=crawler.scheduler.wrap(_instant_check, 'update', username), args=(user_db_val,), daemon=True).start()
 
+        crawler.alignment.schedule_build(_book_title_for_key(key), toc_url)
         return jsonify({"status": "success", "msg": "已开启追更，正在后台立即检查..."})
     else:
         managers.update_sub_manager.unsubscribe(key)
@@ -1638,7 +1808,8 @@ def start_export():
             export_format=export_format,
             metadata=metadata,
             resume_task_id=resume_task_id,
-            delay=delay
+            delay=delay,
+            username=get_current_user()
         )
         
         return jsonify({"status": "success", "task_id": task_id})
@@ -63,7 +63,9 @@ def api_pro_download_book():
         full_data = {}
         # 建议根据服务器配置调整 max_workers，10-15 是比较激进但高效的值
         with ThreadPoolExecutor(max_workers=12) as exe:
-            future_to_url = {exe.submit(crawler.run, c['url']): c['url'] for c in toc['chapters']}
+            # 离线下载属于批量任务，在全局调度器里排在阅读/预读/追更之后
+            bulk_run = crawler.scheduler.wrap(crawler.run, 'bulk')
+            future_to_url = {exe.submit(bulk_run, c['url']): c['url'] for c in toc['chapters']}
             
             # 进度计数
             total = len(toc['chapters'])
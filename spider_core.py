@@ -3,19 +3,29 @@ import random
 import re
 import os
 import importlib.util
+import inspect
 import hashlib
+import heapq
+import bisect
+from contextlib import contextmanager
+import json
+import threading
 from urllib.parse import urljoin, urlparse, quote
-from difflib import SequenceMatcher
+from collections import OrderedDict, deque
 from urllib.request import getproxies
 from curl_cffi import requests as cffi_requests
 from bs4 import BeautifulSoup
 from lxml import html as lxml_html
+from lxml import etree as lxml_etree
 from pypinyin import lazy_pinyin, Style
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait as futures_wait, FIRST_COMPLETED
+from functools import partial
 from ebooklib import epub
 from werkzeug.utils import secure_filename
 # [确保这里有 CACHE_DIR]
-from shared import BASE_DIR, LIB_DIR, CACHE_DIR
+from shared import BASE_DIR, LIB_DIR, CACHE_DIR, USER_DATA_DIR
+from compact_toc import CompactToc, pack_toc, unpack_toc
+from title_matcher import get_title_index, best_ratio, clean_chapter_title
 from curl_cffi import requests as cffi_requests, CurlHttpVersion
 
 # ==========================================
@@ -23,9 +33,10 @@ from curl_cffi import requests as cffi_requests, CurlHttpVersion
 # ==========================================
 # spider_core.py
 
-def _remote_request(endpoint, payload):
+def _remote_request(endpoint, payload, wait=25):
     """
     远程爬取请求（带延迟自动记录）
+    :param wait: 最多等 Worker 多少秒 (调用方有截止时间时传剩余时间)
     返回: (data, worker_uuid, latency_ms) 或 None
     """
     # [关键修复] Worker节点执行时跳过远程请求，直接返回None降级到本地爬取
@@ -65,7 +76,7 @@ def _remote_request(endpoint, payload):
     start_time = time.time()
     result_key = f"crawler:result:{task_id}"
     
-    while time.time() - start_time < 25:
+    while time.time() - start_time < wait:
         res = cluster_manager.r.get(result_key)
         if res:
             # 计算延迟
@@ -160,6 +171,482 @@ def _smart_convert_int(s):
     return result
     
 
+# ==========================================
+# 0.5 单飞去重 (Single-Flight)
+# ==========================================
+class SingleFlight:
+    """
+    同一个 key 同一时刻只执行一次：第一个调用者真正干活，其余调用者等待并共享结果
+    - 等待超时的调用者自己执行一次 (防止主任务卡死拖住所有人)
+    - 主任务抛出的异常会原样抛给等待者
+    - shareable(result) 为假的结果 (如截止时间截断的残缺目录) 不分给等待者，等待者自己执行
+    """
+    def __init__(self, name="single_flight"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}  # {key: {'event', 'result', 'error', 'waiters'}}
+        self._stats = {'leaders': 0, 'shared': 0, 'timeouts': 0}
+
+    def do(self, key, fn, *args, wait_timeout=30, shareable=None, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {'event': threading.Event(), 'result': None, 'error': None, 'waiters': 0, 'shared': True}
+                self._calls[key] = call
+                is_leader = True
+                self._stats['leaders'] += 1
+            else:
+                call['waiters'] += 1
+                is_leader = False
+
+        if not is_leader:
+            if call['event'].wait(timeout=wait_timeout):
+                if call['error'] is not None: raise call['error']
+                if not call['shared']: return fn(*args, **kwargs)
+                with self._lock: self._stats['shared'] += 1
+                return call['result']
+            with self._lock: self._stats['timeouts'] += 1
+            print(f"[{self.name}] ⏰ 等待超时，自行执行: {str(key)[:80]}")
+            return fn(*args, **kwargs)
+
+        try:
+            call['result'] = fn(*args, **kwargs)
+            if shareable is not None and not shareable(call['result']): call['shared'] = False
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+                waiters = call['waiters']
+            call['event'].set()
+            if waiters and call['shared']:
+                print(f"[{self.name}] 📢 {waiters} 个等待者共享结果: {str(key)[:80]}")
+            elif waiters:
+                print(f"[{self.name}] ✂️ 结果不可共享，{waiters} 个等待者自行执行: {str(key)[:80]}")
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
+
+# 全局实例：目录 / 搜索 / 元数据共用
+single_flight = SingleFlight()
+
+
+class ClusterSingleFlight:
+    """
+    跨进程单飞：多 worker 的 WSGI / 多台 Master 之间同一个 key 也只抓一次
+    - 先过本进程的 SingleFlight，每个进程只有一个调用者会去 Redis 抢租约
+    - 租约: SET crawler:sf:lock:<k> <token> NX PX <lease_ms>，持有者执行，进程挂了租约自动过期
+    - 结果: 持有者把结果写入 crawler:sf:result:<k> (短 TTL，兜住订阅前就已发布的竞态)，
+      再 PUBLISH 到 crawler:sf:done:<k>，最后比对 token 释放租约
+    - 等待者订阅结果频道；租约消失却没有结果时自己抢租约重做，等待超时则自己执行
+    - 没有 Redis (或 Redis 出错) 时退化为本地 SingleFlight
+    结果需要能 JSON 序列化，特殊对象通过 encode/decode 钩子转换 (如目录的 pack_toc/unpack_toc)
+    """
+    _RELEASE_LUA = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, local=None, prefix="crawler:sf", result_ttl_ms=15000):
+        self.local = local or single_flight
+        self.prefix = prefix
+        self.result_ttl_ms = result_ttl_ms
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'remote_shared': 0, 'takeovers': 0, 'timeouts': 0, 'fallbacks': 0}
+
+    def _redis(self):
+        # 必须在函数内部导入，防止循环引用 (Worker 侧的 managers 也可能是替身)
+        if os.environ.get('FORCE_LOCAL_CRAWL') == '1': return None
+        try:
+            from managers import cluster_manager
+            if cluster_manager.use_redis and cluster_manager.r is not None:
+                return cluster_manager.r
+        except Exception:
+            pass
+        return None
+
+    def _count(self, name):
+        with self._lock: self._stats[name] += 1
+
+    def _keys(self, key):
+        digest = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+        return (f"{self.prefix}:lock:{digest}", f"{self.prefix}:result:{digest}", f"{self.prefix}:done:{digest}")
+
+    def do(self, key, fn, *args, wait_timeout=30, lease_ms=60000, encode=None, decode=None, local=True, shareable=None, **kwargs):
+        """
+        :param local: False 表示调用方已经做过本进程去重 (如 run 的 _active_tasks)，直接走跨进程这一层
+        :param shareable: 结果是否可以发布给其他进程的等待者 (如半章不发布)；不可共享时等待者自己执行
+        """
+        if local:
+            return self.local.do(key, self._cluster_do, key, fn, args, kwargs, wait_timeout, lease_ms, encode, decode,
+                                 shareable, wait_timeout=wait_timeout, shareable=shareable)
+        return self._cluster_do(key, fn, args, kwargs, wait_timeout, lease_ms, encode, decode, shareable)
+
+    def _cluster_do(self, key, fn, args, kwargs, wait_timeout, lease_ms, encode, decode, shareable=None):
+        r = self._redis()
+        if r is None: return fn(*args, **kwargs)
+        lock_key, result_key, channel = self._keys(key)
+        token = f"{os.getpid()}:{threading.get_ident()}:{time.time()}"
+        try:
+            acquired = r.set(lock_key, token, nx=True, px=int(lease_ms))
+        except Exception as e:
+            print(f"[ClusterFlight] ⚠️ Redis 不可用，退化为本地执行: {e}")
+            self._count('fallbacks')
+            return fn(*args, **kwargs)
+        if acquired:
+            return self._lead(r, key, token, fn, args, kwargs, encode, shareable)
+        return self._wait(r, key, token, fn, args, kwargs, wait_timeout, lease_ms, encode, decode, shareable)
+
+    def _lead(self, r, key, token, fn, args, kwargs, encode, shareable=None):
+        lock_key, result_key, channel = self._keys(key)
+        self._count('leaders')
+        envelope = {'ok': False}
+        try:
+            result = fn(*args, **kwargs)
+            if shareable is None or shareable(result):
+                envelope = {'ok': True, 'data': encode(result) if (encode and result is not None) else result}
+            return result
+        finally:
+            try:
+                payload = json.dumps(envelope, ensure_ascii=False)
+                pipe = r.pipeline()
+                if envelope['ok']: pipe.set(result_key, payload, px=self.result_ttl_ms)
+                pipe.publish(channel, payload)
+                pipe.eval(self._RELEASE_LUA, 1, lock_key, token)
+                pipe.execute()
+            except Exception as e:
+                print(f"[ClusterFlight] ⚠️ 结果发布失败 {str(key)[:80]}: {e}")
+
+    def _unwrap(self, raw, decode):
+        envelope = json.loads(raw)
+        if not envelope.get('ok'): return False, None
+        data = envelope.get('data')
+        return True, (decode(data) if (decode and data is not None) else data)
+
+    def _wait(self, r, key, token, fn, args, kwargs, wait_timeout, lease_ms, encode, decode, shareable=None):
+        lock_key, result_key, channel = self._keys(key)
+        give_up = time.monotonic() + wait_timeout
+        pubsub = None
+        outcome = ('timeouts', "等待超时")
+        try:
+            pubsub = r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(channel)
+            while True:
+                # 先订阅再查结果：持有者在我们订阅前就发布了也能拿到
+                raw = r.get(result_key)
+                if raw is None:
+                    left = give_up - time.monotonic()
+                    if left <= 0: break
+                    msg = pubsub.get_message(timeout=min(1.0, left))
+                    if msg and msg.get('type') == 'message': raw = msg['data']
+                if raw is not None:
+                    ok, result = self._unwrap(raw, decode)
+                    if not ok:
+                        outcome = ('fallbacks', "持有者执行出错")
+                        break
+                    self._count('remote_shared')
+                    print(f"[ClusterFlight] 📥 共享其他进程的结果: {str(key)[:80]}")
+                    return result
+                # 持有者挂了 (租约过期且没留下结果)：接管
+                if not r.exists(lock_key) and r.set(lock_key, token, nx=True, px=int(lease_ms)):
+                    outcome = ('takeovers', None)
+                    break
+        except Exception as e:
+            outcome = ('fallbacks', f"等待结果出错 ({e})")
+        finally:
+            if pubsub is not None:
+                try: pubsub.close()
+                except Exception: pass
+
+        stat, reason = outcome
+        self._count(stat)
+        if stat == 'takeovers':
+            print(f"[ClusterFlight] 🔁 持有者已消失，接管执行: {str(key)[:80]}")
+            return self._lead(r, key, token, fn, args, kwargs, encode, shareable)
+        print(f"[ClusterFlight] ⏰ {reason}，自行执行: {str(key)[:80]}")
+        return fn(*args, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, redis=self._redis() is not None)
+
+# 全局实例：目录 / 章节抓取跨进程去重
+cluster_flight = ClusterSingleFlight()
+
+
+class TTLReaper:
+    """
+    单线程到期清理器：按到期时间放进小顶堆，只有一个守护线程按顺序处理
+    用来替代"每个任务起一个 threading.Timer"，批量任务时线程数保持恒定
+    """
+    def __init__(self, name="ttl_reaper"):
+        self.name = name
+        self._heap = []   # [(expire_at, seq, callback)]
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _ensure_thread(self):
+        """调用方需持有 self._cond"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+
+    def schedule(self, ttl, callback):
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (time.time() + ttl, self._seq, callback))
+            self._ensure_thread()
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                expire_at, _, callback = self._heap[0]
+                delay = expire_at - time.time()
+                if delay > 0:
+                    self._cond.wait(timeout=delay)
+                    continue
+                heapq.heappop(self._heap)
+            try:
+                callback()
+            except Exception as e:
+                print(f"[{self.name}] 清理回调出错: {e}")
+
+# 全局实例
+task_reaper = TTLReaper()
+
+
+class CrawlScheduler:
+    """
+    全局抓取调度器：所有 _fetch_page_smart 请求在这里排队拿"出网名额"
+    - 优先级: interactive(阅读) > prefetch(预读) > update(追更检查) > bulk(导出/离线下载)
+    - 同一优先级内按用户当前占用的名额数排队 (占得少的先走)，避免一个人的导出挤占所有人
+    - 全局并发上限 + 单域名并发上限对所有类别生效
+    - 预留若干名额只给 interactive，后台任务再多阅读页也不用排队
+    优先级和用户通过线程上下文传递：with crawl_scheduler.context('bulk', user): ...
+    没有设置上下文的线程 (后台线程、线程池) 一律按 update 排队；Web 请求线程由 before_request 钩子显式标成 interactive
+    """
+    INTERACTIVE, PREFETCH, UPDATE, BULK = 0, 1, 2, 3
+    _NAMES = {'interactive': 0, 'prefetch': 1, 'update': 2, 'bulk': 3}
+
+    def __init__(self, global_limit=16, per_domain_limit=4, reserved_interactive=4):
+        self.global_limit = global_limit
+        self.per_domain_limit = per_domain_limit
+        self.reserved_interactive = min(reserved_interactive, global_limit - 1)
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._waiting = []          # [(priority, seq, user, domain)]
+        self._seq = 0
+        self._running = 0
+        self._by_domain = {}        # {domain: 运行中数量}
+        self._by_user = {}          # {user: 运行中数量}
+        self._granted = {0: 0, 1: 0, 2: 0, 3: 0}
+
+    # ---------- 上下文 ----------
+    def _level(self, priority):
+        if isinstance(priority, str): return self._NAMES.get(priority, self.INTERACTIVE)
+        return priority if priority in (0, 1, 2, 3) else self.INTERACTIVE
+
+    def current(self):
+        """当前线程的 (priority, user)；未设置时视为 update (后台)"""
+        return getattr(self._local, 'priority', self.UPDATE), getattr(self._local, 'user', None)
+
+    def enter(self, priority, user=None):
+        """不方便用 with 的地方 (Flask 请求钩子) 直接设置当前线程的上下文，结束时调用 leave()"""
+        self._local.priority, self._local.user = self._level(priority), user
+
+    def leave(self):
+        """清除 enter() 设置的上下文 (请求线程会被复用，不能把上一个请求的优先级带下去)"""
+        self._local.__dict__.pop('priority', None)
+        self._local.__dict__.pop('user', None)
+
+    @contextmanager
+    def context(self, priority, user=None):
+        old = self.current()
+        self._local.priority, self._local.user = self._level(priority), user if user is not None else old[1]
+        try:
+            yield
+        finally:
+            self._local.priority, self._local.user = old
+
+    def wrap(self, fn, priority=None, user=None):
+        """把当前 (或指定) 上下文带进线程池里的任务"""
+        cur_p, cur_u = self.current()
+        p = self._level(priority) if priority is not None else cur_p
+        u = user if user is not None else cur_u
+
+        def runner(*args, **kwargs):
+            with self.context(p, u):
+                return fn(*args, **kwargs)
+        return runner
+
+    # ---------- 名额 ----------
+    def _has_capacity(self, priority, domain):
+        """调用方需持有 self._cond"""
+        limit = self.global_limit if priority == self.INTERACTIVE else self.global_limit - self.reserved_interactive
+        if self._running >= limit: return False
+        return self._by_domain.get(domain, 0) < self.per_domain_limit
+
+    def _next_ticket(self):
+        """当前最该放行的排队者：优先级 -> 用户占用数 -> 先来后到；跳过域名已满的"""
+        best, best_key = None, None
+        for t in self._waiting:
+            priority, seq, user, domain = t
+            if not self._has_capacity(priority, domain): continue
+            key = (priority, self._by_user.get(user, 0), seq)
+            if best_key is None or key < best_key: best, best_key = t, key
+        return best
+
+    @contextmanager
+    def slot(self, domain, timeout=None):
+        """
+        申请一个出网名额
+        :param timeout: 最多排队多少秒，超时抛 TimeoutError (调用方的截止时间已到，不必再排)
+        """
+        priority, user = self.current()
+        give_up = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._seq += 1
+            ticket = (priority, self._seq, user, domain)
+            self._waiting.append(ticket)
+            while self._next_ticket() is not ticket:
+                wait = 5
+                if give_up is not None:
+                    wait = give_up - time.monotonic()
+                    if wait <= 0:
+                        self._waiting.remove(ticket)
+                        self._cond.notify_all()
+                        raise TimeoutError(f"crawl slot wait timeout: {domain}")
+                    wait = min(wait, 5)
+                self._cond.wait(timeout=wait)
+            self._waiting.remove(ticket)
+            self._running += 1
+            self._by_domain[domain] = self._by_domain.get(domain, 0) + 1
+            self._by_user[user] = self._by_user.get(user, 0) + 1
+            self._granted[priority] += 1
+            # 放行后名额可能还有剩余，叫醒其他排队者重新判断
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._by_domain[domain] -= 1
+                if self._by_domain[domain] <= 0: del self._by_domain[domain]
+                self._by_user[user] -= 1
+                if self._by_user[user] <= 0: del self._by_user[user]
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            names = {v: k for k, v in self._NAMES.items()}
+            return {
+                'running': self._running,
+                'waiting': len(self._waiting),
+                'by_domain': dict(self._by_domain),
+                'granted': {names[k]: v for k, v in self._granted.items()},
+            }
+
+# 全局实例 (上限可通过环境变量调整)
+crawl_scheduler = CrawlScheduler(
+    global_limit=int(os.environ.get('CRAWL_GLOBAL_LIMIT', 16)),
+    per_domain_limit=int(os.environ.get('CRAWL_DOMAIN_LIMIT', 4)),
+)
+
+
+class FetchContext:
+    """
+    单次调用的抓取参数：超时 / 重试次数 / 优先级 / 截止时间
+    显式传给 get_toc / run / _fetch_page_smart / 适配器，代替临时改共享爬虫实例 self.timeout 的做法，
+    并发的 fast_mode 换源验证和正常阅读互不影响。
+    - deadline 是整次调用的截止时间 (time.monotonic)，单次请求超时和重试都不会越过它
+    - priority / user 为 None 时沿用调度器的线程上下文
+    适配器里没透传 ctx 的 _fetch_page_smart 调用，从 fetch_context_scope 设置的线程上下文里取
+    """
+    __slots__ = ('timeout', 'retries', 'priority', 'user', 'deadline', 'cancelled')
+
+    def __init__(self, timeout=15, retries=3, priority=None, user=None, deadline=None, budget=None):
+        self.timeout = timeout
+        self.retries = max(1, int(retries))
+        self.priority = priority
+        self.user = user
+        self.cancelled = False
+        # budget: 从现在起最多花多少秒 (和 deadline 同时给时取更早的那个)
+        if budget is not None:
+            end = time.monotonic() + budget
+            deadline = end if deadline is None else min(deadline, end)
+        self.deadline = deadline
+
+    @classmethod
+    def fast(cls, **kwargs):
+        """换源验证 / 追更检查用：5 秒超时，不重试"""
+        kwargs.setdefault('timeout', 5)
+        kwargs.setdefault('retries', 1)
+        return cls(**kwargs)
+
+    def replace(self, **kwargs):
+        ctx = FetchContext(self.timeout, self.retries, self.priority, self.user, self.deadline)
+        for k, v in kwargs.items(): setattr(ctx, k, v)
+        return ctx
+
+    def remaining(self):
+        """距截止时间还剩多少秒；没有截止时间返回 None"""
+        if self.deadline is None: return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def cancel(self):
+        """立即到期：正在进行的抓取在下一次重试 / 分页 / 排队检查时放弃 (对冲读取里输掉的一方)"""
+        self.cancelled = True
+        self.deadline = time.monotonic()
+
+    def attempt_timeout(self):
+        """本次请求可用的超时 (被截止时间截断)"""
+        left = self.remaining()
+        return self.timeout if left is None else min(self.timeout, left)
+
+    def wait_timeout(self, default):
+        """等待别人结果时最多等多久"""
+        left = self.remaining()
+        return default if left is None else min(default, left)
+
+    def __repr__(self):
+        left = self.remaining()
+        return (f"<FetchContext timeout={self.timeout} retries={self.retries} priority={self.priority}"
+                f" left={'-' if left is None else round(left, 1)}>")
+
+
+_fetch_local = threading.local()
+
+
+def current_fetch_context():
+    """当前线程上生效的 FetchContext (没有则返回 None)"""
+    return getattr(_fetch_local, 'ctx', None)
+
+
+@contextmanager
+def fetch_context_scope(ctx):
+    """在当前线程上挂一个 FetchContext，供没有透传 ctx 的旧适配器代码使用"""
+    old = current_fetch_context()
+    _fetch_local.ctx = ctx
+    try:
+        yield ctx
+    finally:
+        _fetch_local.ctx = old
+
 # ==========================================
 # 1. 插件管理器
 # ==========================================
@@ -265,13 +752,517 @@ from bs4 import BeautifulSoup
 from curl_cffi import requests as cffi_requests
 from pypinyin import lazy_pinyin, Style
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import json
 import datetime
 
 def debug_log(message):
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     with open('debug.txt', 'a', encoding='utf-8') as f:
         f.write(f"[{timestamp}] {message}\n")
+
+
+class SearchResultCache:
+    """
+    搜索结果缓存 (按规范化关键词)
+    - 带 TTL：书源会失效，过期后重新搜
+    - 落盘到 user_data/search_cache.json，重启不丢；条目数有上限，按最近使用淘汰
+    - 配置了 Redis 时多进程 / 多 Master 共享 (search:cache:<md5>，Redis 自己过期)
+    search_concurrent / search_bing_cached / 换源验证都走这里，同一本书反复搜索、换源秒回
+    """
+    def __init__(self, ttl=None, max_entries=300):
+        self.cache_file = os.path.join(USER_DATA_DIR, 'search_cache.json')
+        self.ttl = ttl if ttl is not None else int(os.environ.get('SEARCH_CACHE_TTL', 6 * 3600))
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'redis_hits': 0}
+        self.entries = self._load()  # OrderedDict{norm_key: {'ts', 'keyword', 'results'}}
+
+    @staticmethod
+    def normalize(keyword):
+        """全角转半角、去书名号/空白/标点、小写：'《 诡秘之主 》' 和 '诡秘之主' 命中同一条"""
+        import unicodedata
+        text = unicodedata.normalize('NFKC', keyword or '').lower()
+        return re.sub(r'[\s《》<>"\'“”‘’「」【】\[\]()（）,，.。!！?？:：;；·_-]+', '', text)
+
+    def _load(self):
+        entries = OrderedDict()
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    raw = json.load(f)
+                now = time.time()
+                for k, v in sorted(raw.items(), key=lambda kv: kv[1].get('ts', 0)):
+                    if now - v.get('ts', 0) < self.ttl: entries[k] = v
+        except Exception as e:
+            print(f"[SearchCache] 加载失败: {e}")
+        return entries
+
+    def _save_locked(self):
+        """调用方需持有 self._lock；先写临时文件再替换，避免写一半被读到"""
+        try:
+            tmp = self.cache_file + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp, self.cache_file)
+        except Exception as e:
+            print(f"[SearchCache] 保存失败: {e}")
+
+    def _redis(self):
+        try:
+            from managers import cluster_manager
+            if cluster_manager.use_redis and cluster_manager.r is not None:
+                return cluster_manager.r
+        except Exception:
+            pass
+        return None
+
+    def _redis_key(self, norm):
+        return f"search:cache:{hashlib.md5(norm.encode('utf-8')).hexdigest()}"
+
+    def get(self, keyword):
+        """命中返回结果列表 (浅拷贝，调用方可随意改条目)，未命中返回 None"""
+        norm = self.normalize(keyword)
+        if not norm: return None
+        with self._lock:
+            entry = self.entries.get(norm)
+            if entry and time.time() - entry['ts'] < self.ttl:
+                self.entries.move_to_end(norm)
+                self._stats['hits'] += 1
+                return [dict(item) for item in entry['results']]
+            if entry: del self.entries[norm]
+
+        r = self._redis()
+        if r is not None:
+            try:
+                raw = r.get(self._redis_key(norm))
+                if raw:
+                    entry = json.loads(raw)
+                    with self._lock:
+                        self.entries[norm] = entry
+                        self.entries.move_to_end(norm)
+                        self._stats['redis_hits'] += 1
+                    return [dict(item) for item in entry['results']]
+            except Exception as e:
+                print(f"[SearchCache] Redis 读取失败: {e}")
+
+        with self._lock: self._stats['misses'] += 1
+        return None
+
+    def set(self, keyword, results):
+        """只缓存非空结果 (搜不到多半是临时故障，不应该锁住 TTL 这么久)"""
+        norm = self.normalize(keyword)
+        if not norm or not results: return
+        entry = {'ts': time.time(), 'keyword': keyword, 'results': [dict(item) for item in results]}
+        with self._lock:
+            self.entries[norm] = entry
+            self.entries.move_to_end(norm)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._save_locked()
+        r = self._redis()
+        if r is not None:
+            try:
+                r.setex(self._redis_key(norm), int(self.ttl), json.dumps(entry, ensure_ascii=False))
+            except Exception as e:
+                print(f"[SearchCache] Redis 写入失败: {e}")
+
+    def peek(self, keyword):
+        """只看本机是否有未过期的缓存 (不计命中率、不查 Redis，给联想列表打标记用)"""
+        norm = self.normalize(keyword)
+        with self._lock:
+            entry = self.entries.get(norm)
+            return bool(entry) and time.time() - entry['ts'] < self.ttl
+
+    def invalidate(self, keyword):
+        norm = self.normalize(keyword)
+        with self._lock:
+            if self.entries.pop(norm, None) is not None: self._save_locked()
+        r = self._redis()
+        if r is not None:
+            try: r.delete(self._redis_key(norm))
+            except Exception: pass
+
+    def stats(self):
+        with self._lock:
+            total = self._stats['hits'] + self._stats['redis_hits'] + self._stats['misses']
+            hit_rate = (self._stats['hits'] + self._stats['redis_hits']) / total if total else 0.0
+            return dict(self._stats, entries=len(self.entries), hit_rate=round(hit_rate, 3))
+
+
+class ResolvedLinkCache:
+    """
+    搜索引擎跳转链接解析缓存 (360 / 百度的 /link?url=... 加密链)
+    - links: 加密链 -> 真实地址；加密链几天内都指向同一地址，解析一次就够
+      解析失败也记下来 (real=None)，但只保留较短时间，避免死链每次搜索都白等 6 秒
+    - valid: 真实地址 -> 是否可用 (http、非加密链、不在黑名单)
+    落盘到 user_data/resolved_links.json，条目数有上限，按时间淘汰
+    """
+    def __init__(self, ttl=None, fail_ttl=1800, max_entries=5000):
+        self.cache_file = os.path.join(USER_DATA_DIR, 'resolved_links.json')
+        self.ttl = ttl if ttl is not None else int(os.environ.get('LINK_CACHE_TTL', 3 * 86400))
+        self.fail_ttl = fail_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stats = {'hits': 0, 'misses': 0, 'failed_hits': 0, 'resolved': 0, 'failed': 0}
+        self.links, self.valid = self._load()  # {url: {'real'|'ok', 'ts'}}
+
+    def _load(self):
+        links, valid = OrderedDict(), OrderedDict()
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    raw = json.load(f)
+                now = time.time()
+                for k, v in sorted((raw.get('links') or {}).items(), key=lambda kv: kv[1].get('ts', 0)):
+                    if now - v.get('ts', 0) < self._ttl_of(v): links[k] = v
+                for k, v in sorted((raw.get('valid') or {}).items(), key=lambda kv: kv[1].get('ts', 0)):
+                    if now - v.get('ts', 0) < self.ttl: valid[k] = v
+        except Exception as e:
+            print(f"[LinkCache] 加载失败: {e}")
+        return links, valid
+
+    def _ttl_of(self, entry):
+        return self.ttl if entry.get('real') else self.fail_ttl
+
+    def lookup(self, url):
+        """
+        返回 (命中?, 真实地址)：命中且 real 为 None 表示最近解析失败过，直接丢弃即可
+        """
+        with self._lock:
+            entry = self.links.get(url)
+            if entry and time.time() - entry['ts'] < self._ttl_of(entry):
+                if entry.get('real'): self._stats['hits'] += 1
+                else: self._stats['failed_hits'] += 1
+                return True, entry.get('real')
+            if entry: del self.links[url]
+            self._stats['misses'] += 1
+            return False, None
+
+    def store(self, url, real):
+        """real 为 None 表示解析失败"""
+        with self._lock:
+            self.links[url] = {'real': real, 'ts': time.time()}
+            self.links.move_to_end(url)
+            self._stats['resolved' if real else 'failed'] += 1
+            while len(self.links) > self.max_entries:
+                self.links.popitem(last=False)
+            self._dirty = True
+
+    def is_valid(self, real_url, check):
+        """真实地址可用性 (check 为校验函数，只在未缓存时调用)"""
+        with self._lock:
+            entry = self.valid.get(real_url)
+            if entry and time.time() - entry['ts'] < self.ttl: return entry['ok']
+        ok = bool(check(real_url))
+        with self._lock:
+            self.valid[real_url] = {'ok': ok, 'ts': time.time()}
+            self.valid.move_to_end(real_url)
+            while len(self.valid) > self.max_entries:
+                self.valid.popitem(last=False)
+            self._dirty = True
+        return ok
+
+    def flush(self):
+        """一批解析完成后落盘一次 (而不是每条都写)"""
+        with self._lock:
+            if not self._dirty: return
+            self._dirty = False
+            try:
+                tmp = self.cache_file + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump({'links': self.links, 'valid': self.valid}, f, ensure_ascii=False)
+                os.replace(tmp, self.cache_file)
+            except Exception as e:
+                print(f"[LinkCache] 保存失败: {e}")
+
+    def stats(self):
+        with self._lock:
+            hits = self._stats['hits'] + self._stats['failed_hits']
+            total = hits + self._stats['misses']
+            return dict(self._stats, links=len(self.links), valid=len(self.valid),
+                        hit_rate=round(hits / total, 3) if total else 0.0)
+
+
+class EngineLatencyStats:
+    """
+    搜索源延迟统计 (每个直连插件 / 360 各算一个源)
+    - 保留最近 window 次耗时，算 p50 / p90；失败按实际耗时记样本并累计连续失败次数
+    - 长尾源 (p90 明显高于 p50)：超过 p50 还没回来就补发一个对冲请求，谁先回来用谁
+    - 慢源 (p50 超过搜索截止时间) 或连续失败的源自动降级：照常发出、结果赶上了照用，但不再等它
+      降级源的请求仍在后台跑完并记样本，变快后自动恢复
+    落盘到 user_data/search_engine_stats.json (节流)
+    """
+    def __init__(self, window=50, min_samples=5, max_failures=3, save_interval=60, stats_file=None):
+        self.stats_file = stats_file or os.path.join(USER_DATA_DIR, 'search_engine_stats.json')
+        self.window = window
+        self.min_samples = min_samples
+        self.max_failures = max_failures
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._last_save = 0
+        self._samples = {}   # {name: deque[秒]}
+        self._failures = {}  # {name: 连续失败次数}
+        self._load()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.stats_file):
+                with open(self.stats_file, 'r', encoding='utf-8') as f:
+                    raw = json.load(f)
+                for name, v in raw.items():
+                    self._samples[name] = deque(v.get('samples', []), maxlen=self.window)
+                    self._failures[name] = v.get('failures', 0)
+        except Exception as e:
+            print(f"[EngineStats] 加载失败: {e}")
+
+    def _save_locked(self):
+        if time.time() - self._last_save < self.save_interval: return
+        try:
+            data = {n: {'samples': [round(x, 3) for x in s], 'failures': self._failures.get(n, 0)}
+                    for n, s in self._samples.items()}
+            with open(self.stats_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            self._last_save = time.time()
+        except Exception as e:
+            print(f"[EngineStats] 保存失败: {e}")
+
+    def record(self, name, seconds, ok=True):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+            self._failures[name] = 0 if ok else self._failures.get(name, 0) + 1
+            self._save_locked()
+
+    def _percentile_locked(self, name, q):
+        s = self._samples.get(name)
+        if not s or len(s) < self.min_samples: return None
+        ordered = sorted(s)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def percentile(self, name, q):
+        """最近样本的分位数 (秒)；样本不足时返回 None"""
+        with self._lock:
+            return self._percentile_locked(name, q)
+
+    def hedge_delay(self, name):
+        """长尾源的对冲时机 (秒)；样本不足或没有长尾时返回 None"""
+        with self._lock:
+            p50, p90 = self._percentile_locked(name, 0.5), self._percentile_locked(name, 0.9)
+        if p50 is None or p90 is None: return None
+        if p90 < max(1.0, 2 * p50): return None
+        return max(0.5, p50 * 1.5)
+
+    def is_demoted(self, name, deadline):
+        with self._lock:
+            if self._failures.get(name, 0) >= self.max_failures: return True
+            p50 = self._percentile_locked(name, 0.5)
+        return p50 is not None and p50 > deadline
+
+    def snapshot(self):
+        with self._lock:
+            return {n: {'p50': self._percentile_locked(n, 0.5), 'p90': self._percentile_locked(n, 0.9),
+                        'samples': len(s), 'failures': self._failures.get(n, 0)}
+                    for n, s in self._samples.items()}
+
+
+class SuggestIndex:
+    """
+    本地书名联想索引 (纯内存，增量更新)
+    数据来源：历史搜索结果、library/ 下的 EPUB (全站共用)；书架 (user_books) 按用户单独建索引，
+    查询时只合并当前用户自己的书架，不会把别人的书和链接联想出来
+    每本书建几类前缀键：书名 / 书名分词 / 作者 / 全拼 / 拼音首字母
+    所有键放进一个有序列表，前缀查询 = bisect 定位 + 顺序扫描，几千本书也是微秒级
+    排序：匹配类型 (完全匹配 > 书名前缀 > 全拼 > 首字母 > 分词 > 作者) + 热度 + 长度接近程度
+    """
+    KIND_BONUS = {'exact': 100, 'title': 60, 'pinyin': 50, 'initials': 40, 'token': 30, 'author': 20}
+    SOURCE_WEIGHT = {'shelf': 5, 'epub': 3, 'direct': 2, 'search': 1}
+    _SPLIT_RE = re.compile(r'[\s《》<>"\'“”‘’「」【】\[\]()（）,，.。!！?？:：;；·、_\-—~/|]+')
+
+    def __init__(self, result_cache=None, max_scan=3000, max_shelves=256):
+        self.result_cache = result_cache  # 预热时顺带收录历史搜索结果
+        self.max_scan = max_scan      # 单次查询最多扫描多少个键 (超短前缀时兜底)
+        self.max_shelves = max_shelves  # 内存里保留多少个用户的书架索引
+        self._lock = threading.Lock()
+        self._global = self._new_index()  # 搜索结果 / 书库
+        self._shelves = OrderedDict()     # {username: 书架索引}，LRU
+        self._warmed = False
+        self._warm_lock = threading.Lock()
+
+    @staticmethod
+    def _new_index():
+        # entries: [{'title', 'author', 'url', 'weight', 'sources'}]; by_title: {规范化书名: entry_id}; keys: 有序 [(键, 类型, entry_id)]
+        return {'entries': [], 'by_title': {}, 'keys': []}
+
+    @staticmethod
+    def normalize(text):
+        return SearchResultCache.normalize(text)
+
+    def _index_keys(self, title, author):
+        """一本书的所有 (键, 类型)"""
+        norm = self.normalize(title)
+        keys = {(norm, 'title')}
+        tokens = [self.normalize(t) for t in self._SPLIT_RE.split(title or '')]
+        for t in tokens:
+            if t and t != norm and len(t) >= 2: keys.add((t, 'token'))
+        if author:
+            a = self.normalize(author)
+            if a: keys.add((a, 'author'))
+        try:
+            full = ''.join(lazy_pinyin(norm)).lower()
+            initials = ''.join(lazy_pinyin(norm, style=Style.FIRST_LETTER)).lower()
+            if full and full != norm: keys.add((full, 'pinyin'))
+            if initials and initials != norm and len(initials) >= 2: keys.add((initials, 'initials'))
+        except Exception:
+            pass
+        return keys
+
+    def _add_to(self, idx, title, author, url, source):
+        """新增一本书，已存在时累加热度并补全作者/链接 (调用方持有 _lock)"""
+        title = (title or '').strip()
+        norm = self.normalize(title)
+        if not norm or len(norm) < 2 or len(title) > 40: return
+        weight = self.SOURCE_WEIGHT.get(source, 1)
+        eid = idx['by_title'].get(norm)
+        if eid is not None:
+            e = idx['entries'][eid]
+            e['weight'] += weight
+            e['sources'].add(source)
+            if url and (not e['url'] or source in ('shelf', 'direct')): e['url'] = url
+            if author and not e['author']:
+                e['author'] = author
+                a = self.normalize(author)
+                if a: bisect.insort(idx['keys'], (a, 'author', eid))
+            return
+        eid = len(idx['entries'])
+        idx['entries'].append({'title': title, 'author': author or '', 'url': url,
+                               'weight': weight, 'sources': {source}})
+        idx['by_title'][norm] = eid
+        for key, kind in self._index_keys(title, author):
+            bisect.insort(idx['keys'], (key, kind, eid))
+
+    def add(self, title, author='', url=None, source='search'):
+        """全站共用的条目 (搜索结果 / 书库)；书架条目走 add_shelf_book"""
+        if source == 'shelf': return
+        with self._lock:
+            self._add_to(self._global, title, author, url, source)
+
+    def add_results(self, results):
+        """搜索结果入索引：直连源书名可信度高；搜索引擎的页面标题偏杂，只收短标题"""
+        for item in results or []:
+            title = item.get('title') or ''
+            desc = item.get('description') or ''
+            author = desc.split('作者:', 1)[1].strip() if '作者:' in desc else ''
+            direct = item.get('_weight') == 0
+            if not direct and len(title) > 15: continue
+            self.add(title, author, item.get('url'), 'direct' if direct else 'search')
+
+    def _scan(self, idx, q, best):
+        """在一个索引里做前缀扫描，结果按规范化书名合并进 best (调用方持有 _lock)"""
+        keys, entries = idx['keys'], idx['entries']
+        i = bisect.bisect_left(keys, (q,))
+        scanned = 0
+        while i < len(keys) and scanned < self.max_scan:
+            key, kind, eid = keys[i]
+            if not key.startswith(q): break
+            i += 1
+            scanned += 1
+            e = entries[eid]
+            k = 'exact' if (kind == 'title' and key == q) else kind
+            score = self.KIND_BONUS[k] + min(30, e['weight'] * 2) - (len(key) - len(q)) * 0.5
+            norm = self.normalize(e['title'])
+            cur = best.get(norm)
+            if cur is None:
+                best[norm] = [score, k, e, set(e['sources'])]
+            else:
+                cur[3] |= e['sources']
+                if 'shelf' in e['sources']: cur[2] = e  # 自己书架上的链接优先
+                if score > cur[0]: cur[0], cur[1] = score, k
+
+    def suggest(self, query, limit=8, username=None):
+        """返回按得分排序的建议 [{'title', 'author', 'url', 'match', 'sources'}]；username 为空时不查书架"""
+        q = self.normalize(query)
+        if not q: return []
+        self.ensure_warm()
+        shelf = self._user_shelf(username) if username else None
+        best = {}  # {规范化书名: [得分, 匹配类型, 条目, 来源]}
+        with self._lock:
+            self._scan(self._global, q, best)
+            if shelf is not None: self._scan(shelf, q, best)
+            ranked = sorted(best.values(), key=lambda v: -v[0])[:limit]
+            return [{'title': e['title'], 'author': e['author'], 'url': e['url'], 'match': kind,
+                     'sources': sorted(sources)}
+                    for _, kind, e, sources in ranked]
+
+    def ensure_warm(self, result_cache=None):
+        """首次使用时从搜索缓存 / EPUB 书库建全站索引 (只做一次，之后靠增量)；书架按用户在首次查询时加载"""
+        if self._warmed: return
+        with self._warm_lock:
+            if self._warmed: return
+            self._warmed = True
+            t0 = time.time()
+            cache = result_cache or self.result_cache
+            if cache is not None:
+                for entry in list(cache.entries.values()):
+                    self.add_results(entry.get('results'))
+            self._warm_from_library()
+            print(f"[Suggest] 📇 联想索引就绪: {len(self._global['entries'])} 本书 / {len(self._global['keys'])} 个键，耗时 {time.time() - t0:.2f}s")
+
+    def _user_shelf(self, username):
+        with self._lock:
+            idx = self._shelves.get(username)
+            if idx is not None:
+                self._shelves.move_to_end(username)
+                return idx
+        # 必须在函数内部导入，防止循环引用 (Worker 侧的 managers 可能是替身)
+        rows = []
+        try:
+            from managers import get_db
+            with get_db() as conn:
+                rows = conn.execute("SELECT book_key, value FROM user_books WHERE username=? "
+                                    "AND book_key NOT LIKE '@%' AND book_key NOT LIKE '%:meta'", (username,)).fetchall()
+        except Exception as e:
+            print(f"[Suggest] 读取书架失败: {e}")
+        idx = self._new_index()
+        with self._lock:
+            for key, value in rows:
+                self._add_shelf_to(idx, key, value)
+            self._shelves[username] = idx
+            while len(self._shelves) > self.max_shelves:
+                self._shelves.popitem(last=False)
+        return idx
+
+    def add_shelf_book(self, key, value, username):
+        """书架新增：只更新该用户已加载的书架索引 (未加载时首次查询会从库里读到)"""
+        with self._lock:
+            idx = self._shelves.get(username)
+            if idx is not None: self._add_shelf_to(idx, key, value)
+
+    def _add_shelf_to(self, idx, key, value):
+        """书架条目：优先 value 里的书名，书架 key 只在含中文时当作书名 (拼音简写 key 没有意义)"""
+        data = value
+        if isinstance(value, str):
+            try: data = json.loads(value)
+            except Exception: data = {'url': value}
+        if not isinstance(data, dict): data = {}
+        title = data.get('book_name') or data.get('title') or data.get('name')
+        if not title and key and re.search(r'[一-龥]', key): title = key
+        url = data.get('url')
+        if not isinstance(url, str) or url.startswith('epub:'): url = None
+        if title: self._add_to(idx, title, data.get('author') or '', url, 'shelf')
+
+    def _warm_from_library(self):
+        try:
+            for fn in os.listdir(LIB_DIR):
+                if fn.lower().endswith('.epub'):
+                    self.add(os.path.splitext(fn)[0], '', None, 'epub')
+        except Exception as e:
+            print(f"[Suggest] 读取书库失败: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {'books': len(self._global['entries']), 'keys': len(self._global['keys']),
+                    'shelves': len(self._shelves), 'warmed': self._warmed}
+
+
 class SearchHelper:
     def __init__(self):
         # [Owllook 配置] 模拟 Chrome 指纹，这是过盾的关键
@@ -290,6 +1281,18 @@ class SearchHelper:
         }
         self.plugins = []
         self._load_search_plugins()
+        # [新增] 搜索结果缓存 (TTL + 落盘 + 可选 Redis 共享)
+        self.result_cache = SearchResultCache()
+        # [新增] 加密跳转链解析缓存 (360 / 百度 /link?)
+        self.link_cache = ResolvedLinkCache()
+        # [新增] 本地书名联想索引 (搜索结果写缓存时同步收录)
+        self.suggest_index = SuggestIndex(self.result_cache)
+        # [新增] 搜索截止时间 / 提前返回阈值 / 各源延迟统计
+        self.search_deadline = float(os.environ.get('SEARCH_DEADLINE', 8))
+        self.early_hits = int(os.environ.get('SEARCH_EARLY_HITS', 3))
+        self.engine_stats = EngineLatencyStats()
+        self._engine_pool = None
+        self._engine_pool_lock = threading.Lock()
         self.sites = [
             {
                 "name": "笔趣阁.cc", 
@@ -328,69 +1331,211 @@ class SearchHelper:
             }
         ]
 
-    @lru_cache(maxsize=100)
     def search_bing_cached(self, keyword):
-        """[新增] 带缓存的搜索入口 (兼容旧接口并提高性能)"""
-        # print(f"[Search Cache] Miss, fetching: {keyword}")
+        """带缓存的搜索入口 (命中 TTL 内的缓存直接返回，否则聚合搜索并写入缓存)"""
+        cached = self.result_cache.get(keyword)
+        if cached is not None:
+            print(f"[Search Cache] ✅ 命中: {keyword} ({len(cached)} 条)")
+            return cached
         return self.search_bing(keyword)
 
-    def search_concurrent(self, keyword, callback=None):
-        """[异步版] 并发搜索"""
-        print(f"\n[Search] 🚀 启动全网并发聚合搜索 (Async): {keyword}")
-
-        # 定义搜索源 (函数, 名称, 权重)
-        search_sources = [
-            (self._do_direct_source_search, "直连源", 0),
-            (self._do_so_search, "360搜索", 1),
-            # (self._do_bing_search, "Bing国际", 2)
-        ]
+    def search_concurrent(self, keyword, callback=None, use_cache=True, deadline=None):
+        """
+        [异步版] 并发搜索 (use_cache=False 时强制重新搜索并刷新缓存)
+        有截止时间：到点带着已有结果返回；高置信结果够数提前返回；没赶上的源在后台跑完后补进缓存
+        """
+        if use_cache:
+            cached = self.result_cache.get(keyword)
+            if cached is not None:
+                print(f"[Search Cache] ✅ 命中: {keyword} ({len(cached)} 条)")
+                if callback: callback(100, f"命中缓存，共 {len(cached)} 条结果", cached)
+                return cached
 
-        all_results = []
-        seen_urls = set()
-        completed_count = 0
-        total_sources = len(search_sources)
+        print(f"\n[Search] 🚀 启动全网并发聚合搜索 (Async): {keyword}")
+        all_results, complete = self._gather_engines(keyword, callback=callback, deadline=deadline)
 
-        if callback: callback(0, f"正在初始化 {total_sources} 个搜索引擎...")
+        if callback: callback(95, "正在聚合排序...")
+        all_results = self._rank_results(all_results)
+        if complete: self._store_results(keyword, all_results)
+        tip = "" if complete else " (部分源未返回，稍后重搜可得完整结果)"
+        if callback: callback(100, f"聚合完成，共 {len(all_results)} 条结果{tip}")
+        return all_results
 
-        with ThreadPoolExecutor(max_workers=total_sources) as exe:
-            future_to_source = {
-                exe.submit(func, keyword): (name, weight)
-                for func, name, weight in search_sources
-            }
+    # ==========================================
+    # 搜索源调度：截止时间 + 提前返回 + 对冲 + 慢源降级
+    # ==========================================
+    def _search_engines(self):
+        """(名称, 函数, 权重)：每个直连插件单独算一个源，一个慢插件不再拖住整个直连组"""
+        engines = [(f"直连:{p.source_name}", partial(self._run_plugin, p), 0) for p in self.plugins]
+        engines.append(("360搜索", self._do_so_search, 1))
+        # engines.append(("Bing国际", self._do_bing_search, 2))
+        return engines
+
+    def _run_plugin(self, plugin, keyword):
+        res = plugin.search(keyword) or []
+        for item in res:
+            # 给结果补上 pinyin_key (插件里可能没加)
+            if 'suggested_key' not in item:
+                item['suggested_key'] = self.get_pinyin_key(keyword)
+        return res
+
+    def _get_engine_pool(self):
+        """搜索源共享线程池：没赶上截止时间的请求留在池里跑完，不阻塞本次返回"""
+        if self._engine_pool is None:
+            with self._engine_pool_lock:
+                if self._engine_pool is None:
+                    self._engine_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="search_engine")
+        return self._engine_pool
+
+    @staticmethod
+    def _result_key(item):
+        return item['url'].replace('https://', '').replace('http://', '').rstrip('/')
+
+    def _is_confident(self, item, norm_kw):
+        """高置信：直连源返回且书名包含关键词 (直连源给的是真实目录页)"""
+        return item.get('_weight') == 0 and norm_kw and norm_kw in self.result_cache.normalize(item.get('title', ''))
+
+    def _store_results(self, keyword, results):
+        """完整结果写入搜索缓存，并收录进联想索引"""
+        self.result_cache.set(keyword, results)
+        try: self.suggest_index.add_results(results)
+        except Exception as e: print(f"[Suggest] 收录搜索结果失败: {e}")
+
+    def _rank_results(self, results):
+        """番茄 > 书香阁 > 其他直连 > 搜索引擎；同级描述信息多的靠前"""
+        def priority(item):
+            src = item.get('source', '')
+            if '番茄' in src or 'Fanqie' in src: return 0
+            if '书香阁' in src: return 1
+            return 2
+        return sorted(results, key=lambda x: (priority(x), x.get('_weight', 99), -len(x.get('description', '') or '')))
 
-            for future in as_completed(future_to_source):
-                name, weight = future_to_source[future]
-                new_items = []
+    def _gather_engines(self, keyword, callback=None, deadline=None):
+        """
+        并发跑所有搜索源，返回 (结果列表, 是否完整)
+        - 截止时间 (默认 SEARCH_DEADLINE 秒) 到了就带着已有结果返回
+        - 高置信结果达到 early_hits 条提前返回
+        - 长尾源超过 p50*1.5 未返回时补发一份对冲请求
+        - 降级源照常发出，但不再等它
+        没返回的请求留在后台，全部完成后把合并结果写入搜索缓存
+        """
+        engines = self._search_engines()
+        budget = deadline if deadline is not None else self.search_deadline
+        t0 = time.monotonic()
+        deadline_at = t0 + budget
+        stats = self.engine_stats
+        pool = self._get_engine_pool()
+        norm_kw = self.result_cache.normalize(keyword)
+
+        pending = {}       # {future: (name, weight, started_at)}
+        hedge_at = {}      # {name: 何时对冲}
+        by_name = {}
+        for name, fn, weight in engines:
+            by_name[name] = (fn, weight)
+            pending[pool.submit(fn, keyword)] = (name, weight, time.monotonic())
+            delay = stats.hedge_delay(name)
+            if delay is not None and delay < budget: hedge_at[name] = t0 + delay
+        waited = {name for name, _, _ in engines if not stats.is_demoted(name, budget)}
+        demoted = [name for name, _, _ in engines if name not in waited]
+        if not waited: waited = set(by_name)  # 全部降级时退回等所有源
+        if demoted: print(f"[Search] 🐢 已降级 (不等待): {', '.join(demoted)}")
+        if callback: callback(0, f"正在初始化 {len(engines)} 个搜索源...")
+
+        results, seen, done = [], set(), set()
+        confident = 0
+        reason = None
+
+        def absorb(name, weight, items):
+            nonlocal confident
+            fresh = []
+            for item in items or []:
+                key = self._result_key(item)
+                if key in seen: continue
+                seen.add(key)
+                item['_weight'] = weight
+                fresh.append(item)
+                if self._is_confident(item, norm_kw): confident += 1
+            results.extend(fresh)
+            return fresh
+
+        while True:
+            if waited <= done: break
+            now = time.monotonic()
+            if now >= deadline_at:
+                reason = f"到达截止时间 {budget:.0f}s"
+                break
+            if confident >= self.early_hits:
+                reason = f"已有 {confident} 条高置信结果"
+                break
+            wake = deadline_at
+            if hedge_at: wake = min(wake, min(hedge_at.values()))
+            finished, _ = futures_wait(list(pending), timeout=max(0.05, wake - now), return_when=FIRST_COMPLETED)
+
+            for f in finished:
+                name, weight, started = pending.pop(f)
+                elapsed = time.monotonic() - started
                 try:
-                    if callback: callback(None, f"正在搜索 {name}...")
-                    results = future.result()
-
-                    if results:
-                        for item in results:
-                            clean_url = item['url'].replace('https://', '').replace('http://', '').rstrip('/')
-                            if clean_url not in seen_urls:
-                                seen_urls.add(clean_url)
-                                item['_weight'] = weight
-                                new_items.append(item)
-                                all_results.append(item)
-
-                    msg = f"{name} 完成，找到 {len(results) if results else 0} 条"
+                    items, ok = f.result(), True
                 except Exception as e:
+                    items, ok = [], False
                     print(f"[Search Error] {name}: {e}")
-                    msg = f"{name} 搜索失败"
-
-                completed_count += 1
-                progress = int((completed_count / total_sources) * 90)
-
+                stats.record(name, elapsed, ok)
+                if name in done: continue  # 对冲的另一份已经先回来了
+                if not ok and any(v[0] == name for v in pending.values()): continue  # 等对冲那一份
+                done.add(name)
+                hedge_at.pop(name, None)
+                fresh = absorb(name, weight, items)
                 if callback:
-                    callback(progress, msg, new_items if new_items else None)
-
-        if callback: callback(95, "正在聚合排序...")
-
-        all_results.sort(key=lambda x: (x.get('_weight', 99), -len(x.get('description', ''))))
-
-        if callback: callback(100, f"聚合完成，共 {len(all_results)} 条结果")
-        return all_results
+                    progress = int(len(done & waited) / len(waited) * 90)
+                    msg = f"{name} 完成，找到 {len(items or [])} 条" if ok else f"{name} 搜索失败"
+                    callback(progress, msg, fresh or None)
+
+            now = time.monotonic()
+            for name, at in list(hedge_at.items()):
+                if now >= at and name not in done:
+                    print(f"[Search] 🪝 {name} 超过 p50 未返回，发出对冲请求")
+                    fn, weight = by_name[name]
+                    pending[pool.submit(fn, keyword)] = (name, weight, now)
+                    del hedge_at[name]
+
+        stragglers = {f: v for f, v in pending.items() if v[0] not in done}
+        elapsed = time.monotonic() - t0
+        if stragglers:
+            # 提前返回，或者只剩没等的降级源：结果都不完整，后台跑完再写缓存
+            names = sorted({v[0] for v in stragglers.values()})
+            reason = reason or "等待的源已全部返回"
+            print(f"[Search] ⏱️ {reason}，{elapsed:.2f}s 返回 {len(results)} 条，后台继续: {', '.join(names)}")
+            threading.Thread(target=self._finish_stragglers, daemon=True,
+                             args=(keyword, stragglers, list(results), set(seen), set(done))).start()
+            return results, False
+        # 没有在等的请求 (对冲剩下的副本) 只记延迟样本
+        for f, (name, _, started) in pending.items():
+            f.add_done_callback(lambda fut, n=name, s=started: stats.record(n, time.monotonic() - s, fut.exception() is None))
+        print(f"[Search] 聚合完成，耗时 {elapsed:.2f}s，共 {len(results)} 条结果")
+        return results, True
+
+    def _finish_stragglers(self, keyword, stragglers, results, seen, done):
+        """后台等没赶上的源跑完：记延迟样本，把完整结果写进搜索缓存"""
+        try:
+            for f in as_completed(stragglers, timeout=120):
+                name, weight, started = stragglers[f]
+                try:
+                    items, ok = f.result(), True
+                except Exception:
+                    items, ok = [], False
+                self.engine_stats.record(name, time.monotonic() - started, ok)
+                if name in done or not ok: continue
+                done.add(name)
+                for item in items or []:
+                    key = self._result_key(item)
+                    if key in seen: continue
+                    seen.add(key)
+                    item['_weight'] = weight
+                    results.append(item)
+        except Exception as e:
+            print(f"[Search] ⚠️ 后台补齐超时，按已有结果写缓存: {e}")
+        self._store_results(keyword, self._rank_results(results))
+        print(f"[Search] 🧩 后台补齐完成: {keyword} 共 {len(results)} 条，已写入缓存")
 
     def _search_single_site(self, site, keyword):
         """搜索单个站点"""
@@ -849,29 +1994,47 @@ class SearchHelper:
     # ==========================================
     def _concurrent_resolve(self, raw_results):
         if not raw_results: return []
-        print(f"[Search] 并发解析 {len(raw_results)} 个链接...")
-        
-        final_results = []
-        with ThreadPoolExecutor(max_workers=8) as exe:
-            future_to_item = {
-                exe.submit(self._resolve_real_url, item['url']): item 
-                for item in raw_results
-            }
-            for future in as_completed(future_to_item):
-                item = future_to_item[future]
-                try:
-                    real_url = future.result()
-                    # 确保解析出来的是 http 且不是加密链
-                    if (real_url.startswith('http') and 
-                        "baidu.com/link" not in real_url and 
-                        "so.com/link" not in real_url and 
-                        self._is_valid_result(item['title'], real_url)):
-                        
-                        item['url'] = real_url
-                        final_results.append(item)
-                except: pass
-        
+        # [新增] 先查解析缓存，只有没见过的加密链才发请求
+        final_results, pending, cached = [], [], 0
+        for item in raw_results:
+            url = item['url']
+            if "so.com/link" not in url and "baidu.com/link" not in url:
+                self._accept_resolved(item, url, final_results)
+                continue
+            hit, real_url = self.link_cache.lookup(url)
+            if not hit:
+                pending.append(item)
+                continue
+            cached += 1
+            if real_url: self._accept_resolved(item, real_url, final_results)
+
+        print(f"[Search] 并发解析 {len(raw_results)} 个链接 (解析缓存命中 {cached}，需请求 {len(pending)})...")
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(8, len(pending))) as exe:
+                future_to_item = {
+                    exe.submit(self._resolve_real_url, item['url']): item 
+                    for item in pending
+                }
+                for future in as_completed(future_to_item):
+                    item = future_to_item[future]
+                    try:
+                        real_url = future.result()
+                    except Exception:
+                        real_url = item['url']
+                    # 解析失败会原样返回加密链，记为失败 (短 TTL)
+                    resolved = real_url if real_url and real_url != item['url'] else None
+                    self.link_cache.store(item['url'], resolved)
+                    if resolved: self._accept_resolved(item, resolved, final_results)
+        self.link_cache.flush()
         return final_results
+
+    def _accept_resolved(self, item, real_url, out):
+        """确保解析出来的是 http 且不是加密链、域名不在黑名单 (按真实地址缓存)，再校验标题"""
+        ok = self.link_cache.is_valid(real_url, lambda u: (
+            "baidu.com/link" not in u and "so.com/link" not in u and self._is_valid_result('', u)))
+        if ok and self._is_valid_result(item['title'], real_url):
+            item['url'] = real_url
+            out.append(item)
     # ==========================================
     # 统一入口
     # ==========================================
@@ -879,70 +2042,24 @@ class SearchHelper:
 
     # === [核心升级] 全网并发聚合搜索 (Aggregated Search) ===
     def search_bing(self, keyword):
-        print(f"\n[Search] 🚀 启动全网并发聚合搜索: {keyword}")
-        start_time = time.time()
-        
-        # 1. 定义参赛选手
-        # _do_direct_source_search 会自动加载 search_plugins 里的所有插件
-        # 包括我们刚写的 fanqie_local_source 和之前的 sxg_source
-        search_funcs = [
-            self._do_direct_source_search, # 插件大军 (番茄、书香阁等)
-            self._do_so_search,            # 360 (主力)
-            # self._do_bing_search        # Bing CN (辅助)
-        ]
+        """聚合搜索 (同一关键词并发搜索只跑一次)；总是重新搜索，完整结果刷新到缓存"""
+        if not keyword: return []
+        return single_flight.do(('search', self.result_cache.normalize(keyword) or keyword.strip()),
+                                self._search_bing_impl, keyword, wait_timeout=45)
 
-        all_results = []
-        seen_urls = set()  # URL 去重
-        # with open('debug.json', 'w', encoding='utf-8') as f:
-                # f.write(str(search_funcs))
-        # 2. 并发执行
-        # for func in search_funcs:
-        #     try:
-        #         results = func(keyword)  # 直接调用函数
-        #         if results:
-        #             for item in results:
-        #                 # 简单去重
-        #                 clean_url = item['url'].replace('https://', '').replace('http://', '').rstrip('/')
-        #                 if clean_url not in seen_urls:
-        #                     seen_urls.add(clean_url)
-        #                     all_results.append(item)
-        #     except Exception: 
-        #         pass  # 忽略单个函数的异常
-        with ThreadPoolExecutor(max_workers=len(search_funcs)) as exe:
-            future_to_name = {
-                exe.submit(func, keyword): func.__name__ 
-                for func in search_funcs
-            }
-            
-            for future in as_completed(future_to_name):
-                try:
-                    results = future.result()
-                    if results:
-                        for item in results:
-                            # 简单去重
-                            clean_url = item['url'].replace('https://', '').replace('http://', '').rstrip('/')
-                            if clean_url not in seen_urls:
-                                seen_urls.add(clean_url)
-                                all_results.append(item)
-                except Exception: pass
+    def _search_bing_impl(self, keyword):
+        print(f"\n[Search] 🚀 启动全网并发聚合搜索: {keyword}")
+        # 与 search_concurrent 共用搜索源调度 (截止时间 / 提前返回 / 对冲 / 慢源降级)
+        # 插件大军 (番茄、书香阁等) 每个插件单独算一个源，360 为主力引擎
+        all_results, complete = self._gather_engines(keyword)
 
-        # === 3. [关键修改] 结果优先级排序 ===
-        # 优先级规则: 
+        # === 结果优先级排序 ===
         # 1. 番茄 (Fanqie) -> 最顶层
         # 2. 书香阁 (书香阁/sxg) -> 第二层
         # 3. 其他 -> 后面
-        def get_priority(item):
-            src = item.get('source', '')
-            if '番茄' in src or 'Fanqie' in src:
-                return 0  # 优先级最高
-            if '书香阁' in src:
-                return 1  # 优先级次之
-            return 2      # 其他
-
-        # 执行排序
-        all_results.sort(key=get_priority)
-
-        print(f"[Search] 聚合完成，耗时 {time.time() - start_time:.2f}s，共 {len(all_results)} 条结果")
+        all_results = self._rank_results(all_results)
+        # 不完整的结果由后台补齐后再写缓存
+        if complete: self._store_results(keyword, all_results)
         return all_results
 
 
@@ -1625,6 +2742,882 @@ class SearchHelperOld:
         except Exception as e:
             print(f"[Search] Baidu Error: {e}")
             return []
+# ==========================================
+# 2.5 站点提取画像 (通用逻辑自学习)
+# ==========================================
+class ExtractionProfileStore:
+    """
+    按域名记住通用逻辑"哪个选择器提取到了正文/导航"
+    - 命中画像时只查画像里的选择器，跳过 7 个正文 id + 全量 div 打分 + 全量 <a> 扫描
+    - 画像结果质量下降 (正文过短/导航丢失) 时回退全量启发式，并自动重新学习
+    """
+    def __init__(self, min_learn_len=200, max_misses=3, save_interval=60):
+        self.profile_file = os.path.join(USER_DATA_DIR, 'extraction_profiles.json')
+        self.min_learn_len = min_learn_len   # 正文少于这个字数不学习 (防止把错误页学进去)
+        self.max_misses = max_misses         # 连续失败多少次后丢弃画像
+        self.save_interval = save_interval   # 统计类更新的落盘节流 (秒)
+        self._lock = threading.Lock()
+        self._last_save = 0
+        self._dirty = False
+        self.profiles = self._load()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.profile_file):
+                with open(self.profile_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"[Profile] 加载失败: {e}")
+        return {}
+
+    def _save_locked(self, force=False):
+        """调用方需持有 self._lock"""
+        if not force and time.time() - self._last_save < self.save_interval:
+            self._dirty = True
+            return
+        try:
+            with open(self.profile_file, 'w', encoding='utf-8') as f:
+                json.dump(self.profiles, f, ensure_ascii=False, indent=2)
+            self._last_save = time.time()
+            self._dirty = False
+        except Exception as e:
+            print(f"[Profile] 保存失败: {e}")
+
+    def flush(self):
+        with self._lock:
+            if self._dirty: self._save_locked(force=True)
+
+    def get(self, domain):
+        if not domain: return None
+        with self._lock:
+            p = self.profiles.get(domain)
+            return dict(p) if p else None
+
+    def is_content_ok(self, domain, content):
+        """画像提取出的正文是否可信 (和该域名历史平均长度比较)"""
+        if not content or content == ["正文解析失败"]: return False
+        total = sum(len(line) for line in content)
+        p = self.profiles.get(domain) or {}
+        avg = p.get('avg_len', 0)
+        return total >= max(50, avg * 0.3)
+
+    def learn(self, domain, content_sel=None, nav_sels=None, nav_ids=None, content_len=0):
+        """用全量启发式的结果(重新)学习画像"""
+        if not domain: return
+        with self._lock:
+            p = self.profiles.get(domain) or {}
+            changed = False
+            if content_sel and content_len >= self.min_learn_len and p.get('content') != content_sel:
+                p['content'] = content_sel
+                p['avg_len'] = content_len
+                changed = True
+            if nav_sels and p.get('nav') != nav_sels:
+                p['nav'] = nav_sels
+                changed = True
+            if nav_ids is not None and p.get('nav_ids') != nav_ids:
+                p['nav_ids'] = nav_ids
+                changed = True
+            if not changed: return
+            p['misses'] = 0
+            p['learned_at'] = int(time.time())
+            p.setdefault('hits', 0)
+            self.profiles[domain] = p
+            print(f"[Profile] 📚 学习站点画像 {domain}: content={p.get('content')} nav={p.get('nav')}")
+            self._save_locked(force=True)
+
+    def record_hit(self, domain, content_len):
+        with self._lock:
+            p = self.profiles.get(domain)
+            if not p: return
+            p['hits'] = p.get('hits', 0) + 1
+            p['misses'] = 0
+            # EWMA 平滑平均正文长度，用于判断质量是否下降
+            p['avg_len'] = int(0.2 * content_len + 0.8 * p.get('avg_len', content_len))
+            self._save_locked()
+
+    def record_miss(self, domain):
+        with self._lock:
+            p = self.profiles.get(domain)
+            if not p: return
+            p['misses'] = p.get('misses', 0) + 1
+            if p['misses'] >= self.max_misses:
+                print(f"[Profile] ♻️ 画像连续失效 {p['misses']} 次，丢弃并重新学习: {domain}")
+                del self.profiles[domain]
+                self._save_locked(force=True)
+            else:
+                self._save_locked()
+
+    def stats(self):
+        with self._lock:
+            return {d: {'content': p.get('content'), 'nav': p.get('nav'), 'hits': p.get('hits', 0), 'misses': p.get('misses', 0)}
+                    for d, p in self.profiles.items()}
+
+# ==========================================
+# 2.6 流式章节提取 (lxml HTMLPullParser)
+# ==========================================
+class StreamingPageExtractor:
+    """
+    边解析边提取 标题 / 正文块 / 导航链接，目标齐了就停止读取
+    - 不关心的节点在结束事件里立即清理，全程不保留完整 DOM
+    - 选择器只支持简单形式: tag / #id / [id="x"] / tag#id / tag.cls / .cls
+    """
+    CHUNK_SIZE = 16 * 1024
+    DEFAULT_CONTENT = ['[id="txt"]', '[id="content"]', '[id="chaptercontent"]', '[id="BookText"]',
+                       '[id="showtxt"]', '[id="nr1"]', '[id="read-content"]']
+    SKIP_TAGS = {'script', 'style', 'noscript'}
+    BREAK_TAGS = {'br', 'p', 'div'}
+
+    _ID_SPEC_RE = re.compile(r'^\[id="([^"]+)"\]$')
+    _SIMPLE_SPEC_RE = re.compile(r'^([A-Za-z][\w-]*)?(?:#([\w-]+))?((?:\.[\w-]+)*)$')
+
+    def __init__(self, title=None, content=None, nav=None, drop=None, nav_ids=None, stop_when=None):
+        """
+        :param title: 标题选择器列表；为空时沿用 _get_smart_title 的 h1/<title> 规则
+        :param content: 正文块选择器列表 (按文档顺序取第一个命中的)
+        :param nav: 导航容器选择器列表；为空时收集全页 <a>
+        :param drop: 正文内需要剔除的节点 (默认剔除 <a>)
+        :param nav_ids: 额外记录 href 的导航元素 id
+        :param stop_when: 正文就绪后用于判断"导航是否已够用"的回调 f(extractor) -> bool；为空则读到结尾
+        """
+        self.title_specs = self._parse_specs(title)
+        self.content_specs = self._parse_specs(content or self.DEFAULT_CONTENT)
+        self.content_raw = [s for s in (content or self.DEFAULT_CONTENT)]
+        self.nav_specs = self._parse_specs(nav)
+        self.drop_specs = self._parse_specs(drop if drop is not None else ['a'])
+        self.nav_ids = set(nav_ids or [])
+        self.stop_when = stop_when
+
+        # 输出
+        self.title = None
+        self.page_title = ""
+        self.h1s = []            # [(text, class_str, in_nav_header)]
+        self.content = None      # 原始文本 (已按块换行)
+        self.content_spec = None
+        self.links = []          # [(text, href)]
+        self.id_links = {}       # {id: href}
+        self.complete = False    # 是否因目标齐全而提前结束
+
+        # 解析状态
+        self._content_el = None
+        self._nav_open = 0
+        self._header_open = 0
+
+    def _parse_specs(self, specs):
+        parsed = []
+        for s in specs or []:
+            s = (s or '').strip()
+            m = self._ID_SPEC_RE.match(s)
+            if m:
+                parsed.append((None, m.group(1), ()))
+                continue
+            m = self._SIMPLE_SPEC_RE.match(s)
+            if m and s:
+                classes = tuple(c for c in (m.group(3) or '').split('.') if c)
+                parsed.append(((m.group(1) or '').lower() or None, m.group(2), classes))
+        return parsed
+
+    @staticmethod
+    def _matches(el, specs):
+        """返回第一个命中的 spec 下标，未命中返回 -1"""
+        tag = el.tag if isinstance(el.tag, str) else None
+        if not tag: return -1
+        el_id = el.get('id')
+        el_cls = set((el.get('class') or '').split())
+        for i, (s_tag, s_id, s_cls) in enumerate(specs):
+            if s_tag and s_tag != tag.lower(): continue
+            if s_id and s_id != el_id: continue
+            if s_cls and not el_cls.issuperset(s_cls): continue
+            return i
+        return -1
+
+    def _element_text(self, el):
+        """取正文文本：块级标签/<br> 处换行，剔除 drop 节点 (保留其尾随文本)"""
+        parts = [el.text or '']
+
+        def walk(node):
+            for child in node:
+                tag = child.tag.lower() if isinstance(child.tag, str) else None
+                if tag and tag not in self.SKIP_TAGS and self._matches(child, self.drop_specs) < 0:
+                    if tag in self.BREAK_TAGS: parts.append('\n')
+                    if child.text: parts.append(child.text)
+                    walk(child)
+                    if tag in ('p', 'div'): parts.append('\n')
+                if child.tail: parts.append(child.tail)
+
+        walk(el)
+        return ''.join(parts)
+
+    def _smart_title(self):
+        """与 NovelCrawler._get_smart_title 相同的取舍规则，只是作用在流式收集到的 h1 上"""
+        for txt, cls, _ in self.h1s:
+            if re.search(r'title|chapter|book|name', cls, re.I): return txt
+        for txt, cls, in_nav in self.h1s:
+            if len(txt) <= 4 or any(x in txt for x in ["笔趣阁", "小说网", "阅读器"]):
+                if "logo" in cls.lower(): continue
+                if in_nav: continue
+            return txt
+        if self.page_title: return re.split(r'[_—|-]', self.page_title)[0].strip()
+        return "未知章节"
+
+    def _title_ready(self):
+        if self.title_specs: return self.title is not None
+        return self.content is not None
+
+    def _handle(self, event, el):
+        tag = el.tag.lower() if isinstance(el.tag, str) else None
+        if not tag: return
+
+        if event == 'start':
+            if tag in ('nav', 'header'): self._header_open += 1
+            if self.nav_specs and self._matches(el, self.nav_specs) >= 0: self._nav_open += 1
+            if self.content is None and self._content_el is None:
+                idx = self._matches(el, self.content_specs)
+                if idx >= 0:
+                    self._content_el = el
+                    self.content_spec = self.content_raw[idx]
+            return
+
+        # === end 事件 ===
+        if tag in ('nav', 'header'): self._header_open -= 1
+        if self.nav_specs and self._matches(el, self.nav_specs) >= 0: self._nav_open -= 1
+
+        el_id = el.get('id')
+        if el_id in self.nav_ids and el.get('href') and el_id not in self.id_links:
+            self.id_links[el_id] = el.get('href')
+
+        if tag == 'a' and (self._nav_open > 0 or not self.nav_specs):
+            href = el.get('href')
+            if href:
+                self.links.append((''.join(el.itertext()).strip().replace(' ', ''), href))
+        elif tag == 'title' and not self.page_title:
+            self.page_title = ''.join(el.itertext()).strip()
+        elif self.title_specs:
+            if self.title is None and self._matches(el, self.title_specs) >= 0:
+                self.title = ''.join(el.itertext()).strip()
+        elif tag == 'h1':
+            self.h1s.append((''.join(el.itertext()).strip(), el.get('class') or '', self._header_open > 0))
+
+        if el is self._content_el:
+            self.content = self._element_text(el)
+            self._content_el = None
+            if not self.title_specs: self.title = self._smart_title()
+
+        # 正文块内部的节点要留到正文结束时统一取文本，其余节点用完即清
+        if self._content_el is None:
+            el.clear()
+            parent = el.getparent()
+            if parent is not None:
+                while el.getprevious() is not None:
+                    del parent[0]
+
+    def _done(self):
+        if self.content is None or not self._title_ready(): return False
+        return bool(self.stop_when and self.stop_when(self))
+
+    def feed_all(self, html):
+        """按块喂入 HTML，目标齐全立即返回；返回 self，未找到正文时 content 为 None"""
+        parser = lxml_etree.HTMLPullParser(events=('start', 'end'), remove_comments=True)
+        for pos in range(0, len(html), self.CHUNK_SIZE):
+            parser.feed(html[pos:pos + self.CHUNK_SIZE])
+            for event, el in parser.read_events():
+                self._handle(event, el)
+            if self._done():
+                self.complete = True
+                return self
+        try:
+            parser.close()
+        except Exception:
+            pass
+        for event, el in parser.read_events():
+            self._handle(event, el)
+        if self.content is not None and self.title is None and not self.title_specs:
+            self.title = self._smart_title()
+        return self
+
+    def hint_text(self):
+        """供分页推算使用的提示文本 (标题、h1、导航文字、正文末尾)"""
+        tail = (self.content or '')[-300:]
+        return ' '.join([self.page_title, self.title or ''] + [t for t, _, _ in self.h1s] + [t for t, _ in self.links] + [tail])
+
+
+# ==========================================
+# 2.7 目录索引 (URL -> 位置/章节号)
+# ==========================================
+class TocIndexStore:
+    """
+    每本书 (按目录 URL) 一份持久化索引：章节 URL -> 位置 / 章节号
+    每次抓到目录时顺手建立，阅读页、更新红点、导出续传都用它 O(1) 回答
+    "当前第几章、落后几章、下一章是哪"，不再靠正则猜 URL 里的数字
+    """
+    def __init__(self, max_memory_books=64):
+        self.index_dir = os.path.join(USER_DATA_DIR, 'toc_index')
+        self.max_memory_books = max_memory_books
+        self._lock = threading.Lock()
+        self._books = OrderedDict()  # {toc_key: entry} 最近使用的书常驻内存
+        self.on_change = None        # 回调 (toc_url, chapters)：目录内容变化 (新建/更新) 时触发
+
+    @staticmethod
+    def normalize(url):
+        """去掉协议、锚点、结尾斜杠和章节内分页后缀 (123_2.html -> 123.html)"""
+        if not url: return ""
+        u = url.split('#', 1)[0].split('://', 1)[-1].rstrip('/')
+        return re.sub(r'/(\d+)_\d+(\.s?html?)?$', r'/\1\2', u)
+
+    def _key(self, toc_url):
+        return hashlib.md5(self.normalize(toc_url).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.index_dir, f"{key}.json")
+
+    @staticmethod
+    def _signature(urls):
+        return [len(urls), urls[0] if urls else "", urls[-1] if urls else ""]
+
+    @staticmethod
+    def _chapter_url(chapters, i):
+        if isinstance(chapters, CompactToc): return chapters.url_at(i)
+        return chapters[i].get('url', '')
+
+    def _chapters_signature(self, chapters):
+        """与 _signature(urls) 相同，但只取首末两章"""
+        n = len(chapters)
+        return [n, self._chapter_url(chapters, 0) if n else "", self._chapter_url(chapters, -1) if n else ""]
+
+    def _make_entry(self, toc_url, urls, ids, titles):
+        pos = {}
+        for i, u in enumerate(urls):
+            pos.setdefault(self.normalize(u), i)
+        return {'toc_url': toc_url, 'urls': urls, 'ids': ids, 'titles': titles,
+                'pos': pos, 'sig': self._signature(urls)}
+
+    def _remember(self, key, entry):
+        """调用方需持有 self._lock"""
+        self._books[key] = entry
+        self._books.move_to_end(key)
+        while len(self._books) > self.max_memory_books:
+            self._books.popitem(last=False)
+
+    def _get_entry(self, toc_url):
+        if not toc_url: return None
+        key = self._key(toc_url)
+        with self._lock:
+            entry = self._books.get(key)
+            if entry:
+                self._books.move_to_end(key)
+                return entry
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                d = json.load(f)
+            entry = self._make_entry(d.get('toc_url', toc_url), d.get('urls', []), d.get('ids', []), d.get('titles', []))
+        except Exception:
+            return None
+        with self._lock:
+            self._remember(key, entry)
+        return entry
+
+    def build(self, toc_url, chapters):
+        """目录抓取成功后调用；章节没变化时不重复落盘"""
+        if not toc_url or not chapters: return
+        # Worker 节点只负责抓取，索引由主服务建立
+        if os.environ.get('FORCE_LOCAL_CRAWL') == '1': return
+        try:
+            # 先只比签名 (章数 + 首末章 URL)：目录没变时不展开 CompactToc 的每一行
+            existing = self._get_entry(toc_url)
+            if existing and existing['sig'] == self._chapters_signature(chapters): return
+            urls = [self._chapter_url(chapters, i) for i in range(len(chapters))]
+
+            ids, titles = [], []
+            for c in chapters:
+                try: ids.append(int(c.get('id', -1)))
+                except (TypeError, ValueError): ids.append(-1)
+                titles.append(c.get('title') or c.get('name') or '')
+            entry = self._make_entry(toc_url, urls, ids, titles)
+
+            os.makedirs(self.index_dir, exist_ok=True)
+            key = self._key(toc_url)
+            tmp = self._path(key) + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'toc_url': toc_url, 'updated_at': time.time(), 'urls': urls, 'ids': ids, 'titles': titles},
+                          f, ensure_ascii=False)
+            os.replace(tmp, self._path(key))
+            with self._lock:
+                self._remember(key, entry)
+            print(f"[TocIndex] 🗂️ 已建立目录索引: {len(urls)} 章 | {toc_url}")
+        except Exception as e:
+            print(f"[TocIndex] 建立索引失败: {e}")
+            return
+        # 目录有变化时通知订阅者 (换源对齐表增量更新)
+        if self.on_change:
+            try: self.on_change(toc_url, chapters)
+            except Exception as e: print(f"[TocIndex] 变更回调失败: {e}")
+
+    def locate(self, toc_url, chapter_url, latest_id=None):
+        """
+        定位章节在目录中的位置
+        :param latest_id: 远程最新章节号 (可选)；比索引里最后一章还新时，落后章数会加上差值
+        :return: {pos, id, title, total, behind, prev_url, next_url} ；索引或章节不存在时返回 None
+        """
+        entry = self._get_entry(toc_url)
+        if not entry: return None
+        i = entry['pos'].get(self.normalize(chapter_url))
+        if i is None: return None
+
+        urls, ids = entry['urls'], entry['ids']
+        total = len(urls)
+        behind = total - 1 - i
+        last_id = ids[-1] if ids else -1
+        if latest_id and last_id > 0 and latest_id > last_id:
+            behind += latest_id - last_id
+        return {
+            'pos': i,
+            'id': ids[i] if i < len(ids) else -1,
+            'title': entry['titles'][i] if i < len(entry['titles']) else '',
+            'total': total,
+            'behind': behind,
+            'prev_url': urls[i - 1] if i > 0 else None,
+            'next_url': urls[i + 1] if i + 1 < total else None,
+        }
+
+    def position_map(self, chapters):
+        """给任意章节列表建 {规范化URL: 下标}，供导出续传对齐新旧目录"""
+        pos = {}
+        for i, c in enumerate(chapters):
+            pos.setdefault(self.normalize(c.get('url', '')), i)
+        return pos
+
+
+class SourceQualityStats:
+    """
+    按域名统计书源质量，换源时先按质量给候选排序，再决定花钱验证谁
+    - 目录成功率：换源验证时目录拉没拉下来
+    - 目录延迟：拉目录的耗时 (指数滑动平均，命中缓存的不算)
+    - 章节完整度：目录里有没有目标章节 / 最新章节号追到目标的几成
+    - 正文质量：本地抓章节时正文是否够长
+    没有样本的域名按中等水平 (0.5) 处理，保证新源也有机会被验证
+    """
+    ALPHA = 0.3  # 滑动平均系数
+
+    def __init__(self, save_interval=60):
+        self.stats_file = os.path.join(USER_DATA_DIR, 'source_quality.json')
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._last_save = 0
+        self._dirty = False
+        self.domains = self._load()  # {domain: {'toc_ok', 'toc_fail', 'latency', 'complete', 'content_ok', 'content_bad'}}
+
+    def _load(self):
+        try:
+            if os.path.exists(self.stats_file):
+                with open(self.stats_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"[Quality] 加载失败: {e}")
+        return {}
+
+    def _save_locked(self, force=False):
+        """调用方需持有 self._lock"""
+        if not force and time.time() - self._last_save < self.save_interval:
+            self._dirty = True
+            return
+        try:
+            tmp = self.stats_file + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.domains, f, ensure_ascii=False)
+            os.replace(tmp, self.stats_file)
+            self._last_save = time.time()
+            self._dirty = False
+        except Exception as e:
+            print(f"[Quality] 保存失败: {e}")
+
+    def flush(self):
+        with self._lock:
+            if self._dirty: self._save_locked(force=True)
+
+    def _ewma(self, d, field, value):
+        old = d.get(field)
+        d[field] = round(value if old is None else old * (1 - self.ALPHA) + value * self.ALPHA, 3)
+
+    def record_toc(self, domain, ok, latency=None, completeness=None):
+        if not domain: return
+        with self._lock:
+            d = self.domains.setdefault(domain, {})
+            key = 'toc_ok' if ok else 'toc_fail'
+            d[key] = d.get(key, 0) + 1
+            if latency is not None: self._ewma(d, 'latency', latency)
+            if completeness is not None: self._ewma(d, 'complete', completeness)
+            self._save_locked()
+
+    def record_content(self, domain, content):
+        """content 为章节段落列表"""
+        if not domain: return
+        ok = bool(content) and content != ["正文解析失败"] and sum(len(l) for l in content) >= 300
+        with self._lock:
+            d = self.domains.setdefault(domain, {})
+            key = 'content_ok' if ok else 'content_bad'
+            d[key] = d.get(key, 0) + 1
+            self._save_locked()
+
+    def score(self, domain):
+        """0~1 的综合得分 (成功率、正文质量用拉普拉斯平滑，样本少时向 0.5 靠拢)"""
+        with self._lock:
+            d = self.domains.get(domain) or {}
+        success = (d.get('toc_ok', 0) + 1) / (d.get('toc_ok', 0) + d.get('toc_fail', 0) + 2)
+        content = (d.get('content_ok', 0) + 1) / (d.get('content_ok', 0) + d.get('content_bad', 0) + 2)
+        speed = 1 / (1 + d['latency'] / 3) if d.get('latency') is not None else 0.5
+        complete = d.get('complete', 0.5)
+        return 0.4 * success + 0.2 * speed + 0.2 * complete + 0.2 * content
+
+    def rank(self, results, url_key='url'):
+        """
+        候选排序：质量分为主，搜索排名只做微调；同域名只留排名最靠前的一个
+        (一个站的目录验证一次就够了)
+        """
+        seen, ranked = set(), []
+        for i, item in enumerate(results):
+            domain = urlparse(item.get(url_key) or '').netloc
+            if not domain or domain in seen: continue
+            seen.add(domain)
+            ranked.append((self.score(domain) - i * 0.01, i, item))
+        ranked.sort(key=lambda x: (-x[0], x[1]))
+        return [item for _, _, item in ranked]
+
+    def snapshot(self):
+        with self._lock:
+            domains = list(self.domains)
+        return {d: round(self.score(d), 3) for d in domains}
+
+
+class SourceAlignmentStore:
+    """
+    每本书一份跨源章节对齐表：主源目录 (规范章节序列) 的第 i 章 -> 各镜像站的对应章节 URL
+    - 书加入书架 / 订阅更新时后台建表：搜索镜像、按书源质量挑几个、拉目录、逐章对齐
+    - 目录刷新 (TocIndexStore 发现章节变化) 时增量对齐：已对齐的位置不动，只补新章节
+    - 换源 / 主源挂掉时直接查表，不再现场搜索 + 拉目录 + 模糊匹配
+    章节 URL -> 哪本书：按章节 URL 的目录前缀 (.../book/123/) 反查，且该 URL 必须真在表里；
+    多本书共用的前缀 (番茄这类 /reader/<id> 扁平路径) 不登记，只能按书名查
+    """
+    def __init__(self, crawler, max_mirrors=5, min_coverage=0.5, max_memory_books=32):
+        self.crawler = crawler
+        self.table_dir = os.path.join(USER_DATA_DIR, 'source_alignment')
+        self.index_file = os.path.join(self.table_dir, '_index.json')
+        self.max_mirrors = max_mirrors        # 每本书最多对齐几个镜像
+        self.min_coverage = min_coverage      # 对齐上的章节不足这个比例的镜像不要
+        self.max_memory_books = max_memory_books
+        self._lock = threading.Lock()
+        self._books = OrderedDict()           # {book_id: table} 最近使用的常驻内存
+        self._pending = set()                 # 排队中的建表/刷新任务，避免重复提交
+        self._pool = None
+        self.index = self._load_index()       # {'tocs': {目录: book_id}, 'prefixes': {章节前缀: book_id，多本书共用时为 ''}, 'names': {book_id: 书名}}
+
+    # ---------- 存储 ----------
+    @staticmethod
+    def book_id(book_name):
+        norm = SearchResultCache.normalize(book_name)
+        return hashlib.md5(norm.encode('utf-8')).hexdigest()[:16] if norm else None
+
+    @staticmethod
+    def _prefix(url):
+        """章节 URL 的目录前缀；只剩域名的前缀区分不了书，返回 None"""
+        u = TocIndexStore.normalize(url)
+        p = u[:u.rfind('/') + 1] if '/' in u else ''
+        return p if p.count('/') >= 2 else None
+
+    def _path(self, book_id):
+        return os.path.join(self.table_dir, f"{book_id}.json")
+
+    def _load_index(self):
+        try:
+            if os.path.exists(self.index_file):
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                return {k: data.get(k) or {} for k in ('tocs', 'prefixes', 'names')}
+        except Exception as e:
+            print(f"[Align] 加载索引失败: {e}")
+        return {'tocs': {}, 'prefixes': {}, 'names': {}}
+
+    def _write_json(self, path, data):
+        os.makedirs(self.table_dir, exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _get_table(self, book_id):
+        if not book_id: return None
+        with self._lock:
+            table = self._books.get(book_id)
+            if table is not None:
+                self._books.move_to_end(book_id)
+                return table
+        try:
+            with open(self._path(book_id), 'r', encoding='utf-8') as f:
+                table = json.load(f)
+        except Exception:
+            return None
+        with self._lock:
+            self._remember(book_id, table)
+        return table
+
+    def _remember(self, book_id, table):
+        """调用方需持有 self._lock"""
+        self._books[book_id] = table
+        self._books.move_to_end(book_id)
+        while len(self._books) > self.max_memory_books:
+            self._books.popitem(last=False)
+
+    def _save_table(self, book_id, table):
+        """落盘并刷新反查索引 (目录 URL / 章节前缀 -> 书)"""
+        table['updated_at'] = time.time()
+        table.pop('_pos', None)
+        try:
+            self._write_json(self._path(book_id), table)
+        except Exception as e:
+            print(f"[Align] 保存对齐表失败: {e}")
+            return
+        with self._lock:
+            self._remember(book_id, table)
+            self.index['names'][book_id] = table['book']
+            sources = [(table['canon']['toc_url'], table['canon']['urls'])]
+            sources += [(u, m['urls']) for u, m in table['mirrors'].items()]
+            for toc_url, urls in sources:
+                self.index['tocs'][TocIndexStore.normalize(toc_url)] = book_id
+                for u in (urls[0] if urls else None, urls[-1] if urls else None):
+                    p = self._prefix(u) if u else None
+                    if not p: continue
+                    # 前缀已被别的书登记过：说明这个站的章节路径不分书，标记为共用，以后不再按前缀反查
+                    owner = self.index['prefixes'].get(p)
+                    self.index['prefixes'][p] = book_id if owner in (None, book_id) else ''
+            try:
+                self._write_json(self.index_file, self.index)
+            except Exception as e:
+                print(f"[Align] 保存索引失败: {e}")
+
+    # ---------- 对齐 ----------
+    @staticmethod
+    def _canon_from(toc_url, chapters):
+        urls, ids, titles = [], [], []
+        for c in chapters:
+            urls.append(c.get('url', ''))
+            cid = c.get('id')
+            ids.append(cid if isinstance(cid, int) else -1)
+            titles.append(c.get('title') or c.get('name') or '')
+        return {'toc_url': toc_url, 'urls': urls, 'ids': ids, 'titles': titles}
+
+    def _align_mirror(self, table, toc_url, chapters, only_missing=True):
+        """
+        把镜像目录对齐到规范序列：标题精确/模糊匹配 (章节号窗口 + 倒排索引)，不行再按章节号
+        only_missing=True 时已对齐的位置保持不变，只补空位 (新章节 / 上次没对上的)
+        返回对齐覆盖率
+        """
+        canon = table['canon']
+        n = len(canon['urls'])
+        m = table['mirrors'].get(toc_url) or {'source': urlparse(toc_url).netloc, 'urls': []}
+        urls = (m['urls'] if only_missing else [])[:n]
+        urls += [None] * (n - len(urls))
+        index = get_title_index(toc_url, chapters)
+        for i in range(n):
+            if urls[i] is not None: continue
+            pos = self._match_chapter(index, chapters, canon['titles'][i], canon['ids'][i])
+            if pos is not None: urls[i] = chapters[pos]['url']
+        m.update({'urls': urls, 'n': len(chapters), 'updated_at': time.time()})
+        table['mirrors'][toc_url] = m
+        return sum(1 for u in urls if u) / n if n else 0.0
+
+    @staticmethod
+    def _match_chapter(index, chapters, title, cid):
+        """在镜像目录里找同一章：标题精确/模糊匹配，不行再按章节号"""
+        cid = cid if isinstance(cid, int) and cid > 0 else None
+        pos, _, exact = index.match(title, cid)
+        if pos is not None and not exact and cid:
+            # 模糊命中但章节号对不上 ("标题50" vs "标题5")：不可信，改按章节号
+            mid = chapters[pos].get('id')
+            if isinstance(mid, int) and mid > 0 and mid != cid: pos = None
+        if pos is None and cid: pos = index.id_pos.get(cid)
+        return pos
+
+    def build(self, book_name, toc_url):
+        """(后台) 以 toc_url 为主源建整张表"""
+        book_id = self.book_id(book_name)
+        toc = self.crawler.get_toc(toc_url)
+        if not book_id or not toc or not toc.get('chapters'): return None
+        t0 = time.time()
+        table = {'book': book_name, 'canon': self._canon_from(toc_url, toc['chapters']), 'mirrors': {}}
+        old = self._get_table(book_id)
+        if old and TocIndexStore.normalize(old['canon']['toc_url']) == TocIndexStore.normalize(toc_url):
+            table['mirrors'] = {u: m for u, m in old['mirrors'].items()}  # 同一主源：沿用已对齐的镜像
+
+        from spider_core import searcher
+        primary = urlparse(toc_url).netloc
+        known = {urlparse(u).netloc for u in table['mirrors']}
+        candidates = [r for r in self.crawler.source_quality.rank(searcher.search_bing_cached(book_name) or [])
+                      if urlparse(r['url']).netloc not in known | {primary}]
+        candidates = candidates[:max(0, self.max_mirrors - len(table['mirrors'])) * 2]
+
+        def fetch(result):
+            try: return result['url'], self.crawler.get_toc(result['url'], fast_mode=True)
+            except Exception: return result['url'], None
+
+        if candidates:
+            with ThreadPoolExecutor(max_workers=4) as exe:
+                for mirror_url, mtoc in exe.map(fetch, candidates):
+                    if len(table['mirrors']) >= self.max_mirrors: break
+                    if not mtoc or not mtoc.get('chapters'): continue
+                    coverage = self._align_mirror(table, mirror_url, mtoc['chapters'], only_missing=False)
+                    if coverage < self.min_coverage:
+                        table['mirrors'].pop(mirror_url, None)
+        for mirror_url in list(table['mirrors']):
+            if mirror_url in {r['url'] for r in candidates}: continue
+            mtoc = self.crawler.get_toc(mirror_url, fast_mode=True)
+            if mtoc and mtoc.get('chapters'): self._align_mirror(table, mirror_url, mtoc['chapters'])
+        self._save_table(book_id, table)
+        print(f"[Align] 🧭 《{book_name}》对齐表就绪: {len(table['canon']['urls'])} 章 × {len(table['mirrors'])} 个镜像，"
+              f"耗时 {time.time() - t0:.1f}s")
+        return table
+
+    def refresh(self, book_id, toc_url, chapters):
+        """(后台) 某个源目录更新：主源变长就给所有镜像补新位置，镜像变长就补它自己的空位"""
+        table = self._get_table(book_id)
+        if not table: return
+        norm = TocIndexStore.normalize(toc_url)
+        canon = table['canon']
+        if TocIndexStore.normalize(canon['toc_url']) == norm:
+            fresh = self._canon_from(canon['toc_url'], chapters)
+            old_n = len(canon['urls'])
+            if fresh['urls'][:old_n] != canon['urls']:
+                # 不是追加更新 (目录重排/改版)：规范序列变了，已有对齐全部作废
+                for m in table['mirrors'].values(): m['urls'] = []
+            table['canon'] = fresh
+            for mirror_url in list(table['mirrors']):
+                mtoc = self.crawler.get_toc(mirror_url, fast_mode=True)
+                if mtoc and mtoc.get('chapters'): self._align_mirror(table, mirror_url, mtoc['chapters'])
+        else:
+            mirror_url = next((u for u in table['mirrors'] if TocIndexStore.normalize(u) == norm), None)
+            if not mirror_url: return
+            self._align_mirror(table, mirror_url, chapters)
+        self._save_table(book_id, table)
+        print(f"[Align] ♻️ 《{table['book']}》对齐表增量更新: {toc_url}")
+
+    # ---------- 后台调度 ----------
+    def _submit(self, task_key, fn, *args):
+        with self._lock:
+            if task_key in self._pending: return
+            self._pending.add(task_key)
+            if self._pool is None:
+                # 单线程：同一张表的建表/刷新天然串行
+                self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='align')
+
+        def job():
+            try: fn(*args)
+            except Exception as e: print(f"[Align] 后台任务失败 {task_key}: {e}")
+            finally:
+                with self._lock: self._pending.discard(task_key)
+        # 建表 / 刷新是一次搜索加最多 10 个目录抓取：按 update 排队，不占 interactive 预留名额
+        self._pool.submit(self.crawler.scheduler.wrap(job, 'update'))
+
+    def schedule_build(self, book_name, toc_url):
+        """加书架 / 订阅时调用；主源没变且表在 1 天内建过的不重复建"""
+        if not book_name or not toc_url or toc_url.startswith('epub:'): return
+        if os.environ.get('FORCE_LOCAL_CRAWL') == '1': return
+        book_id = self.book_id(book_name)
+        table = self._get_table(book_id)
+        if (table and TocIndexStore.normalize(table['canon']['toc_url']) == TocIndexStore.normalize(toc_url)
+                and time.time() - table.get('updated_at', 0) < 86400):
+            return
+        self._submit(('build', book_id), self.build, book_name, toc_url)
+
+    def on_toc_changed(self, toc_url, chapters):
+        """TocIndexStore 的变更回调：只处理对齐表里登记过的目录"""
+        book_id = self.index['tocs'].get(TocIndexStore.normalize(toc_url))
+        if book_id and ('build', book_id) not in self._pending:
+            self._submit(('refresh', book_id, toc_url), self.refresh, book_id, toc_url, chapters)
+
+    # ---------- 查询 ----------
+    def _position(self, table, url=None, chapter_id=None, title=None):
+        """当前章节在规范序列里的位置：URL (主源或任一镜像) > 章节号 > 标题"""
+        canon = table['canon']
+        if url:
+            pos = self._url_position(table, url)
+            if pos is not None: return pos
+        if chapter_id and chapter_id > 0 and chapter_id in canon['ids']:
+            return canon['ids'].index(chapter_id)
+        if title:
+            clean = clean_chapter_title(title)
+            for i, t in enumerate(canon['titles']):
+                if clean and clean_chapter_title(t) == clean: return i
+        return None
+
+    @staticmethod
+    def _url_position(table, url):
+        """URL (主源或任一镜像) 在规范序列里的位置，不在表里返回 None"""
+        pos_map = table.get('_pos')
+        if pos_map is None:
+            pos_map = {}
+            canon = table['canon']
+            for urls in [canon['urls']] + [m['urls'] for m in table['mirrors'].values()]:
+                for i, u in enumerate(urls):
+                    if u: pos_map.setdefault(TocIndexStore.normalize(u), i)
+            table['_pos'] = pos_map
+        return pos_map.get(TocIndexStore.normalize(url))
+
+    def _live_alternatives(self, table, url, ctx=None):
+        """
+        表里还没有这一章 (新章节，表还没来得及增量更新)：
+        从主源目录索引取出它的标题 / 章节号，现场在各镜像目录 (通常命中目录缓存) 里匹配
+        """
+        loc = self.crawler.toc_index.locate(table['canon']['toc_url'], url)
+        if not loc: return []
+        out = []
+        for mirror_url in table['mirrors']:
+            if ctx is not None and ctx.expired(): break
+            mctx = ctx.replace(timeout=min(ctx.timeout, 5), retries=1) if ctx else None
+            mtoc = self.crawler.get_toc(mirror_url, fast_mode=True, ctx=mctx)
+            chapters = (mtoc or {}).get('chapters')
+            if not chapters: continue
+            pos = self._match_chapter(get_title_index(mirror_url, chapters), chapters, loc['title'], loc['id'])
+            if pos is not None:
+                out.append({'source': urlparse(mirror_url).netloc, 'url': chapters[pos]['url'],
+                            'toc_url': mirror_url, 'title': loc['title']})
+        return out
+
+    def alternatives(self, url=None, book_name=None, chapter_id=None, title=None, live=False, ctx=None):
+        """
+        查表给出当前章节在其他源上的 URL，按书源质量排序
+        返回 [{'source', 'url', 'toc_url', 'title'}]；没建过表 / 定位不到章节时返回 []
+        live=True 时表里定位不到的章节现场去镜像目录里匹配 (可能要拉目录，只在对冲读取里用)
+        """
+        table = None
+        if url:
+            # 前缀只是线索：表里真有这个 URL 才算找到了书，否则按书名
+            p = self._prefix(url)
+            hit = self._get_table(self.index['prefixes'].get(p)) if p else None
+            if hit and self._url_position(hit, url) is not None: table = hit
+        if table is None and book_name: table = self._get_table(self.book_id(book_name))
+        if not table: return []
+        pos = self._position(table, url, chapter_id, title)
+        if pos is None:
+            if not (live and url): return []
+            out = self._live_alternatives(table, url, ctx)
+            out.sort(key=lambda a: -self.crawler.source_quality.score(a['source']))
+            return out
+        canon = table['canon']
+        current = TocIndexStore.normalize(url) if url else None
+        out = []
+        for toc_url, urls in [(canon['toc_url'], canon['urls'])] + [(u, m['urls']) for u, m in table['mirrors'].items()]:
+            if pos >= len(urls) or not urls[pos]: continue
+            if current and TocIndexStore.normalize(urls[pos]) == current: continue
+            out.append({'source': urlparse(toc_url).netloc, 'url': urls[pos], 'toc_url': toc_url,
+                        'title': canon['titles'][pos]})
+        current_domain = urlparse(url).netloc if url else None
+        out = [a for a in out if a['source'] != current_domain] or out
+        out.sort(key=lambda a: -self.crawler.source_quality.score(a['source']))
+        return out
+
+    def stats(self):
+        with self._lock:
+            return {'books': len(self.index['names']), 'tocs': len(self.index['tocs']),
+                    'pending': len(self._pending)}
+
+
 # ==========================================
 # 3. 小说爬虫 (NovelCrawler - 修复KeyError版)
 # ==========================================
@@ -1637,6 +3630,30 @@ class NovelCrawler:
         # [新增] 任务去重机制：防止同一 URL 被重复爬取
         self._active_tasks = {}  # {url: {'event': threading.Event(), 'result': None, 'error': None}}
         self._task_lock = threading.Lock()
+        self.task_record_ttl = 120  # 执行者卡死时，记录最多保留这么久
+        # [新增] 全局抓取调度 (优先级 + 用户公平 + 全局/域名并发上限)
+        self.scheduler = crawl_scheduler
+        # [新增] 通用逻辑的站点提取画像
+        self.profile_store = ExtractionProfileStore()
+        # [新增] 分页章节并行抓取：首页能看出分页规律和总页数时，剩余页并发拉取
+        self.parallel_pages = True
+        self._page_pool = None
+        self._page_pool_lock = threading.Lock()
+        # [新增] 流式提取：章节页优先走 HTMLPullParser，拿齐目标即停，失败再回退 BeautifulSoup
+        self.streaming_extract = True
+        # [新增] 目录索引：章节 URL -> 位置/章节号
+        self.toc_index = TocIndexStore()
+        # [新增] 书源质量统计 (换源时决定先验证谁)
+        self.source_quality = SourceQualityStats()
+        # [新增] 跨源章节对齐表 (换源 / 主源挂掉时查表)，目录变化时增量更新
+        self.alignment = SourceAlignmentStore(self)
+        self.toc_index.on_change = self.alignment.on_toc_changed
+        # [新增] 对冲读取：主源超过该域名近期 p90 还没返回时，同时去最佳镜像抓同一章
+        self.hedged_read = os.environ.get('HEDGED_READ') == '1'
+        self.hedge_default_budget = float(os.environ.get('HEDGE_DEFAULT_BUDGET', 3))
+        self.chapter_latency = EngineLatencyStats(stats_file=os.path.join(USER_DATA_DIR, 'chapter_latency.json'))
+        self._hedge_pool = None
+        self._hedge_pool_lock = threading.Lock()
 
     def _normalize_title(self, text):
         if not text:
@@ -1649,17 +3666,14 @@ class NovelCrawler:
         if not candidates:
             return None
         target_norm = self._normalize_title(target_title)
-        best = None
-        best_score = 0.0
-        for item in candidates:
-            title = item.get('title') or item.get('book_name')
-            if not title:
-                continue
-            score = SequenceMatcher(None, target_norm, self._normalize_title(title)).ratio()
-            if score > best_score:
-                best_score = score
-                best = item.copy()
-                best['match_score'] = score
+        titles = [self._normalize_title(item.get('title') or item.get('book_name') or '') for item in candidates]
+        valid = [i for i, item in enumerate(candidates) if item.get('title') or item.get('book_name')]
+        # LCS 上界剪枝：上界不超过当前最好分数的候选不再算 SequenceMatcher
+        i, score = best_ratio(target_norm, titles, valid)
+        if i is None:
+            return None
+        best = candidates[i].copy()
+        best['match_score'] = score
         return best
 
     def _fetch_qidian_meta(self, book_name):
@@ -1738,6 +3752,10 @@ class NovelCrawler:
         return None
 
     def get_meta_from_qidian_fanqie(self, book_name):
+        if not book_name: return None
+        return single_flight.do(('meta', book_name.strip()), self._get_meta_from_qidian_fanqie, book_name)
+
+    def _get_meta_from_qidian_fanqie(self, book_name):
         qidian_meta = self._fetch_qidian_meta(book_name)
         fanqie_meta = self._fetch_fanqie_meta(book_name)
 
@@ -1751,7 +3769,61 @@ class NovelCrawler:
     # [新增] 智能换源核心逻辑
     # ==========================================
     # === [调试增强版] 搜索并返回可用源列表 ===
-    def search_alternative_sources(self, book_name, target_chapter_id):
+    def _validate_candidates(self, search_results, target_chapter_id, ctx=None, want=1, max_checks=10, workers=8):
+        """
+        换源候选验证：先按书源质量排序 (而不是搜索结果顺序)，并发拉目录找目标章节
+        找够 want 个就停：没开始的任务直接取消，已在跑的让它跑完 (只用于更新质量统计)
+        返回 [(搜索结果, 命中的章节)]，按完成先后排列
+        """
+        candidates = self.source_quality.rank(search_results)[:max_checks]
+        if not candidates: return []
+        stop = threading.Event()
+        found = []
+
+        def check_source(result):
+            if stop.is_set(): return None
+            toc_url = result['url']
+            domain = urlparse(toc_url).netloc
+            started = time.monotonic()
+            try:
+                toc = self.get_toc(toc_url, ctx=ctx)
+            except Exception:
+                toc = None
+            elapsed = time.monotonic() - started
+            chapters = (toc or {}).get('chapters')
+            if not chapters:
+                self.source_quality.record_toc(domain, False)
+                return None
+            # 倒序查找，效率更高
+            hit = next((c for c in reversed(chapters) if c.get('id') == target_chapter_id), None)
+            if hit is not None:
+                completeness = 1.0
+            else:
+                ids = [c.get('id') for c in chapters[-20:] if isinstance(c.get('id'), int)]
+                completeness = min(1.0, max(ids) / target_chapter_id) if ids and target_chapter_id else 0.0
+            # 命中目录缓存的耗时不代表站点速度，不计入延迟
+            self.source_quality.record_toc(domain, True, elapsed if elapsed > 0.05 else None, completeness)
+            return (result, hit) if hit is not None else None
+
+        exe = ThreadPoolExecutor(max_workers=min(workers, len(candidates)))
+        try:
+            check = self.scheduler.wrap(check_source)  # 线程池里沿用调用方 (通常是阅读请求) 的优先级
+            futures = [exe.submit(check, res) for res in candidates]
+            for future in as_completed(futures):
+                try: res = future.result()
+                except Exception: res = None
+                if not res: continue
+                found.append(res)
+                if len(found) >= want:
+                    stop.set()
+                    break
+        finally:
+            # 找够了就不再等剩下的源 (排队中的直接取消)
+            exe.shutdown(wait=False, cancel_futures=True)
+        self.source_quality.flush()
+        return found
+
+    def search_alternative_sources(self, book_name, target_chapter_id, want=3):
         print(f"\n[Switch] 🚀 极速换源: 《{book_name}》 (ID: {target_chapter_id})")
         
         # 1. 搜索 (带缓存)
@@ -1762,45 +3834,19 @@ class NovelCrawler:
         if not search_results:
             return []
 
-        print(f"[Switch] 🔍 缓存/搜索返回 {len(search_results)} 个源，开始极速验证...")
-        valid_sources = []
+        print(f"[Switch] 🔍 缓存/搜索返回 {len(search_results)} 个源，按书源质量排序后验证...")
+        # 所有候选共用一个截止时间：单源 5 秒超时、不重试，整轮验证最多 12 秒
+        ctx = self._resolve_ctx(fast_mode=True)
+        if ctx.wait_timeout(12) >= 12: ctx = ctx.replace(deadline=time.monotonic() + 12)
         
-        # 2. 验证任务 (极速版)
-        def check_source(result):
-            toc_url = result['url']
-            domain = urlparse(toc_url).netloc
-            
-            try:
-                # [关键] 开启 fast_mode=True
-                # 超时 5秒，不重试。如果 5秒没拉下来目录，说明这个源太慢，直接丢弃！
-                toc = self.get_toc(toc_url, fast_mode=True)
-                
-                if not toc or not toc.get('chapters'):
-                    return None
-                
-                # 倒序查找，效率更高
-                for chap in reversed(toc['chapters']):
-                    if chap.get('id') == target_chapter_id:
-                        # print(f"[Switch] ✅ 命中: {domain}")
-                        return {
-                            "source": domain,
-                            "url": chap['url'],
-                            "title": chap['name'],
-                            "toc_url": toc_url
-                        }
-            except: pass
-            return None
-
-        # 3. 并发验证 (最大 8 线程)
-        # 只取前 5 个结果验证，因为后面的通常质量低且浪费时间
-        candidates = search_results[:5] 
-        
-        with ThreadPoolExecutor(max_workers=8) as exe:
-            futures = [exe.submit(check_source, res) for res in candidates]
-            for future in as_completed(futures):
-                res = future.result()
-                if res:
-                    valid_sources.append(res)
+        # 2. 并发验证：最多验证 10 个质量靠前的源，找够 want 个有效源立即返回
+        matches = self._validate_candidates(search_results, target_chapter_id, ctx=ctx, want=want)
+        valid_sources = [{
+            "source": urlparse(result['url']).netloc,
+            "url": chap['url'],
+            "title": chap['name'],
+            "toc_url": result['url']
+        } for result, chap in matches]
         
         print(f"[Switch] 🏁 耗时操作结束，找到 {len(valid_sources)} 个有效源")
         return valid_sources
@@ -1826,44 +3872,17 @@ class NovelCrawler:
             if not chapters: return None
 
             # === 1. 优先尝试标题模糊匹配 ===
+            # 索引匹配：精确标题字典 + bigram 倒排/章节号窗口收窄候选 + LCS 上界剪枝，只对少数候选算相似度
             if target_title:
-                from difflib import SequenceMatcher
-                
-                # 预处理：去掉 "第xxx章" 和空格，只比对核心文字
-                def clean_t(t):
-                    # 去除 "第xxx章"、"Episode X" 等前缀，以及所有空格和标点
-                    t = re.sub(r'^(?:第)?\s*[0-9零一二三四五六七八九十百千万]+\s*[章节回卷\.]', '', str(t))
-                    t = re.sub(r'[ \u3000\t\r\n]', '', t)
-                    return t.strip()
-                
-                clean_target = clean_t(target_title)
-                
-                if clean_target:
-                    best_ratio = 0
-                    best_url = None
-                    best_title_found = ""
-
-                    # 遍历目录查找最相似的
-                    for chap in chapters:
-                        clean_chap = clean_t(chap.get('name', '') or chap['title'])
-                        
-                        # A. 完全包含 (极高置信度，例如 "大战三百回合" vs "大战三百回合(修)")
-                        if clean_target == clean_chap and len(clean_target) > 1:
-                            print(f"[Switch] ✅ 标题完全一致: {chap['title']}")
-                            return chap['url']
-                        
-                        # B. 相似度计算
-                        ratio = SequenceMatcher(None, clean_target, clean_chap).ratio()
-                        
-                        # 如果相似度超过 0.7 且是目前最高的
-                        if ratio > 0.7 and ratio > best_ratio:
-                            best_ratio = ratio
-                            best_url = chap['url']
-                            best_title_found = chap['title']
-                    
-                    if best_url:
-                        print(f"[Switch] ✅ 标题相似度命中 ({best_ratio:.2f}): [{target_title}] vs [{best_title_found}]")
-                        return best_url
+                index = get_title_index(toc_url, chapters)
+                pos, ratio, exact = index.match(target_title, target_id if target_id and target_id > 0 else None)
+                if pos is not None:
+                    chap = chapters[pos]
+                    if exact:
+                        print(f"[Switch] ✅ 标题完全一致: {chap['title']}")
+                    else:
+                        print(f"[Switch] ✅ 标题相似度命中 ({ratio:.2f}): [{target_title}] vs [{chap['title']}]")
+                    return chap['url']
 
             # === 2. 其次尝试 ID 匹配 ===
             if target_id and target_id > 0:
@@ -2040,58 +4059,23 @@ class NovelCrawler:
         # 1. 全网搜索备选源 (复用 SearchHelper)
         # 搜索关键词加上 "目录"，提高命中率
         from spider_core import searcher # 确保引用
-        search_results = searcher.search_bing(book_name)
+        search_results = searcher.search_bing_cached(book_name)
         
         if not search_results:
             print("[Switch] 未搜索到任何结果")
             return None
 
-        # 2. 定义单个源的验证任务
-        def check_source(result):
-            toc_url = result['url']
-            domain = urlparse(toc_url).netloc
-            
-            # 简单过滤：如果是当前正在使用的源(略)，或者明显不是小说站的，可以在这里过滤
-            # 这里先不做复杂过滤，信任 SearchHelper 的黑名单
-            
-            try:
-                # 抓取目录 (复用 get_toc，它会自动进行 ID 解析和排序)
-                toc = self.get_toc(toc_url)
-                if not toc or not toc.get('chapters'):
-                    return None
-                
-                # 3. 在目录中二分查找或遍历寻找目标 ID
-                # 因为我们已经排好序了，理论上二分更快，但列表不长，遍历也行
-                for chap in toc['chapters']:
-                    if chap.get('id') == target_chapter_id:
-                        print(f"[Switch] ✅ 在 [{domain}] 找到匹配章节: {chap['name']}")
-                        return {
-                            "new_url": chap['url'],
-                            "source_name": domain,
-                            "chapter_title": chap['name']
-                        }
-            except Exception as e:
-                # print(f"[Switch] 检查源 {domain} 失败: {e}")
-                pass
-            return None
-
-        # 3. 并发验证 (速度至上)
-        # 我们同时检查前 5 个搜索结果
-        candidates = search_results[:6] 
-        found_target = None
-        
-        with ThreadPoolExecutor(max_workers=6) as exe:
-            futures = [exe.submit(check_source, res) for res in candidates]
-            
-            for future in as_completed(futures):
-                res = future.result()
-                if res:
-                    found_target = res
-                    # 只要找到一个能用的，立马停止其他任务（虽然线程池没法立刻kill，但我们可以break返回）
-                    # 实际上为了最快响应，谁先返回就用谁
-                    break
-        
-        return found_target
+        # 2. 按书源质量排序后并发验证，谁先找到目标章节就用谁 (其余取消)
+        matches = self._validate_candidates(search_results, target_chapter_id, want=1)
+        if not matches: return None
+        result, chap = matches[0]
+        domain = urlparse(result['url']).netloc
+        print(f"[Switch] ✅ 在 [{domain}] 找到匹配章节: {chap['name']}")
+        return {
+            "new_url": chap['url'],
+            "source_name": domain,
+            "chapter_title": chap['name']
+        }
     def resolve_start_url(self, url):
         """
         [新增] 智能入口解析：如果给的是目录，自动转为第一章
@@ -2126,32 +4110,77 @@ class NovelCrawler:
         except Exception as e:
             print(f"[SmartURL] Resolve Error: {e}")
             return url
-    def _fetch_page_smart(self, url, retry=None, timeout=None):
+    def _resolve_ctx(self, ctx=None, fast_mode=False):
+        """
+        确定本次调用的 FetchContext：显式传入 > 线程上下文 > 按实例默认值新建
+        fast_mode 只在没有显式 ctx 时生效 (5 秒超时、不重试)，截止时间/优先级沿用线程上下文
         """
-        基础请求：支持自定义重试次数和超时时间
-        配合 get_toc 的 fast_mode 使用
+        if ctx is not None: return ctx
+        inherited = current_fetch_context()
+        if fast_mode:
+            if inherited is not None:
+                return inherited.replace(timeout=min(inherited.timeout, 5), retries=1)
+            return FetchContext.fast()
+        if inherited is not None: return inherited
+        return FetchContext(timeout=self.timeout)
+
+    @contextmanager
+    def fetch_scope(self, ctx):
         """
-        # 1. 参数决断：如果未传入，则使用实例变量或默认值
-        # 这样设计是为了让 get_toc 中临时修改 self.timeout 能生效
-        current_retry = retry if retry is not None else 3
-        current_timeout = timeout if timeout is not None else self.timeout
+        让 ctx 在当前线程生效：旧适配器里不带 ctx 的 _fetch_page_smart 调用也能取到它；
+        ctx 指定了优先级/用户时同时切换调度器上下文
+        """
+        with fetch_context_scope(ctx):
+            if ctx is not None and (ctx.priority is not None or ctx.user is not None):
+                priority = ctx.priority if ctx.priority is not None else self.scheduler.current()[0]
+                with self.scheduler.context(priority, ctx.user):
+                    yield ctx
+            else:
+                yield ctx
+
+    def _call_adapter(self, fn, url, ctx):
+        """调用适配器方法：声明了 ctx 参数的直接透传，没声明的通过线程上下文生效"""
+        try:
+            accepts = 'ctx' in inspect.signature(fn).parameters
+        except (TypeError, ValueError):
+            accepts = False
+        with self.fetch_scope(ctx):
+            return fn(self, url, ctx=ctx) if accepts else fn(self, url)
+
+    def _fetch_page_smart(self, url, retry=None, timeout=None, ctx=None):
+        """
+        基础请求
+        :param ctx: FetchContext (超时/重试/优先级/截止时间)；不传时取线程上下文，再没有就用实例默认值
+        :param retry / timeout: 兼容旧调用，显式给出时覆盖 ctx 里的对应值
+        截止时间到了就不再重试，单次请求超时也会被截断到剩余时间
+        """
+        ctx = self._resolve_ctx(ctx)
+        current_retry = retry if retry is not None else ctx.retries
+        domain = urlparse(url).netloc
 
         for i in range(current_retry):
+            current_timeout = ctx.attempt_timeout() if timeout is None else min(timeout, ctx.attempt_timeout())
+            if current_timeout <= 0:
+                return None  # 截止时间已到
             try:
                 headers = {
                     "Referer": url, 
                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36"
                 }
                 
-                # 发起请求
-                resp = cffi_requests.get(
-                    url, 
-                    impersonate=self.impersonate, 
-                    timeout=current_timeout,  # <--- 关键：使用动态超时
-                    headers=headers, 
-                    allow_redirects=True, 
-                    proxies=self.proxies
-                )
+                # 发起请求 (先向全局调度器申请名额，重试间隔期间不占名额；有截止时间时排队也不越过它)
+                with self.fetch_scope(ctx), self.scheduler.slot(domain, timeout=ctx.remaining()):
+                    # 排队可能已经用掉一部分时间，按剩余时间重新截断
+                    current_timeout = min(current_timeout, ctx.attempt_timeout())
+                    if current_timeout <= 0: return None
+                    resp = cffi_requests.get(
+                        url, 
+                        impersonate=self.impersonate, 
+                        timeout=current_timeout,  # <--- 本次调用自己的超时，不读共享的 self.timeout
+                        headers=headers, 
+                        allow_redirects=True, 
+                        proxies=self.proxies
+                    )
                 
                 # === 编码智能识别逻辑 ===
                 
@@ -2176,14 +4205,78 @@ class NovelCrawler:
                 return resp.content.decode('utf-8', errors='replace')
 
             except Exception as e: 
-                # 只有不是最后一次重试时才 sleep
+                # 只有不是最后一次重试时才 sleep (剩余时间不够等一秒也直接放弃)
                 if i == current_retry - 1: 
                     # print(f"[Fetch] 最终失败: {url} | Err: {e}")
                     return None 
+                left = ctx.remaining()
+                if left is not None and left <= 1: return None
                 time.sleep(1)
         
         return None
 
+    # 分页 URL 规律: 123_2.html / 1_2 / 123-2.html / ?page=2
+    _PAGE_URL_PATTERNS = [
+        re.compile(r'^(.*[_-])2((?:\.s?html?)?/?)$'),
+        re.compile(r'^(.*[?&](?:page|p)=)2((?:&.*)?)$'),
+    ]
+    # 总页数提示: (1/3) / 第1/3页 / 1/3页
+    _PAGE_TOTAL_RE = re.compile(r'(?:[\(（]\s*1\s*/\s*(\d{1,2})\s*[\)）]|第?\s*1\s*/\s*(\d{1,2})\s*页)')
+
+    def _get_page_pool(self):
+        """分页抓取共享线程池 (阅读和批量任务共用，懒加载)"""
+        if self._page_pool is None:
+            with self._page_pool_lock:
+                if self._page_pool is None:
+                    self._page_pool = ThreadPoolExecutor(max_workers=12, thread_name_prefix="page_fetch")
+        return self._page_pool
+
+    def _plan_page_urls(self, page, next_page_url, max_pages):
+        """
+        根据首页推算剩余分页 URL
+        需要同时满足：第2页链接符合已知规律 + 首页能看到总页数；否则返回 [] 走顺序发现
+        :param page: 首页的 soup，或流式提取得到的提示文本
+        """
+        if not next_page_url: return []
+        template = None
+        for pat in self._PAGE_URL_PATTERNS:
+            m = pat.match(next_page_url)
+            if m:
+                template = (m.group(1), m.group(2))
+                break
+        if not template: return []
+
+        total = 0
+        if isinstance(page, str):
+            texts = [page]
+        else:
+            head = page.find('title')
+            texts = [head.get_text() if head else "", page.get_text(' ')]
+        for txt in texts:
+            m = self._PAGE_TOTAL_RE.search(txt)
+            if m:
+                total = int(m.group(1) or m.group(2))
+                break
+        if total < 2: return []
+        total = min(total, max_pages)
+        return [f"{template[0]}{n}{template[1]}" for n in range(2, total + 1)]
+
+    def _prefetch_pages(self, urls, ctx=None):
+        """并发拉取分页，返回 {url: html}，失败的页不放入结果 (后续由顺序逻辑补抓)"""
+        if not urls: return {}
+        pool = self._get_page_pool()
+        ctx = self._resolve_ctx(ctx)  # 线程池里没有调用方的线程上下文，显式带过去
+        fetch = self.scheduler.wrap(self._fetch_page_smart)
+        futures = {u: pool.submit(fetch, u, ctx=ctx) for u in urls}
+        pages = {}
+        for u, f in futures.items():
+            try:
+                html = f.result()
+                if html: pages[u] = html
+            except Exception:
+                pass
+        return pages
+
     def _get_smart_title(self, soup):
         h1_title = soup.find('h1', class_=re.compile(r'title|chapter|book|name', re.I))
         if h1_title: return h1_title.get_text(strip=True)
@@ -2210,51 +4303,240 @@ class NovelCrawler:
         return lines
 
     def _extract_content_smart(self, soup):
+        return self._extract_content_with_selector(soup)[0]
+
+    def _css_selector_for(self, tag, max_depth=6):
+        """
+        为标签(或其最近的可识别祖先)生成稳定的 CSS 选择器，供站点画像记忆
+        优先 id，其次 tag.class；都没有则返回 None
+        """
+        node = tag
+        for _ in range(max_depth):
+            if node is None or not getattr(node, 'name', None) or node.name in ('html', 'body', '[document]'):
+                return None
+            nid = node.get('id')
+            if nid and re.match(r'^[\w-]+$', str(nid)):
+                return f'[id="{nid}"]'
+            classes = [c for c in (node.get('class') or []) if re.match(r'^[A-Za-z_][\w-]*$', c)]
+            if classes:
+                return node.name + ''.join('.' + c for c in classes)
+            node = node.parent
+        return None
+
+    def _extract_content_with_selector(self, soup):
+        """全量启发式提取正文，同时返回命中的选择器 (content_lines, selector)"""
         for cid in ['txt', 'content', 'chaptercontent', 'BookText', 'showtxt', 'nr1', 'read-content']:
             div = soup.find(id=cid)
             if div:
                 for a in div.find_all('a'): a.decompose()
-                return self._clean_text_lines(div.get_text('\n'))
+                return self._clean_text_lines(div.get_text('\n')), f'[id="{cid}"]'
         best_div, max_score = None, 0
         for div in soup.find_all('div'):
             if div.get('id') and re.search(r'(nav|foot|header|menu)', str(div.get('id')), re.I): continue
             txt = div.get_text(strip=True)
             score = len(txt) - (len(div.find_all('a')) * 5)
             if score > max_score: max_score, best_div = score, div
-        return self._clean_text_lines(best_div.get_text('\n')) if best_div else ["正文解析失败"]
+        if not best_div: return ["正文解析失败"], None
+        # 只有正文块自身带 id/class 才能被记住 (祖先选择器会圈进导航等杂项)
+        sel = self._css_selector_for(best_div, max_depth=1)
+        return self._clean_text_lines(best_div.get_text('\n')), sel
+
+    def _extract_content_by_selector(self, soup, selector):
+        """按画像中记住的选择器直接取正文"""
+        try:
+            div = soup.select_one(selector)
+        except Exception:
+            return None
+        if not div: return None
+        for a in div.find_all('a'): a.decompose()
+        return self._clean_text_lines(div.get_text('\n'))
+
+    def _scan_nav_links(self, soup, current_url, current_chap_id, page_count, nav_scopes=None, nav_ids=None):
+        """
+        扫描上一章/下一章/下一页/目录链接
+        :param nav_scopes: 画像中记住的导航容器选择器，给定时只扫描这些容器内的 <a>
+        :param nav_ids: 画像中记住的导航 id，给定时只检查这些 id
+        :return: (nav, learned_scopes, found_ids)
+        """
+        if nav_scopes:
+            anchors = []
+            for sel in nav_scopes:
+                try: box = soup.select_one(sel)
+                except Exception: box = None
+                if box: anchors.extend(box.find_all('a'))
+        else:
+            anchors = soup.find_all('a')
+        links = [(a.get_text(strip=True).replace(' ', ''), a.get('href')) for a in anchors]
+
+        id_links = {}
+        for aid in (nav_ids if nav_ids is not None else self.NAV_IDS):
+            tag = soup.find(id=aid)
+            if tag and tag.get('href'): id_links[aid] = tag['href']
+
+        nav, hit_idx = self._classify_nav_links(links, id_links, current_url, current_chap_id, page_count)
+        learned_scopes = []
+        for i in hit_idx.values():
+            sel = self._css_selector_for(anchors[i].parent)
+            if sel and sel not in learned_scopes: learned_scopes.append(sel)
+        return nav, learned_scopes[:3], list(id_links.keys())
+
+    NAV_IDS = ['pb_prev', 'prev_url', 'pb_next', 'next_url', 'pb_mulu']
+
+    def _classify_nav_links(self, links, id_links, current_url, current_chap_id, page_count):
+        """
+        把 (文字, href) 列表归类为 上一章/下一章/下一页/目录 (soup 与流式提取共用)
+        :return: (nav, hit_idx) hit_idx 记录每类命中的 links 下标
+        """
+        nav = {'next_page': None, 'next': None, 'prev': None, 'toc': None}
+        hit_idx = {}
+        for i, (txt, href) in enumerate(links):
+            if not href or href.startswith('javascript'): continue
+            full = urljoin(current_url, href)
+            if "下一页" in txt or "下—页" in txt or re.search(r'\(\d+/\d+\)', txt):
+                if current_chap_id and current_chap_id in href: nav['next_page'] = full; hit_idx['next_page'] = i
+                else: nav['next'] = full; hit_idx['next'] = i
+            elif "下一章" in txt or "下章" in txt: nav['next'] = full; hit_idx['next'] = i
+            if page_count == 0:
+                if "上一章" in txt or "上章" in txt: nav['prev'] = full; hit_idx['prev'] = i
+                elif "上一页" in txt or "上页" in txt:
+                    if current_chap_id and current_chap_id not in href: nav['prev'] = full; hit_idx['prev'] = i
+            if "目录" in txt: nav['toc'] = full; hit_idx['toc'] = i
+
+        for aid in self.NAV_IDS:
+            href = id_links.get(aid)
+            if not href: continue
+            t_url = urljoin(current_url, href)
+            if 'prev' in aid and page_count == 0 and not nav['prev']:
+                if current_chap_id and current_chap_id not in href: nav['prev'] = t_url
+            elif 'next' in aid and not nav['next']:
+                if current_chap_id and current_chap_id in href: nav['next_page'] = t_url
+                else: nav['next'] = t_url
+            elif 'mulu' in aid and not nav['toc']: nav['toc'] = t_url
+        return nav, hit_idx
+
+    def stream_extract(self, html, title=None, content=None, nav=None, drop=None, nav_ids=None, stop_when=None):
+        """
+        流式提取入口 (适配器可直接调用并声明自己的目标)
+        :return: StreamingPageExtractor (含 title/content/links/id_links)；解析异常或没找到正文时返回 None
+        """
+        try:
+            ex = StreamingPageExtractor(title=title, content=content, nav=nav, drop=drop,
+                                        nav_ids=nav_ids, stop_when=stop_when).feed_all(html)
+        except Exception as e:
+            print(f"[Stream] 流式解析失败，回退 soup: {e}")
+            return None
+        return ex if ex.content is not None else None
+
+    def _stream_page_parts(self, html, current_url, current_chap_id, page_count, domain, profile):
+        """
+        通用逻辑的流式快路径：返回 (title, content_lines, nav, hint_text)；拿不到可信结果时返回 None 交给 soup 路径
+        """
+        targets = list(StreamingPageExtractor.DEFAULT_CONTENT)
+        learned = profile.get('content') if profile else None
+        if learned:
+            if learned in targets: targets.remove(learned)
+            targets.insert(0, learned)
+
+        def nav_ready(ex):
+            nav, _ = self._classify_nav_links(ex.links, ex.id_links, current_url, current_chap_id, page_count)
+            return bool((nav['next'] or nav['next_page']) and nav['toc'] and (page_count > 0 or nav['prev']))
+
+        ex = self.stream_extract(html, content=targets, nav_ids=self.NAV_IDS, stop_when=nav_ready)
+        if not ex: return None
+
+        content = self._clean_text_lines(ex.content)
+        content_len = sum(len(l) for l in content)
+        nav, _ = self._classify_nav_links(ex.links, ex.id_links, current_url, current_chap_id, page_count)
+        if page_count == 0 and not (nav['next'] or nav['prev'] or nav['toc']): return None
+
+        if learned and ex.content_spec == learned:
+            if not self.profile_store.is_content_ok(domain, content): return None
+            self.profile_store.record_hit(domain, content_len)
+        else:
+            self.profile_store.learn(domain, content_sel=ex.content_spec, content_len=content_len)
+        return ex.title, content, nav, ex.hint_text()
+
+    def _extract_page_parts(self, soup, current_url, current_chap_id, page_count, domain, profile):
+        """
+        提取单页的正文与导航：优先走站点画像，质量不达标时回退全量启发式并重新学习
+        """
+        content, nav = None, None
+        missed = False  # 画像里学过的部分是否有一项试过但失败了
+        if profile and profile.get('content'):
+            content = self._extract_content_by_selector(soup, profile['content'])
+            if not self.profile_store.is_content_ok(domain, content): content, missed = None, True
+        if profile and profile.get('nav'):
+            nav, _, _ = self._scan_nav_links(soup, current_url, current_chap_id, page_count,
+                                             nav_scopes=profile['nav'], nav_ids=profile.get('nav_ids', []))
+            # 首页至少要拿到一个导航链接，否则认为画像失效
+            if page_count == 0 and not (nav['next'] or nav['prev'] or nav['toc']): nav, missed = None, True
+
+        if content is not None and nav is not None:
+            self.profile_store.record_hit(domain, sum(len(l) for l in content))
+            return content, nav
+
+        # === 画像缺失或失效：全量启发式 ===
+        # 只有学过的选择器失败才算失效；画像只是还没学到导航时，正文照常算命中，下面补学导航
+        if missed: self.profile_store.record_miss(domain)
+        elif content is not None: self.profile_store.record_hit(domain, sum(len(l) for l in content))
+        content_sel = None
+        if content is None:
+            content, content_sel = self._extract_content_with_selector(soup)
+        nav_sels, nav_ids = None, None
+        if nav is None:
+            nav, nav_sels, nav_ids = self._scan_nav_links(soup, current_url, current_chap_id, page_count)
+            if not (nav['next'] or nav['prev'] or nav['toc']): nav_sels, nav_ids = None, None
+        self.profile_store.learn(domain, content_sel=content_sel, nav_sels=nav_sels, nav_ids=nav_ids,
+                                 content_len=sum(len(l) for l in content))
+        return content, nav
+
+    _TOC_CONTAINERS = ('div', 'ul', 'dl', 'tbody')
 
     def _parse_chapters_from_soup(self, soup, base_url):
-        links = []
-        max_valid_links = 0
-        containers = soup.find_all(['div', 'ul', 'dl', 'tbody'])
-        if not containers: containers = [soup.body]
-        
-        junk_keywords = ['最新章节', '全文阅读', '无弹窗', '小说', '笔趣阁', '加入书架', '投推荐票', '作家', '作者']
+        """
+        在链接最多的容器里提取章节
+        单次遍历：每个 <a> 只校验一次，再计入它所有的祖先容器 (原先每个容器都要重扫一遍子孙链接)
+        """
+        containers = soup.find_all(list(self._TOC_CONTAINERS))
+        if not containers:
+            containers = [soup.body] if soup.body else []
+        order = {id(c): i for i, c in enumerate(containers)}
+        skip = set()
+        for c in containers:
+            if c.get('class') and any(x in str(c.get('class')) for x in ['nav', 'footer', 'header', 'hot', 'recommend']): skip.add(id(c))
 
-        for container in containers:
-            if container.get('class') and any(x in str(container.get('class')) for x in ['nav', 'footer', 'header', 'hot', 'recommend']): continue
-            temp_links = []
-            for a in container.find_all('a'):
-                raw_text = a.get_text(strip=True)
-                href = a.get('href')
-                if not href: continue
-                if any(k in raw_text for k in junk_keywords) and not re.search(r'\d', raw_text): continue
-                
-                chap_id = parse_chapter_id(raw_text)
-                is_valid = False
-                if chap_id > 0: is_valid = True
-                elif len(raw_text) > 2 and any(x in raw_text for x in ['章', '节', '回', '幕']) and not any(k in raw_text for k in junk_keywords): is_valid = True
-                
-                if is_valid:
-                    full_url = urljoin(base_url, href)
-                    match_name = re.search(r'(?:第)?\s*[0-9零一二三四五六七八九十百千万]+\s*[章节回](.*)', raw_text)
-                    pure_name = match_name.group(1).strip() if match_name else raw_text
-                    if full_url:
-                        # 注意：这里我们生成字典时不带 'title' 键，统一由 _standardize_chapters 处理
-                        temp_links.append({'id': chap_id, 'raw_title': raw_text, 'name': pure_name, 'url': full_url})
-            
-            if len(temp_links) > max_valid_links: max_valid_links = len(temp_links); links = temp_links
-        return links
+        junk_keywords = ['最新章节', '全文阅读', '无弹窗', '小说', '笔趣阁', '加入书架', '投推荐票', '作家', '作者']
+        buckets = {}  # {id(container): [chapter, ...]}
+
+        for a in soup.find_all('a'):
+            href = a.get('href')
+            if not href: continue
+            raw_text = a.get_text(strip=True)
+            if any(k in raw_text for k in junk_keywords) and not re.search(r'\d', raw_text): continue
+
+            chap_id = parse_chapter_id(raw_text)
+            is_valid = False
+            if chap_id > 0: is_valid = True
+            elif len(raw_text) > 2 and any(x in raw_text for x in ['章', '节', '回', '幕']) and not any(k in raw_text for k in junk_keywords): is_valid = True
+            if not is_valid: continue
+
+            full_url = urljoin(base_url, href)
+            if not full_url: continue
+            match_name = re.search(r'(?:第)?\s*[0-9零一二三四五六七八九十百千万]+\s*[章节回](.*)', raw_text)
+            pure_name = match_name.group(1).strip() if match_name else raw_text
+            # 注意：这里我们生成字典时不带 'title' 键，统一由 _standardize_chapters 处理
+            item = {'id': chap_id, 'raw_title': raw_text, 'name': pure_name, 'url': full_url}
+            for parent in a.parents:
+                key = id(parent)
+                if key in order and key not in skip:
+                    buckets.setdefault(key, []).append(item)
+
+        # 与原逻辑一致：取链接最多的容器，数量相同取文档中靠前的
+        best_key, best_len = None, 0
+        for key, items in buckets.items():
+            if len(items) > best_len or (len(items) == best_len and best_key is not None and order[key] < order[best_key]):
+                best_key, best_len = key, len(items)
+        return [dict(c) for c in buckets[best_key]] if best_key is not None else []
 
     def _standardize_chapters(self, raw_chapters):
         unique = {c['url']: c for c in raw_chapters}
@@ -2297,11 +4579,24 @@ class NovelCrawler:
         og_author = soup.find('meta', property='og:novel:author')
         if og_author: meta['author'] = og_author.get('content', '')
         else:
-            for tag in soup.find_all(['p', 'span', 'div']):
-                txt = tag.get_text(strip=True)
-                if txt.startswith('作者：') or txt.startswith('作者:'):
-                    meta['author'] = txt.replace('作者：', '').replace('作者:', '').strip()
-                    break
+            author = ''
+            # 从文本节点反查所在的 p/span/div，避免对每个 div 做整棵子树的 get_text
+            # 作者名可能在标签外 (<p><span>作者：</span>张三</p>)：逐级向上，直到 "作者：" 后面有内容
+            for s in soup.find_all(string=re.compile(r'^\s*作者[：:]')):
+                for tag in s.find_parents(['p', 'span', 'div']):
+                    txt = tag.get_text(strip=True)
+                    if not (txt.startswith('作者：') or txt.startswith('作者:')): break
+                    author = txt.replace('作者：', '').replace('作者:', '').strip()
+                    if author: break
+                if author: break
+            if not author:
+                # "作者" 和冒号被拆在不同节点等情况：回退原来的全量扫描
+                for tag in soup.find_all(['p', 'span', 'div']):
+                    txt = tag.get_text(strip=True)
+                    if txt.startswith('作者：') or txt.startswith('作者:'):
+                        author = txt.replace('作者：', '').replace('作者:', '').strip()
+                        if author: break
+            if author: meta['author'] = author
         
         # 3. 简介
         og_desc = soup.find('meta', property='og:description')
@@ -2309,12 +4604,34 @@ class NovelCrawler:
 
         print(f"[Meta] cover={'Y' if meta['cover'] else 'N'} author={meta['author']} desc_len={len(meta['desc'])}")
         return meta
-    def get_toc(self, url, fast_mode=False, no_cache=False):
+    def get_toc(self, url, fast_mode=False, no_cache=False, on_chapters=None, ctx=None):
         """
-        获取目录
+        获取目录 (同一目录并发请求只抓一次，其余调用者共享结果)
         :param no_cache: 如果为 True，强制忽略本地缓存文件
+        :param on_chapters: 通用逻辑下逐页推送新章节的回调 (适配器/缓存/远程命中时不会触发)
+        :param ctx: FetchContext；不传时 fast_mode=True 用 5 秒超时、不重试，否则用实例默认值
         """
         if not url: return None
+        ctx = self._resolve_ctx(ctx, fast_mode=fast_mode)
+        # 需要逐页回调的调用者不能搭别人的车
+        if on_chapters: return self._get_toc_impl(url, no_cache, on_chapters, ctx)
+        # 等别人的结果也不越过自己的截止时间；配置了 Redis 时多进程 / 多 Master 之间也只抓一次
+        # 超时/重试档位也进 key：fast_mode (5 秒、不重试) 的空结果或残缺目录不能分给完整预算的调用者
+        # 截止时间截断的残缺目录 (partial) 只给自己用，不分给同 key 的其他调用者
+        return cluster_flight.do(('toc', url, bool(no_cache), ctx.timeout, ctx.retries), self._get_toc_impl, url, no_cache, None, ctx,
+                                 wait_timeout=ctx.wait_timeout(60), lease_ms=90000,
+                                 encode=pack_toc, decode=lambda data: self._adopt_shared_toc(url, data),
+                                 shareable=lambda data: not (data or {}).get('partial'))
+
+    def _adopt_shared_toc(self, url, data):
+        """其他进程抓到的目录：还原紧凑目录并建本进程的目录索引"""
+        data = unpack_toc(data)
+        if isinstance(data, dict) and data.get('chapters'):
+            self.toc_index.build(url, data['chapters'])
+        return data
+
+    def _get_toc_impl(self, url, no_cache=False, on_chapters=None, ctx=None):
+        ctx = self._resolve_ctx(ctx)
         
         url_hash = hashlib.md5(url.encode()).hexdigest()
         # [修复] 使用 CACHE_DIR 而不是 managers.CACHE_DIR
@@ -2326,58 +4643,37 @@ class NovelCrawler:
                 # 检查过期时间 (例如 12 小时)
                 if time.time() - os.path.getmtime(cache_path) < 43200: 
                     with open(cache_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
+                        data = unpack_toc(json.load(f))
                         if data and data.get('chapters'):
                             print(f"[Crawler] ✅ 命中本地目录缓存: {url}")
+                            self.toc_index.build(url, data['chapters'])
                             return data
              except: pass
              
         # 2. 尝试远程集群获取目录
-        remote_data = _remote_request('toc', {'url': url})
+        remote_data = _remote_request('toc', {'url': url}, wait=ctx.wait_timeout(25))
+        if remote_data and remote_data.get('partial'):
+            print("[Crawler] 📥 远程只拿到残缺目录，不写缓存、不建索引")
+            return unpack_toc(remote_data)
         if remote_data:
             print(f"[Crawler] 📥 远程获取目录成功，写入本地缓存")
             # 写入缓存
             try:
                 with open(cache_path, 'w', encoding='utf-8') as f:
-                    json.dump(remote_data, f, ensure_ascii=False, indent=2)
+                    json.dump(pack_toc(remote_data), f, ensure_ascii=False)
             except: pass
+            remote_data = unpack_toc(remote_data)
+            if isinstance(remote_data, dict) and remote_data.get('chapters'):
+                self.toc_index.build(url, remote_data['chapters'])
             return remote_data
         
         # 3. 降级到本地获取
         print(f"[Crawler] 🌐 远程不可用，本地获取目录 (强制刷新={no_cache}): {url}")
-        
-        # 参数设置
-        timeout = 5 if fast_mode else 15
-        retry = 1 if fast_mode else 3
+        if ctx.expired():
+            print(f"[TOC] ⏰ 已过截止时间，放弃本地抓取: {url}")
+            return None
 
-        print("fff", url)
-        adapter = plugin_mgr.find_match(url)
-        print(adapter)
-        if adapter: 
-            # 注意：如果适配器里的 get_toc 调用了 _fetch_page_smart，
-            # 我们需要修改适配器才能生效，或者我们在这里 monkey patch 一下？
-            # 简单起见，我们假设适配器调用的是 self._fetch_page_smart
-            # 我们可以临时把 self.timeout 改了，虽然不优雅但有效
-            
-            old_timeout = self.timeout
-            self.timeout = timeout # 临时修改全局超时
-            print("ttt")
-            try:
-                data = adapter.get_toc(self, url)
-            finally:
-                self.timeout = old_timeout # 恢复
-        else: 
-            # 通用逻辑，直接传参
-            # 我们需要修改 _general_toc_logic 接受参数，或者像上面一样改 self.timeout
-             # 这里复用上面的逻辑修改 timeout 属性最稳妥
-             pass
-        
-        # 为了不修改所有适配器代码，我们采用修改实例属性的方式来实现 Fast Mode
-        # 上面的逻辑其实只对 adapter 有效，对通用逻辑需要下面这段：
-        
-        # 重新写一段通用的 get_toc 调用逻辑：
-        old_timeout = self.timeout
-        self.timeout = timeout
+        # 超时/重试都在 ctx 里，随调用一路传下去，不再改共享实例的 self.timeout
         adapter = plugin_mgr.find_match(url)
         data = None
         final_meta = {"cover": "", "author": "", "desc": "", "tags": []}
@@ -2386,14 +4682,14 @@ class NovelCrawler:
         try:
             if adapter: 
                 # 1. 调用适配器获取目录 (标准操作)
-                data = adapter.get_toc(self, url)
+                data = self._call_adapter(adapter.get_toc, url, ctx)
                 print(f"[TOC] adapter={adapter.__class__.__name__} data={'Y' if data else 'N'}")
                 
                 # 2. [新增功能] 检查并调用适配器的 get_meta 方法
                 if hasattr(adapter, 'get_meta'):
                     try:
                         print(f"[Crawler] ⚡ 优先调用适配器元数据接口: {adapter.__class__.__name__}")
-                        plugin_meta = adapter.get_meta(self, url)
+                        plugin_meta = self._call_adapter(adapter.get_meta, url, ctx)
                         
                         if plugin_meta:
                             # 优先使用适配器返回的数据 (如果非空)
@@ -2413,7 +4709,7 @@ class NovelCrawler:
                     print(f"[Meta] toc_meta cover={'Y' if final_meta['cover'] else 'N'} author={final_meta['author']} desc_len={len(final_meta['desc'])}")
             else:
                 # 通用逻辑
-                data = self._general_toc_logic(url)
+                data = self._general_toc_logic(url, on_chapters=on_chapters, ctx=ctx)
                 print(f"[TOC] general data={'Y' if data else 'N'}")
                 if data:
                     final_meta['cover'] = data.get('cover', '')
@@ -2423,18 +4719,22 @@ class NovelCrawler:
 
         except Exception as e:
             return None
-        finally:
-            self.timeout = old_timeout
 
         if not data or not data.get('chapters'):
             print(f"[TOC] empty or no chapters: data={'Y' if data else 'N'} url={url}")
             return None
         
-        if data.get('manual_sort') is True: return data
+        # 截止时间截断的残缺目录照常返回给调用者，但不建索引 (也就不会触发源对齐刷新)
+        partial = bool(data.get('partial'))
+        if partial: print(f"[TOC] ⏰ 截止时间内只抓到部分分页，目录标记为残缺: {url}")
+        if data.get('manual_sort') is True:
+            if not partial: self.toc_index.build(url, data['chapters'])
+            return data
         final_chapters = self._standardize_chapters(data['chapters'])
+        if not partial: self.toc_index.build(url, final_chapters)
         
         # 返回合并后的结果
-        return {
+        result = {
             'title': data['title'], 
             'chapters': final_chapters,
             'cover': final_meta['cover'],
@@ -2442,33 +4742,102 @@ class NovelCrawler:
             'desc': final_meta['desc'],
             'tags': final_meta['tags']
         }
+        if partial: result['partial'] = True
+        return result
 
-    def _general_toc_logic(self, toc_url):
-        html = self._fetch_page_smart(toc_url)
-        if not html: return None
-        soup = BeautifulSoup(html, 'html.parser')
-        raw_chapters = self._parse_chapters_from_soup(soup, toc_url)
-        
-        pages = set()
+    def _toc_page_urls(self, soup, toc_url):
+        """目录分页：<select><option> 里的页面地址，按页面顺序去重"""
+        pages = []
         for s in soup.find_all('select'):
             for o in s.find_all('option'):
                 v = o.get('value')
                 if v:
                     f = urljoin(toc_url, v)
-                    if f.rstrip('/') != toc_url.rstrip('/'): pages.add(f)
-        if pages:
-            with ThreadPoolExecutor(max_workers=5) as exe:
-                results = exe.map(lambda u: self._parse_chapters_from_soup(BeautifulSoup(self._fetch_page_smart(u) or "", 'html.parser'), toc_url), sorted(list(pages)))
-                for sub in results: raw_chapters.extend(sub)
+                    if f.rstrip('/') != toc_url.rstrip('/') and f not in pages: pages.append(f)
+        return pages
+
+    def _iter_toc_pages(self, pages, toc_url, window=6, ctx=None):
+        """
+        分页目录流水线：共享线程池抓取，最多 window 页在途，按页面顺序逐页产出章节
+        每页只建一次 soup，解析完立即释放，50 页的目录也不会同时驻留 50 棵树
+        截止时间到了还有分页没抓到 (没提交或抓取失败) 时，最后额外产出一个 None
+        """
+        pool = self._get_page_pool()
+        ctx = self._resolve_ctx(ctx)
+        fetch = self.scheduler.wrap(self._fetch_page_smart)
+        pending = []
+        it = iter(pages)
+        for u in it:
+            pending.append(pool.submit(fetch, u, ctx=ctx))
+            if len(pending) >= window: break
+        truncated = False
+        while pending:
+            fut = pending.pop(0)
+            if ctx.expired():
+                nxt = None
+                if next(it, None) is not None: truncated = True
+            else:
+                nxt = next(it, None)
+            if nxt: pending.append(pool.submit(fetch, nxt, ctx=ctx))
+            try:
+                html = fut.result()
+            except Exception:
+                html = None
+            if not html:
+                if ctx.expired(): truncated = True
+                continue
+            soup = BeautifulSoup(html, 'html.parser')
+            chapters = self._parse_chapters_from_soup(soup, toc_url)
+            soup.decompose()
+            yield chapters
+        if truncated: yield None
+
+    def _general_toc_logic(self, toc_url, on_chapters=None, ctx=None):
+        """
+        通用目录逻辑
+        :param on_chapters: 可选回调 f(new_chapters)，每解析完一页就按页面顺序推送本页新增 (已去重) 的章节
+        :param ctx: FetchContext；不传时取线程上下文 (适配器回退到这里时沿用它的 ctx)
+        """
+        ctx = self._resolve_ctx(ctx)
+        html = self._fetch_page_smart(toc_url, ctx=ctx)
+        if not html: return None
+        soup = BeautifulSoup(html, 'html.parser')
+        # 首页一次解析：章节 + 分页 + 元数据 + 标题
+        first = self._parse_chapters_from_soup(soup, toc_url)
+        pages = self._toc_page_urls(soup, toc_url)
         meta = self._get_book_meta(soup, toc_url)
+        title = self._get_smart_title(soup)
+        soup.decompose()
+
+        raw_chapters, seen = [], set()
+
+        def absorb(batch):
+            fresh = []
+            for c in batch:
+                if c['url'] in seen: continue
+                seen.add(c['url'])
+                fresh.append(c)
+            raw_chapters.extend(fresh)
+            if on_chapters and fresh:
+                try: on_chapters(fresh)
+                except Exception as e: print(f"[TOC] 章节推送回调出错: {e}")
+
+        absorb(first)
+        partial = False
+        if pages:
+            for batch in self._iter_toc_pages(pages, toc_url, ctx=ctx):
+                if batch is None: partial = True
+                else: absorb(batch)
         
-        return {
-            'title': self._get_smart_title(soup), 
+        data = {
+            'title': title, 
             'chapters': raw_chapters,
             'cover': meta['cover'],
             'author': meta['author'],
             'desc': meta['desc']
         }
+        if partial: data['partial'] = True
+        return data
 
     def get_latest_chapter(self, toc_url, no_cache=False):
         """
@@ -2482,13 +4851,15 @@ class NovelCrawler:
             return toc['chapters'][-1]
         return None
 
-    def run(self, url):
+    def run(self, url, ctx=None):
         """
         智能爬取：自动去重 + 结果共享
         如果同一 URL 正在被其他请求爬取，则等待结果而非重复爬取
+        :param ctx: FetchContext；等待别人的结果、本地抓取、分页缝合都不越过它的截止时间
         """
         if not url:
             return None
+        ctx = self._resolve_ctx(ctx)
         
         # 0. 优先检查本地缓存
         from managers import cache
@@ -2499,7 +4870,6 @@ class NovelCrawler:
                 return cached_data
         
         # 1. [核心去重] 检查是否有正在进行的任务
-        import threading
         with self._task_lock:
             if url in self._active_tasks:
                 print(f"[Crawler] 🔄 检测到重复请求 {url[:80]}，等待已有任务完成...")
@@ -2511,66 +4881,174 @@ class NovelCrawler:
                 task_info = {
                     'event': threading.Event(),
                     'result': None,
-                    'error': None
+                    'error': None,
+                    'token': object()
                 }
                 self._active_tasks[url] = task_info
                 is_waiter = False
+        if not is_waiter:
+            # 兜底：执行者卡死时由统一的清理线程到期摘除记录并放行等待者
+            # (回调只持有 token，不持有结果，任务完成后结果不会被清理队列拖住)
+            token = task_info['token']
+            task_reaper.schedule(self.task_record_ttl, lambda: self._reap_task(url, token))
         
         # 2. 如果是等待者，阻塞等待结果
         if is_waiter:
-            task_info['event'].wait(timeout=30)  # 最多等待 30 秒
-            if task_info['result'] is not None:
+            finished = task_info['event'].wait(timeout=ctx.wait_timeout(30))  # 最多等待 30 秒 (或到截止时间)
+            if task_info.get('partial') and not ctx.expired():
+                print(f"[Crawler] ✂️ 主任务只拿到半章，自己重新爬取: {url[:80]}")
+            elif task_info['result'] is not None:
                 print(f"[Crawler] ✅ 获得共享结果: {url[:80]}")
                 return task_info['result']
             elif task_info['error'] is not None:
                 print(f"[Crawler] ❌ 主任务失败: {task_info['error']}")
                 return None
+            elif finished:
+                return None  # 执行者已完成但没有拿到内容，不再重复爬取
+            elif ctx.expired():
+                print(f"[Crawler] ⏰ 等待到截止时间仍无结果: {url[:80]}")
+                return None
             else:
                 print(f"[Crawler] ⏰ 等待超时，尝试自己爬取")
                 # 超时后尝试自己爬取（防止死锁）
         
         # 3. 我们是执行者，开始实际爬取
         try:
-            result = self._do_actual_crawl(url)
-            
-            # 保存结果并通知所有等待者
-            with self._task_lock:
-                if url in self._active_tasks:
-                    self._active_tasks[url]['result'] = result
-                    self._active_tasks[url]['event'].set()
-                    print(f"[Crawler] 📢 爬取完成，通知等待者: {url[:80]}")
-            
+            # 本进程内已由 _active_tasks 去重，这里只做跨进程去重
+            started = time.monotonic()
+            result = cluster_flight.do(('run', url), self._do_actual_crawl, url, ctx,
+                                       wait_timeout=ctx.wait_timeout(30), lease_ms=90000, local=False,
+                                       shareable=lambda r: not (r or {}).get('partial'))
+            # 章节抓取耗时按域名记样本 (对冲读取的预算来源)
+            if not url.startswith('epub:'):
+                self.chapter_latency.record(urlparse(url).netloc, time.monotonic() - started, self._is_good_chapter(result))
+            if not is_waiter:
+                # 保存结果并通知所有等待者；记录立即摘除，结果只由等待者手里的引用持有
+                # 半章 (截止时间到了分页没抓完) 不分给等待者，它们按自己的时间预算重爬
+                if (result or {}).get('partial'): task_info['partial'] = True
+                else: task_info['result'] = result
+                self._cleanup_task(url, task_info)
+                print(f"[Crawler] 📢 爬取完成，通知等待者: {url[:80]}")
             return result
         
         except Exception as e:
             # 保存错误并通知等待者
-            with self._task_lock:
-                if url in self._active_tasks:
-                    self._active_tasks[url]['error'] = str(e)
-                    self._active_tasks[url]['event'].set()
+            if not is_waiter:
+                task_info['error'] = str(e)
+                self._cleanup_task(url, task_info)
             print(f"[Crawler] ❌ 爬取失败: {e}")
             return None
-        
-        finally:
-            # 延迟清理任务记录（60秒后），避免内存泄漏
-            threading.Timer(60, lambda: self._cleanup_task(url)).start()
     
-    def _cleanup_task(self, url):
-        """清理已完成的任务记录"""
+    @staticmethod
+    def _is_good_chapter(data):
+        content = (data or {}).get('content')
+        return bool(content) and content != ["正文解析失败"] and data.get('title') != '错误' and not data.get('partial')
+
+    def hedge_budget(self, domain, ctx=None):
+        """主源独占的等待时间：该域名近期 p90 (样本不足时用默认值)，不超过剩余时间的一半"""
+        p90 = self.chapter_latency.percentile(domain, 0.9)
+        budget = max(0.8, p90 if p90 is not None else self.hedge_default_budget)
+        left = ctx.remaining() if ctx else None
+        return budget if left is None else min(budget, left / 2)
+
+    def _get_hedge_pool(self):
+        with self._hedge_pool_lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='hedge')
+            return self._hedge_pool
+
+    def run_hedged(self, url, ctx=None):
+        """
+        对冲读取：先只抓主源；超过预算 (该域名近期 p90) 还没拿到有效正文，
+        就从对齐表 (按标题 / 章节号匹配) 找最佳镜像同时抓同一章，先拿到有效正文的赢，另一边取消
+        两路都走 _hedge_branch (不进 run 的去重)，取消输掉的一方不会影响同 URL 的其他读者
+        返回 (data, 实际采用的 url)
+        """
+        ctx = self._resolve_ctx(ctx)
+        if url.startswith('epub:'): return self.run(url, ctx), url
+        pool = self._get_hedge_pool()
+        primary_ctx = ctx.replace()
+        branch = self.scheduler.wrap(self._hedge_branch)  # 两路都沿用读者的优先级
+        branches = {pool.submit(branch, url, primary_ctx): (url, primary_ctx)}
+        pending = set(branches)
+        done, pending = futures_wait(pending, timeout=self.hedge_budget(urlparse(url).netloc, ctx))
+        fallback = None
+        for f in done:
+            data = f.result()
+            if self._is_good_chapter(data): return data, url
+            fallback = data
+
+        alts = self.alignment.alternatives(url=url, live=True, ctx=ctx)
+        if alts and not ctx.expired():
+            alt = alts[0]
+            print(f"[Hedge] 🔀 主源{'返回无效内容' if done else '超时未返回'}，对冲请求镜像 {alt['source']}: {alt['url']}")
+            alt_ctx = ctx.replace()
+            f = pool.submit(branch, alt['url'], alt_ctx)
+            branches[f] = (alt['url'], alt_ctx)
+            pending.add(f)
+
+        winner = None
+        while pending and winner is None:
+            done, pending = futures_wait(pending, timeout=ctx.wait_timeout(60), return_when=FIRST_COMPLETED)
+            if not done: break
+            for f in done:
+                try: data = f.result()
+                except Exception: data = None
+                if self._is_good_chapter(data):
+                    winner = (data, branches[f][0])
+                    break
+                fallback = fallback or data
+        # 输掉 / 超时的一方：排队中的直接取消，已在抓的让它在下一次检查时放弃
+        for f in pending:
+            f.cancel()
+            branches[f][1].cancel()
+        if winner:
+            if winner[1] != url: print(f"[Hedge] ✅ 镜像先返回: {winner[1]}")
+            return winner
+        return fallback, url
+
+    def _hedge_branch(self, url, ctx):
+        """
+        对冲的一路：查缓存后直接 _do_actual_crawl，不登记 _active_tasks / cluster_flight
+        (它可能被取消，不能当别人的领头任务，否则取消后会把空结果 / 半章分发给所有等待者)
+        """
+        from managers import cache
+        cached = cache.get(url)
+        if cached: return cached
+        started = time.monotonic()
+        result = self._do_actual_crawl(url, ctx)
+        # 被取消的一路耗时不代表该源的真实延迟，不计入样本
+        if not ctx.cancelled:
+            self.chapter_latency.record(urlparse(url).netloc, time.monotonic() - started, self._is_good_chapter(result))
+        return result
+
+    def _cleanup_task(self, url, task_info):
+        """摘除任务记录并唤醒等待者 (只摘除自己那条，避免误删同 URL 的新任务)"""
         with self._task_lock:
-            if url in self._active_tasks:
+            if self._active_tasks.get(url) is task_info:
                 del self._active_tasks[url]
-                print(f"[Crawler] 🧹 清理任务记录: {url[:80]}")
+        task_info['event'].set()
+
+    def _reap_task(self, url, token):
+        """清理线程回调：执行者超过 task_record_ttl 仍未完成"""
+        with self._task_lock:
+            task_info = self._active_tasks.get(url)
+            if not task_info or task_info.get('token') is not token: return
+            del self._active_tasks[url]
+        task_info['error'] = 'timeout'
+        task_info['event'].set()
+        print(f"[Crawler] 🧹 任务超时，已摘除记录: {url[:80]}")
     
-    def _do_actual_crawl(self, url):
+    def _do_actual_crawl(self, url, ctx=None):
         """
         实际执行爬取的逻辑（原 run 方法的核心部分）
         """
+        ctx = self._resolve_ctx(ctx)
         # 必须在函数内部导入，防止循环引用
         from managers import cache
         
         # 1. 尝试远程集群爬取 (Pull/Push 模式通用)
-        remote_data = _remote_request('run', {'url': url})
+        remote_data = _remote_request('run', {'url': url}, wait=ctx.wait_timeout(25))
         
         if remote_data:
             print(f"[Crawler] 📥 远程抓取成功，写入本地缓存")
@@ -2585,15 +5063,18 @@ class NovelCrawler:
         adapter = plugin_mgr.find_match(url)
         if adapter:
             print(f"[Run] ✨ 匹配到适配器: {adapter.__class__.__name__}")
-            result = adapter.run(self, url)
-            print(f"[Run] 📦 插件返回书名: {result.get('book_name', '未获取')}")
-            return result
-        
-        print(f"[Run] 🌐 未找到插件，使用通用逻辑...")
-        # 4. 如果没插件，执行通用逻辑
-        return self._general_run_logic(url)
+            result = self._call_adapter(adapter.run, url, ctx)
+            print(f"[Run] 📦 插件返回书名: {(result or {}).get('book_name', '未获取')}")
+        else:
+            print(f"[Run] 🌐 未找到插件，使用通用逻辑...")
+            # 4. 如果没插件，执行通用逻辑
+            result = self._general_run_logic(url, ctx)
+        # 正文质量计入书源统计
+        self.source_quality.record_content(urlparse(url).netloc, (result or {}).get('content'))
+        return result
     
-    def _general_run_logic(self, url):
+    def _general_run_logic(self, url, ctx=None):
+        ctx = self._resolve_ctx(ctx)
         try:
             base_url = url
             if "_" in url:
@@ -2607,43 +5088,43 @@ class NovelCrawler:
             original_title = ""
             chap_id_match = re.search(r'/(\d+)(?:_\d+)?\.html', base_url)
             current_chap_id = chap_id_match.group(1) if chap_id_match else ""
+            domain = urlparse(url).netloc
+            profile = self.profile_store.get(domain)
+            prefetched = {}
             
+            partial = False
             while page_count < max_pages:
-                html = self._fetch_page_smart(current_url)
-                if not html: break
-                soup = BeautifulSoup(html, 'html.parser')
-                current_title = self._get_smart_title(soup)
+                # 截止时间到了就带着已缝合的部分返回，并标记为半章 (不缓存、不共享)
+                if page_count and ctx.expired():
+                    partial = True
+                    break
+                html = prefetched.pop(current_url, None) or self._fetch_page_smart(current_url, ctx=ctx)
+                if not html:
+                    partial = page_count > 0 and ctx.expired()
+                    break
+                parts = None
+                if self.streaming_extract:
+                    parts = self._stream_page_parts(html, current_url, current_chap_id, page_count, domain, profile)
+                if parts:
+                    current_title, content, nav, page_hint = parts
+                else:
+                    soup = BeautifulSoup(html, 'html.parser')
+                    current_title = self._get_smart_title(soup)
+                    page_hint = soup
                 if page_count == 0: original_title = current_title
                 elif current_title != original_title and len(current_title) > 3: break
-                content = self._extract_content_smart(soup)
+                if not parts:
+                    content, nav = self._extract_page_parts(soup, current_url, current_chap_id, page_count, domain, profile)
                 if content and original_title in content[0]: content = content[1:]
                 combined_content.extend(content)
-                next_page_url, next_chapter_url, prev_chapter_url, toc_url = None, None, None, None
-                for a in soup.find_all('a'):
-                    txt = a.get_text(strip=True).replace(' ', '')
-                    href = a.get('href')
-                    if not href or href.startswith('javascript'): continue
-                    full = urljoin(current_url, href)
-                    if "下一页" in txt or "下—页" in txt or re.search(r'\(\d+/\d+\)', txt):
-                        if current_chap_id and current_chap_id in href: next_page_url = full
-                        else: next_chapter_url = full
-                    elif "下一章" in txt or "下章" in txt: next_chapter_url = full
-                    if page_count == 0:
-                        if "上一章" in txt or "上章" in txt: prev_chapter_url = full
-                        elif "上一页" in txt or "上页" in txt:
-                            if current_chap_id and current_chap_id not in href: prev_chapter_url = full
-                    if "目录" in txt: toc_url = full
-                for aid in ['pb_prev', 'prev_url', 'pb_next', 'next_url', 'pb_mulu']:
-                    tag = soup.find(id=aid)
-                    if not tag or not tag.get('href'): continue
-                    t_url = urljoin(current_url, tag['href'])
-                    if 'prev' in aid and page_count == 0 and not prev_chapter_url:
-                        if current_chap_id and current_chap_id not in tag['href']: prev_chapter_url = t_url
-                    elif 'next' in aid and not next_chapter_url:
-                        if current_chap_id and current_chap_id in tag['href']: next_page_url = t_url
-                        else: next_chapter_url = t_url
-                    elif 'mulu' in aid and not toc_url: toc_url = t_url
-                if page_count == 0: first_page_meta = {'title': original_title, 'prev': prev_chapter_url, 'toc_url': toc_url}
+                next_page_url, next_chapter_url = nav['next_page'], nav['next']
+                prev_chapter_url, toc_url = nav['prev'], nav['toc']
+                if page_count == 0:
+                    first_page_meta = {'title': original_title, 'prev': prev_chapter_url, 'toc_url': toc_url}
+                    # 首页即可推算出全部分页时，并发拉取剩余页；后续仍按链接顺序缝合和校验
+                    if self.parallel_pages and next_page_url:
+                        planned = [u for u in self._plan_page_urls(page_hint, next_page_url, max_pages) if u not in visited_urls]
+                        prefetched = self._prefetch_pages(planned, ctx=ctx)
                 if next_page_url and next_page_url not in visited_urls:
                     current_url = next_page_url
                     visited_urls.add(next_page_url)
@@ -2654,6 +5135,7 @@ class NovelCrawler:
             
             if first_page_meta:
                 first_page_meta['content'] = combined_content
+                if partial: first_page_meta['partial'] = True
                 return first_page_meta
             return None
         except Exception as e:
@@ -0,0 +1,171 @@
+"""
+SQLite 连接层 (SQLitePool)
+
+原先每个请求 / 每次调用都 sqlite3.connect 一次，也没开 WAL：阅读进度同步频繁写库时，
+读请求全部排在写锁后面。这里统一负责：
+1. 启动时把数据库切到 WAL (持久化在库文件里，只需做一次)，读写互不阻塞
+2. 每个连接设置 synchronous=NORMAL / cache_size / mmap_size / busy_timeout / temp_store
+3. 连接复用：线程第一次取连接时从空闲队列借出 (没有就新建)，之后同一线程一直用这一个；
+   请求结束 (release) 或线程退出时自动归还，空闲队列满了才真正关闭
+调用方原有的 conn.close() 不会真的关闭池化连接，只会回滚未提交的事务。
+"""
+import os
+import queue
+import sqlite3
+import threading
+
+SQLITE_CACHE_KB = int(os.environ.get('SQLITE_CACHE_KB', 16384))   # 每连接页缓存 (KB)
+SQLITE_MMAP_MB = int(os.environ.get('SQLITE_MMAP_MB', 128))       # 内存映射读取上限 (MB)
+SQLITE_BUSY_MS = int(os.environ.get('SQLITE_BUSY_MS', 5000))      # 写锁等待时间 (毫秒)
+SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 8))     # 每个库最多保留的空闲连接
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    池化连接：close() 只回滚未提交事务，真正关闭用 real_close()
+    同一线程共用一个连接，close() 回滚的是这个线程上所有未提交的写入，不只是调用者自己的
+    """
+    pooled = False
+
+    def close(self):
+        if not self.pooled:
+            return super().close()
+        try:
+            if self.in_transaction: self.rollback()
+        except sqlite3.Error:
+            pass
+
+    def real_close(self):
+        self.pooled = False
+        super().close()
+
+
+def apply_pragmas(conn):
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_MS}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+def enable_wal(path):
+    """切换到 WAL，返回最终的 journal_mode"""
+    conn = sqlite3.connect(path, timeout=SQLITE_BUSY_MS / 1000)
+    try:
+        return conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    finally:
+        conn.close()
+
+
+class _Lease:
+    """挂在 threading.local 上的租约：线程退出时随线程局部变量一起回收，连接自动回到池里"""
+    __slots__ = ('pool', 'conn')
+
+    def __init__(self, pool, conn):
+        self.pool, self.conn = pool, conn
+
+    def __del__(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            try: self.pool._put_back(conn)
+            except Exception: pass
+
+
+class SQLitePool:
+    def __init__(self, path, row_factory=None, max_idle=SQLITE_POOL_SIZE, wal=True):
+        self.path = path
+        self.row_factory = row_factory
+        self.wal = wal
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wal_checked = False
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+
+    def _ensure_wal(self):
+        if self._wal_checked or not self.wal: return
+        with self._lock:
+            if self._wal_checked: return
+            try:
+                mode = enable_wal(self.path)
+                if mode.lower() != 'wal':
+                    print(f"⚠️ [SQLite] {os.path.basename(self.path)} 无法切换到 WAL (当前 {mode})")
+            except sqlite3.Error as e:
+                print(f"⚠️ [SQLite] 开启 WAL 失败: {e}")
+            self._wal_checked = True
+
+    def _open(self):
+        self._ensure_wal()
+        # 连接会在线程之间传递 (归还后被别的线程借走)，但同一时刻只属于一个线程
+        conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_MS / 1000,
+                               factory=PooledConnection, check_same_thread=False)
+        apply_pragmas(conn)
+        if self.row_factory is not None:
+            conn.row_factory = self.row_factory
+        conn.pooled = True
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    def _put_back(self, conn):
+        try:
+            if conn.in_transaction: conn.rollback()
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.real_close()
+            with self._lock:
+                self.closed += 1
+
+    def get(self):
+        """当前线程的连接 (第一次调用时借出)"""
+        lease = getattr(self._local, 'lease', None)
+        if lease is not None and lease.conn is not None:
+            return lease.conn
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.reused += 1
+        except queue.Empty:
+            conn = self._open()
+        self._local.lease = _Lease(self, conn)
+        return conn
+
+    def release(self):
+        """提前归还当前线程的连接 (请求结束时调用)"""
+        lease = getattr(self._local, 'lease', None)
+        if lease is None: return
+        self._local.lease = None
+        conn, lease.conn = lease.conn, None
+        if conn is not None: self._put_back(conn)
+
+    def close_all(self):
+        while True:
+            try: conn = self._idle.get_nowait()
+            except queue.Empty: break
+            conn.real_close()
+
+    def stats(self):
+        with self._lock:
+            return {'path': os.path.basename(self.path), 'opened': self.opened, 'reused': self.reused,
+                    'closed': self.closed, 'idle': self._idle.qsize()}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path, row_factory=None):
+    """按库文件路径取连接池 (每个库一个)"""
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = _pools[path] = SQLitePool(path, row_factory=row_factory)
+    return pool
+
+
+def pool_stats():
+    return [p.stats() for p in list(_pools.values())]
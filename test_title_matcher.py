@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试 title_matcher.best_ratio 与逐个 SequenceMatcher 比较的结果完全一致"""
+
+import random
+from difflib import SequenceMatcher
+
+from title_matcher import ChapterTitleIndex, best_ratio, clean_chapter_title
+
+# 字表故意取得很小，生成的标题之间大量共享字符，容易出现同分
+ALPHABET = "风云天下剑心魔道人间少年归来山河月明"
+
+
+def linear_best(target, strings, candidates, threshold):
+    """旧写法：顺序遍历，严格大于才替换 (同分取下标最小的)"""
+    best_i, best_score = None, threshold
+    for i in candidates:
+        score = SequenceMatcher(None, target, strings[i]).ratio()
+        if score > best_score:
+            best_i, best_score = i, score
+    return best_i, (best_score if best_i is not None else 0.0)
+
+
+def make_toc(rnd, n):
+    return [{'id': i + 1, 'name': ''.join(rnd.choice(ALPHABET) for _ in range(rnd.randint(1, 8))),
+             'url': f"https://example.com/{i + 1}.html"} for i in range(n)]
+
+
+def test_best_ratio_matches_linear_scan():
+    rnd = random.Random(20240501)
+    for _ in range(30):
+        chapters = make_toc(rnd, rnd.randint(1, 300))
+        titles = [clean_chapter_title(c['name']) for c in chapters]
+        for _ in range(20):
+            target = ''.join(rnd.choice(ALPHABET) for _ in range(rnd.randint(1, 8)))
+            threshold = rnd.choice([0.0, 0.3, 0.5, 0.7])
+            candidates = sorted(rnd.sample(range(len(titles)), rnd.randint(1, len(titles))))
+            assert best_ratio(target, titles, candidates, threshold) == linear_best(target, titles, candidates, threshold)
+            assert best_ratio(target, titles, None, threshold) == linear_best(target, titles, range(len(titles)), threshold)
+
+
+def test_index_match_matches_linear_scan_over_candidates():
+    rnd = random.Random(7)
+    for _ in range(20):
+        chapters = make_toc(rnd, rnd.randint(50, 500))
+        idx = ChapterTitleIndex(chapters)
+        for _ in range(20):
+            target = ''.join(rnd.choice(ALPHABET) for _ in range(rnd.randint(2, 8)))
+            target_id = rnd.randint(1, len(chapters))
+            i, score, exact = idx.match(target, target_id)
+            if exact:
+                assert idx.titles[i] == clean_chapter_title(target)
+                continue
+            expected = linear_best(clean_chapter_title(target), idx.titles, idx.candidates(clean_chapter_title(target), target_id), 0.7)
+            assert (i, score) == expected
+
+
+if __name__ == '__main__':
+    print("=" * 50)
+    print("标题模糊匹配测试")
+    print("=" * 50)
+    for name, fn in list(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print(f"✅ {name}")
+    print("=" * 50)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试通用目录解析 (_parse_chapters_from_soup) 与作者提取 (_get_book_meta)"""
+
+import re
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+from spider_core import crawler_instance, parse_chapter_id
+
+BASE_URL = "https://www.example.com/book/1/"
+
+
+def legacy_parse_chapters(soup, base_url):
+    """从 spider_core.py 复制的旧实现 (每个容器重扫一遍子孙链接)，作为对照"""
+    links = []
+    max_valid_links = 0
+    containers = soup.find_all(['div', 'ul', 'dl', 'tbody'])
+    if not containers: containers = [soup.body]
+
+    junk_keywords = ['最新章节', '全文阅读', '无弹窗', '小说', '笔趣阁', '加入书架', '投推荐票', '作家', '作者']
+
+    for container in containers:
+        if container.get('class') and any(x in str(container.get('class')) for x in ['nav', 'footer', 'header', 'hot', 'recommend']): continue
+        temp_links = []
+        for a in container.find_all('a'):
+            raw_text = a.get_text(strip=True)
+            href = a.get('href')
+            if not href: continue
+            if any(k in raw_text for k in junk_keywords) and not re.search(r'\d', raw_text): continue
+
+            chap_id = parse_chapter_id(raw_text)
+            is_valid = False
+            if chap_id > 0: is_valid = True
+            elif len(raw_text) > 2 and any(x in raw_text for x in ['章', '节', '回', '幕']) and not any(k in raw_text for k in junk_keywords): is_valid = True
+
+            if is_valid:
+                full_url = urljoin(base_url, href)
+                match_name = re.search(r'(?:第)?\s*[0-9零一二三四五六七八九十百千万]+\s*[章节回](.*)', raw_text)
+                pure_name = match_name.group(1).strip() if match_name else raw_text
+                if full_url:
+                    temp_links.append({'id': chap_id, 'raw_title': raw_text, 'name': pure_name, 'url': full_url})
+
+        if len(temp_links) > max_valid_links: max_valid_links = len(temp_links); links = temp_links
+    return links
+
+
+def _links(ids, prefix='c'):
+    return ''.join(f'<a href="{prefix}{i}.html">第{i}章 标题{i}</a>' for i in ids)
+
+
+# 目录页夹具：(名称, html)
+TOC_FIXTURES = [
+    ("普通目录", f'<html><body><div id="list"><dl>{_links(range(1, 6))}</dl></div></body></html>'),
+    # 两个容器章节数相同：取文档中靠前的那个
+    ("数量相同取靠前", f'<html><body><ul class="a">{_links(range(1, 4), "x")}</ul>'
+                       f'<ul class="b">{_links(range(4, 7), "y")}</ul></body></html>'),
+    # 导航 / 推荐容器章节更多也要跳过
+    ("跳过导航容器", f'<html><body><div class="nav-top">{_links(range(1, 20), "n")}</div>'
+                     f'<div class="hot-list">{_links(range(1, 20), "h")}</div>'
+                     f'<ul id="chapters">{_links(range(1, 4))}</ul></body></html>'),
+    # 外层容器被跳过，但内层容器正常参与
+    ("跳过外层保留内层", f'<html><body><div class="footer"><ul>{_links(range(1, 5))}</ul></div></body></html>'),
+    # 杂项链接 (加入书架 / 作者主页) 不算章节，无 href 的链接忽略
+    ("过滤杂项链接", '<html><body><div><a href="/shelf">加入书架</a><a href="/author">作者其他作品</a>'
+                     f'<a>第9章 没有链接</a>{_links(range(1, 3))}<a href="/x">楔子 第一回</a></div></body></html>'),
+    # 没有任何容器：退回 <body>
+    ("只有 body", f'<html><body>{_links(range(1, 4))}</body></html>'),
+    # 没有容器也没有 <body>：旧实现会在 None 上崩溃，新实现返回空列表
+    ("没有 body", f'<p>{_links(range(1, 3))}</p>'),
+    ("空页面", ''),
+]
+
+
+def test_parse_chapters_matches_legacy():
+    for name, html in TOC_FIXTURES:
+        soup = BeautifulSoup(html, 'html.parser')
+        got = crawler_instance._parse_chapters_from_soup(soup, BASE_URL)
+        try:
+            expected = legacy_parse_chapters(soup, BASE_URL)
+        except AttributeError:
+            expected = []  # 旧实现在 soup.body 为 None 时崩溃
+        assert got == expected, f"{name}: {got} != {expected}"
+
+
+def test_parse_chapters_picks_expected_container():
+    soup = BeautifulSoup(dict(TOC_FIXTURES)["数量相同取靠前"], 'html.parser')
+    urls = [c['url'] for c in crawler_instance._parse_chapters_from_soup(soup, BASE_URL)]
+    assert urls == [urljoin(BASE_URL, f"x{i}.html") for i in range(1, 4)]
+
+    soup = BeautifulSoup(dict(TOC_FIXTURES)["跳过导航容器"], 'html.parser')
+    urls = [c['url'] for c in crawler_instance._parse_chapters_from_soup(soup, BASE_URL)]
+    assert urls == [urljoin(BASE_URL, f"c{i}.html") for i in range(1, 4)]
+
+    soup = BeautifulSoup(dict(TOC_FIXTURES)["没有 body"], 'html.parser')
+    assert crawler_instance._parse_chapters_from_soup(soup, BASE_URL) == []
+
+
+# 作者夹具：(html, 期望的作者)
+AUTHOR_FIXTURES = [
+    ('<div><p>作者：张三</p></div>', '张三'),
+    ('<div><p><span>作者：</span>张三</p></div>', '张三'),
+    ('<div class="info"><span>作者:</span><a href="/a/1">李四</a></div>', '李四'),
+    ('<p>作者<b>：</b>王五</p>', '王五'),
+    ('<div><p>作者：</p></div>', '未知作者'),
+    ('<div><p>暂无信息</p></div>', '未知作者'),
+]
+
+
+def test_book_meta_author():
+    for html, expected in AUTHOR_FIXTURES:
+        soup = BeautifulSoup(html, 'html.parser')
+        assert crawler_instance._get_book_meta(soup, BASE_URL)['author'] == expected, html
+
+
+if __name__ == '__main__':
+    print("=" * 50)
+    print("目录解析 / 作者提取测试")
+    print("=" * 50)
+    for name, fn in list(globals().items()):
+        if name.startswith('test_') and callable(fn):
+            fn()
+            print(f"✅ {name}")
+    print("=" * 50)
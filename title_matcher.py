@@ -0,0 +1,146 @@
+"""
+章节标题模糊匹配 (TitleMatcher)
+
+换源时要在新源目录里找"和旧章节标题最像的一章"。原做法是对每一章都跑一次
+difflib.SequenceMatcher.ratio()，五千章的书一次换源就是五千次 O(n²) 比较。这里改为：
+1. 精确匹配：规范化标题 -> 首次出现位置 的字典，O(1)
+2. 候选收窄：字符 bigram 倒排索引 (短标题用单字) 按共享 gram 数取前若干个，
+   再并上目标章节号附近的一段窗口 (ID 错位通常只差几章)
+3. 打分：先用位并行 LCS 算出 ratio 的上界 (SequenceMatcher 的匹配块一定是公共子序列，
+   所以 2*LCS/(la+lb) >= ratio)，按上界从高到低逐个跑 SequenceMatcher，
+   上界不超过当前最好分数时直接停 —— 在候选集内与逐个比较的结果完全一致
+目录索引按 (目录 URL, 章节数, 末章 URL) 缓存，同一本书反复换源不重复建索引。
+"""
+import re
+import threading
+from collections import OrderedDict
+from difflib import SequenceMatcher
+
+_PREFIX_RE = re.compile(r'^(?:第)?\s*[0-9零一二三四五六七八九十百千万]+\s*[章节回卷\.]')
+_SPACE_RE = re.compile(r'[ 　\t\r\n]')
+
+
+def clean_chapter_title(t):
+    """去除 "第xxx章" 等前缀以及空白，只保留核心文字"""
+    t = _PREFIX_RE.sub('', str(t))
+    t = _SPACE_RE.sub('', t)
+    return t.strip()
+
+
+def lcs_length(a, b):
+    """位并行 LCS 长度 (Allison-Dix)：每个字符一次整数运算，短串比 DP 快一个数量级"""
+    if not a or not b: return 0
+    if len(a) < len(b): a, b = b, a
+    masks = {}
+    for i, ch in enumerate(b):
+        masks[ch] = masks.get(ch, 0) | (1 << i)
+    full = (1 << len(b)) - 1
+    v = full
+    for ch in a:
+        m = masks.get(ch)
+        if m:
+            u = v & m
+            v = ((v + u) | (v - u)) & full
+    return len(b) - bin(v).count('1')
+
+
+def ratio_upper_bound(a, b):
+    """SequenceMatcher(None, a, b).ratio() 的上界"""
+    total = len(a) + len(b)
+    return 2.0 * lcs_length(a, b) / total if total else 1.0
+
+
+def best_ratio(target, strings, candidates=None, threshold=0.0):
+    """
+    在 strings (可限定为 candidates 下标) 中找 SequenceMatcher ratio 最高且 > threshold 的一个
+    分数相同时取下标最小的 (与"顺序遍历 + 严格大于"的旧写法一致)
+    返回 (下标, 分数)，没有满足条件的返回 (None, 0.0)
+    """
+    idxs = range(len(strings)) if candidates is None else candidates
+    bounded = []
+    for i in idxs:
+        ub = ratio_upper_bound(target, strings[i])
+        if ub > threshold: bounded.append((-ub, i))
+    bounded.sort()
+    best_i, best_score = None, threshold
+    for neg_ub, i in bounded:
+        if -neg_ub < best_score: break
+        if -neg_ub == best_score and best_i is not None and i > best_i: continue
+        score = SequenceMatcher(None, target, strings[i]).ratio()
+        if score > best_score or (score == best_score and best_i is not None and i < best_i):
+            best_i, best_score = i, score
+    return best_i, (best_score if best_i is not None else 0.0)
+
+
+class ChapterTitleIndex:
+    """一份目录的标题索引"""
+    def __init__(self, chapters, window=30, top_k=60):
+        self.window = window      # 章节号附近取多少章作候选
+        self.top_k = top_k        # 倒排索引按共享 gram 数取前多少个
+        self.titles = []
+        self.exact = {}           # {规范化标题: 首次出现下标}
+        self.id_pos = {}          # {章节号: 首次出现下标}
+        self.grams = {}           # {gram: [下标, ...]}
+        for i, chap in enumerate(chapters):
+            t = clean_chapter_title(chap.get('name', '') or chap.get('title', ''))
+            self.titles.append(t)
+            if len(t) > 1: self.exact.setdefault(t, i)
+            cid = chap.get('id')
+            if isinstance(cid, int): self.id_pos.setdefault(cid, i)
+            for g in self._grams(t):
+                self.grams.setdefault(g, []).append(i)
+
+    @staticmethod
+    def _grams(t):
+        """bigram；三个字以内的短标题额外收单字，避免 "ab" / "axb" 这类没有共同 bigram 的漏召回"""
+        gs = {t[i:i + 2] for i in range(len(t) - 1)}
+        if len(t) <= 3: gs.update(t)
+        return gs
+
+    def candidates(self, clean_target, target_id=None):
+        counts = {}
+        grams = self._grams(clean_target)
+        if len(clean_target) > 3:
+            grams = grams | set(clean_target)  # 长目标也按单字兜底召回短标题
+        for g in grams:
+            weight = 2 if len(g) == 2 else 1
+            for i in self.grams.get(g, ()):
+                counts[i] = counts.get(i, 0) + weight
+        ranked = sorted(counts, key=lambda i: (-counts[i], i))[:self.top_k]
+        picked = set(ranked)
+        if target_id is not None and target_id in self.id_pos:
+            pos = self.id_pos[target_id]
+            picked.update(range(max(0, pos - self.window), min(len(self.titles), pos + self.window + 1)))
+        return sorted(picked)
+
+    def match(self, target_title, target_id=None, threshold=0.7):
+        """
+        返回 (下标, 分数, 是否精确)：精确匹配优先，其次候选集中 ratio 最高且 > threshold 的一章
+        """
+        clean_target = clean_chapter_title(target_title)
+        if not clean_target: return None, 0.0, False
+        if len(clean_target) > 1 and clean_target in self.exact:
+            return self.exact[clean_target], 1.0, True
+        i, score = best_ratio(clean_target, self.titles, self.candidates(clean_target, target_id), threshold)
+        return i, score, False
+
+
+_index_cache = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def get_title_index(toc_url, chapters, max_books=16):
+    """按 (目录 URL, 章节数, 末章 URL) 缓存索引，目录更新后自动重建"""
+    last = chapters[-1].get('url') if len(chapters) else None
+    key = (toc_url, len(chapters), last)
+    with _index_lock:
+        idx = _index_cache.get(key)
+        if idx is not None:
+            _index_cache.move_to_end(key)
+            return idx
+    idx = ChapterTitleIndex(chapters)
+    with _index_lock:
+        _index_cache[key] = idx
+        while len(_index_cache) > max_books:
+            _index_cache.popitem(last=False)
+    return idx
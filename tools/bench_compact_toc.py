@@ -0,0 +1,76 @@
+"""
+CompactToc 与 list[dict] 目录的内存 / 缓存体积 / 加载耗时对比
+
+用法: python tools/bench_compact_toc.py [章节数]
+"""
+import os
+import sys
+import json
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compact_toc import CompactToc, pack_toc, unpack_toc
+
+
+def make_chapters(n):
+    chapters = []
+    for i in range(1, n + 1):
+        raw = f"第{i}章 风起云涌之第{i % 97}回"
+        chapters.append({
+            'id': i,
+            'name': f"风起云涌之第{i % 97}回",
+            'raw_title': raw,
+            'title': raw,
+            'url': f"https://www.example-biquge.com/book/52449/{10000000 + i}.html",
+        })
+    return chapters
+
+
+def measure(builder):
+    tracemalloc.start()
+    obj = builder()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size
+
+
+def timed(fn, rounds=5):
+    best = float('inf')
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f"章节数: {n}")
+
+    plain_json = json.dumps({'title': 'bench', 'chapters': make_chapters(n)}, ensure_ascii=False)
+    compact_json = json.dumps(pack_toc({'title': 'bench', 'chapters': make_chapters(n)}), ensure_ascii=False)
+
+    plain, plain_mem = measure(lambda: json.loads(plain_json))
+    compact, compact_mem = measure(lambda: unpack_toc(json.loads(compact_json)))
+    assert isinstance(compact['chapters'], CompactToc)
+    assert compact['chapters'].to_list() == plain['chapters']
+
+    t_plain = timed(lambda: json.loads(plain_json))
+    t_compact = timed(lambda: unpack_toc(json.loads(compact_json)))
+    t_last_plain = timed(lambda: json.loads(plain_json)['chapters'][-1])
+    t_last_compact = timed(lambda: unpack_toc(json.loads(compact_json))['chapters'][-1])
+
+    def row(label, a, b, unit):
+        ratio = (1 - b / a) * 100 if a else 0
+        print(f"{label:<16}{a:>14.2f}{b:>14.2f} {unit:<4} 节省 {ratio:5.1f}%")
+
+    print(f"{'':<16}{'list[dict]':>14}{'CompactToc':>14}")
+    row("缓存文件", len(plain_json.encode()) / 1024, len(compact_json.encode()) / 1024, "KB")
+    row("常驻内存", plain_mem / 1024, compact_mem / 1024, "KB")
+    row("加载耗时", t_plain * 1000, t_compact * 1000, "ms")
+    row("加载+取末章", t_last_plain * 1000, t_last_compact * 1000, "ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+SQLite 混合读写压测：旧写法 (每次 connect、rollback journal) 与 sqlite_pool (WAL + pragma + 连接复用) 对比
+
+模拟进度同步：写线程不停 REPLACE 阅读进度 / 插入历史，读线程不停查书架和模块 JSON。
+用法:
+    python tools/bench_sqlite.py                      # 4 读 4 写，每种模式跑 5 秒
+    python tools/bench_sqlite.py --readers 8 --writers 2 --seconds 10
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE)
+from sqlite_pool import SQLitePool
+
+USERS = 50
+BOOKS = 40
+
+
+def init_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE user_books (username TEXT, book_key TEXT, value TEXT, PRIMARY KEY (username, book_key))")
+    conn.execute("CREATE TABLE user_modules (username TEXT, module_type TEXT, json_content TEXT, PRIMARY KEY (username, module_type))")
+    conn.execute("CREATE TABLE book_history (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, book_key TEXT, value TEXT, "
+                 "recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    for u in range(USERS):
+        for b in range(BOOKS):
+            conn.execute("INSERT INTO user_books VALUES (?, ?, ?)",
+                         (f"u{u}", f"book{b}", json.dumps({"url": f"https://example.com/{b}/1.html", "author": "某某"})))
+        conn.execute("INSERT INTO user_modules VALUES (?, 'stats', ?)",
+                     (f"u{u}", json.dumps({"daily_stats": {f"2025-01-{d:02d}": {"seconds": d * 60} for d in range(1, 29)}})))
+    conn.commit()
+    conn.close()
+
+
+def legacy_conn(path):
+    """原 get_db() 在请求外的写法"""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def reader(get_conn, done_conn, stop, counter, errors, seed):
+    rnd = random.Random(seed)
+    n = 0
+    while not stop.is_set():
+        u = f"u{rnd.randrange(USERS)}"
+        try:
+            conn = get_conn()
+            conn.execute("SELECT book_key, value FROM user_books WHERE username=?", (u,)).fetchall()
+            conn.execute("SELECT json_content FROM user_modules WHERE username=? AND module_type='stats'", (u,)).fetchone()
+            done_conn(conn)
+            n += 1
+        except sqlite3.OperationalError:
+            errors.append(1)
+    counter.append(n)
+
+
+def writer(get_conn, done_conn, stop, counter, errors, seed):
+    rnd = random.Random(seed)
+    n = 0
+    while not stop.is_set():
+        u, b = f"u{rnd.randrange(USERS)}", f"book{rnd.randrange(BOOKS)}"
+        value = json.dumps({"url": f"https://example.com/{b}/{rnd.randrange(3000)}.html"})
+        try:
+            conn = get_conn()
+            with conn:
+                conn.execute("REPLACE INTO user_books VALUES (?, ?, ?)", (u, b, value))
+                conn.execute("INSERT INTO book_history (username, book_key, value) VALUES (?, ?, ?)", (u, b, value))
+            done_conn(conn)
+            n += 1
+        except sqlite3.OperationalError:
+            errors.append(1)
+    counter.append(n)
+
+
+def run(mode, readers, writers, seconds):
+    tmp = tempfile.mkdtemp(prefix='bench_sqlite_')
+    path = os.path.join(tmp, 'data.sqlite')
+    init_db(path)
+    pool = None
+    if mode == 'legacy':
+        get_conn, done_conn = (lambda: legacy_conn(path)), (lambda c: c.close())
+    else:
+        pool = SQLitePool(path, row_factory=sqlite3.Row, max_idle=readers + writers)
+        get_conn, done_conn = pool.get, (lambda c: c.close())  # 和调用方一样 close()，池化连接不会真关
+
+    stop = threading.Event()
+    reads, writes, errors = [], [], []
+    threads = [threading.Thread(target=reader, args=(get_conn, done_conn, stop, reads, errors, i)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(get_conn, done_conn, stop, writes, errors, 100 + i)) for i in range(writers)]
+    for t in threads: t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads: t.join()
+
+    journal = sqlite3.connect(path).execute("PRAGMA journal_mode").fetchone()[0]
+    print(f"[{mode:6}] journal={journal:8} 读 {sum(reads) / seconds:9.0f} 次/s  写 {sum(writes) / seconds:8.0f} 次/s  "
+          f"锁超时 {len(errors)}")
+    if pool is not None:
+        pool.close_all()
+        print(f"         连接池: {pool.stats()}")
+    return sum(reads), sum(writes)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--readers', type=int, default=4)
+    ap.add_argument('--writers', type=int, default=4)
+    ap.add_argument('--seconds', type=float, default=5)
+    args = ap.parse_args()
+    print(f"{args.readers} 读线程 / {args.writers} 写线程，每种模式 {args.seconds:g}s")
+    r0, w0 = run('legacy', args.readers, args.writers, args.seconds)
+    r1, w1 = run('pooled', args.readers, args.writers, args.seconds)
+    print(f"吞吐对比: 读 {r1 / max(r0, 1):.1f}x  写 {w1 / max(w0, 1):.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+换源章节匹配：逐章 SequenceMatcher (旧) 与 title_matcher 索引匹配 (新) 的耗时 / 结果一致性对比
+
+用法:
+    python tools/bench_title_match.py                 # 使用 cache/ 下章节数 >= 1000 的真实目录，没有则生成
+    python tools/bench_title_match.py a.json b.json   # 指定目录缓存文件
+    python tools/bench_title_match.py --synthetic 5000
+"""
+import os
+import sys
+import json
+import time
+import random
+
+BASE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE)
+from difflib import SequenceMatcher
+from compact_toc import unpack_toc
+from title_matcher import ChapterTitleIndex, clean_chapter_title, best_ratio
+
+CHARS = "天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳云腾致雨露结为霜金生丽水玉出昆冈剑号巨阙珠称夜光"
+
+
+def reference_match(chapters, target_title):
+    """find_best_match 旧实现的标题匹配部分 (逐章比较)"""
+    clean_target = clean_chapter_title(target_title)
+    if not clean_target: return None
+    best_ratio_, best_idx = 0, None
+    for i, chap in enumerate(chapters):
+        clean_chap = clean_chapter_title(chap.get('name', '') or chap.get('title', ''))
+        if clean_target == clean_chap and len(clean_target) > 1:
+            return i
+        ratio = SequenceMatcher(None, clean_target, clean_chap).ratio()
+        if ratio > 0.7 and ratio > best_ratio_:
+            best_ratio_, best_idx = ratio, i
+    return best_idx
+
+
+def synthetic_toc(n, seed=7):
+    rnd = random.Random(seed)
+    chapters = []
+    for i in range(1, n + 1):
+        name = ''.join(rnd.choice(CHARS) for _ in range(rnd.randint(3, 10)))
+        chapters.append({'id': i, 'name': name, 'title': f"第{i}章 {name}", 'url': f"https://example.com/1/{i}.html"})
+    return chapters
+
+
+def load_real_tocs(paths):
+    tocs = []
+    for p in paths:
+        try:
+            with open(p, 'r', encoding='utf-8') as f:
+                data = unpack_toc(json.load(f), as_list=True)
+            chapters = data.get('chapters') if isinstance(data, dict) else None
+            if isinstance(chapters, list) and len(chapters) >= 1000 and 'url' in chapters[0]:
+                tocs.append((os.path.basename(p), chapters))
+        except Exception:
+            continue
+    return tocs
+
+
+def mutate(title, rnd):
+    """模拟另一个源的标题：加后缀、删字、换字、编号错位"""
+    core = clean_chapter_title(title)
+    kind = rnd.randint(0, 4)
+    if kind == 0 or len(core) < 3: return title
+    if kind == 1: return core + "(修)"
+    if kind == 2:
+        k = rnd.randrange(len(core))
+        return core[:k] + core[k + 1:]
+    if kind == 3:
+        k = rnd.randrange(len(core))
+        return core[:k] + rnd.choice(CHARS) + core[k + 1:]
+    return f"第{rnd.randint(1, 9999)}章 {core}"
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    r = fn()
+    return r, time.perf_counter() - t0
+
+
+def bench(name, chapters, queries=200, seed=1):
+    rnd = random.Random(seed)
+    picks = [rnd.randrange(len(chapters)) for _ in range(queries)]
+    targets = [(mutate(chapters[i].get('title') or chapters[i].get('name', ''), rnd), chapters[i].get('id')) for i in picks]
+    # 另有一部分完全不存在的标题 (最坏情况：旧实现要扫完全表)
+    targets += [(''.join(rnd.choice(CHARS) for _ in range(6)), None) for _ in range(queries // 4)]
+
+    old, t_old = timed(lambda: [reference_match(chapters, t) for t, _ in targets])
+    index, t_build = timed(lambda: ChapterTitleIndex(chapters))
+    new, t_new = timed(lambda: [index.match(t, cid)[0] for t, cid in targets])
+
+    def score(t, i):
+        return None if i is None else SequenceMatcher(None, clean_chapter_title(t), index.titles[i]).ratio()
+
+    agree = ties = 0
+    diffs = []
+    for (t, _), a, b in zip(targets, old, new):
+        if a == b: agree += 1
+        elif score(t, a) == score(t, b): ties += 1  # 同分不同章：章节号窗口优先了离目标更近的那章
+        else: diffs.append((t, a, b))
+    print(f"[{name}] {len(chapters)} 章 / {len(targets)} 次查询")
+    print(f"  旧: 逐章比较       {t_old / len(targets) * 1000:8.2f} ms/次")
+    print(f"  新: 建索引 {t_build * 1000:.1f} ms + {t_new / len(targets) * 1000:8.3f} ms/次  "
+          f"加速 {t_old / max(t_new, 1e-9):.0f}x")
+    print(f"  结果一致 {agree}/{len(targets)}，同分不同章 {ties}，不一致 {len(diffs)}")
+    for t, a, b in diffs:
+        print(f"    不一致: {t!r} 旧={a} ({score(t, a)}) 新={b} ({score(t, b)})")
+    return not diffs
+
+
+def check_best_ratio(rounds=2000, seed=3):
+    """best_ratio 的剪枝结果必须与逐个 SequenceMatcher 完全一致 (_pick_best_match 用)"""
+    rnd = random.Random(seed)
+    for _ in range(rounds):
+        target = ''.join(rnd.choice(CHARS[:12]) for _ in range(rnd.randint(1, 8)))
+        strings = [''.join(rnd.choice(CHARS[:12]) for _ in range(rnd.randint(0, 8))) for _ in range(rnd.randint(1, 12))]
+        best, best_score = None, 0.0
+        for i, s in enumerate(strings):
+            r = SequenceMatcher(None, target, s).ratio()
+            if r > best_score: best, best_score = i, r
+        assert best_ratio(target, strings) == (best, best_score), (target, strings)
+    print(f"best_ratio 与逐个比较一致 ({rounds} 组)")
+
+
+def main():
+    args = sys.argv[1:]
+    if args[:1] == ['--synthetic']:
+        tocs = [('synthetic', synthetic_toc(int(args[1]) if len(args) > 1 else 5000))]
+    else:
+        paths = args
+        if not paths:
+            cache_dir = os.path.join(BASE, 'cache')
+            paths = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)] if os.path.isdir(cache_dir) else []
+        tocs = load_real_tocs(paths)[:5] or [('synthetic', synthetic_toc(5000))]
+
+    check_best_ratio()
+    ok = all([bench(name, chapters) for name, chapters in tocs])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()